@@ -9,21 +9,42 @@ FilePath: \security_agent\api\routes.py
 """
 API路由定义
 """
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, field_validator
 from typing import List, Optional, Dict, Any
 import datetime
+import json
+import logging
+import threading
 
 from security_agent.chains.security_agent_chain import SecurityAgentChain
 from security_agent.chains.sql_generator_chain import SQLGeneratorChain
 from security_agent.config import settings
+from security_agent.utils.admission import AdmissionController, AdmissionPolicy, AdmissionRejected
+from security_agent.utils.engine_registry import engine_registry
+from security_agent.utils.jobs import JobManager, JobStore
+from security_agent.utils.llm_cache import llm_cache
+from security_agent.utils.stream_detector import StreamDetector
+from security_agent.utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 延迟创建链时使用的锁，保证每个应用只创建一次
+_chain_lock = threading.Lock()
+
 class SecurityQuery(BaseModel):
     """安全查询请求模型"""
     query: str  # 用户自然语言查询，如"前8小时是否有网络安全攻击风险"
 
+class BatchSecurityQuery(BaseModel):
+    """批量安全查询请求模型，所有问题使用同一个时间窗口"""
+    questions: List[str]  # 如"是否有网络安全攻击风险"、"登录失败最多的IP有哪些"
+    time_query: Optional[str] = None  # 时间范围描述，如"前8小时"，默认从第一个问题中解析
+
 class TimeRange(BaseModel):
     """时间范围模型"""
     start_time: str
@@ -45,6 +66,22 @@ class RiskAnalysisResult(BaseModel):
     risk_type: Optional[str] = None
     analysis: str
     recommendations: List[str]
+    findings: List[Dict[str, Any]] = []  # 本地异常检测结果
+    timings: Dict[str, float] = {}  # 各阶段耗时（秒）
+
+class BatchAnswer(BaseModel):
+    """批量分析中单个问题的回答"""
+    question: str
+    answer: Optional[str] = None
+    error: Optional[str] = None  # 该问题回答失败时的错误信息
+
+class BatchAnalysisResult(BaseModel):
+    """批量分析结果模型"""
+    timestamp: datetime.datetime
+    time_range: str
+    findings: List[Dict[str, Any]] = []  # 本地异常检测结果，所有问题共享
+    answers: List[BatchAnswer]
+    timings: Dict[str, float] = {}  # 各阶段耗时（秒）
 
 class SecurityReport(BaseModel):
     """安全报告模型"""
@@ -54,6 +91,61 @@ class SecurityReport(BaseModel):
     report_content: str
     summary: str
 
+class SecurityEvent(BaseModel):
+    """流式检测输入的安全事件，字段与 SecurityLog 一致"""
+    timestamp: datetime.datetime
+    source_ip: Optional[str] = None
+    destination_ip: Optional[str] = None
+    event_type: Optional[str] = None
+    severity: Optional[str] = None
+    protocol: Optional[str] = None
+    source_port: Optional[int] = None
+    destination_port: Optional[int] = None
+    user_id: Optional[str] = None
+    action: Optional[str] = None
+    status: Optional[str] = None
+    bytes_sent: Optional[int] = None
+    bytes_received: Optional[int] = None
+    session_duration: Optional[int] = None
+    description: Optional[str] = None
+    raw_log: Optional[str] = None
+    
+    @field_validator("timestamp")
+    @classmethod
+    def to_utc(cls, value: datetime.datetime) -> datetime.datetime:
+        """统一转换为UTC时间，没有时区的时间视为UTC，同一批事件中带时区和不带时区的时间可以比较和排序"""
+        if value.tzinfo is None:
+            return value.replace(tzinfo=datetime.timezone.utc)
+        return value.astimezone(datetime.timezone.utc)
+
+class StreamAlert(BaseModel):
+    """流式检测告警模型"""
+    rule: str
+    risk_type: str
+    risk_level: str
+    key_type: str
+    key: str
+    timestamp: datetime.datetime
+    evidence: Dict[str, Any]
+    description: str
+
+class EventIngestResult(BaseModel):
+    """事件处理结果模型"""
+    processed: int
+    alerts: List[StreamAlert]
+
+class JobInfo(BaseModel):
+    """后台任务模型"""
+    id: str
+    job_type: str  # analyze 或 report
+    status: str  # pending、running、succeeded 或 failed
+    params: Dict[str, Any]
+    result: Optional[Any] = None  # 与同步接口的返回相同
+    error: Optional[str] = None
+    created_at: datetime.datetime
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+
 class SQLQueryRequest(BaseModel):
     """SQL查询请求模型"""
     question: str  # 自然语言问题
@@ -66,30 +158,171 @@ class SQLQueryResult(BaseModel):
     result: Any
     answer: str
 
-def get_security_chain():
-    """获取安全代理链的依赖注入函数"""
-    config = {
-        "tongyi_api_key": settings.TONGYI_API_KEY,
-        "tongyi_model_name": settings.TONGYI_MODEL_NAME,
-        "tongyi_base_url": settings.TONGYI_BASE_URL,
-        "db_connection_string": settings.DB_CONNECTION_STRING,
-        "security_logs_table": settings.SECURITY_LOGS_TABLE
-    }
-    return SecurityAgentChain(config)
+def create_security_chain():
+    """创建安全代理链"""
+    return SecurityAgentChain(settings)
 
-def get_sql_chain():
-    """获取SQL生成链的依赖注入函数"""
+def create_sql_chain():
+    """创建SQL生成链并连接数据库"""
     sql_chain = SQLGeneratorChain(
         api_key=settings.TONGYI_API_KEY,
         table_name=settings.SECURITY_LOGS_TABLE,
         model_name=settings.TONGYI_MODEL_NAME,
-        base_url=settings.TONGYI_BASE_URL
+        base_url=settings.TONGYI_BASE_URL,
+        time_column=settings.SECURITY_LOGS_TIME_COLUMN
     )
     # 连接到数据库
-    sql_chain.connect_to_database(settings.DB_CONNECTION_STRING)
+    sql_chain.connect_to_database(settings.DB_CONNECTION_STRING, use_rollups=settings.ROLLUP_ENABLED)
     return sql_chain
 
-@router.post("/security/analyze", response_model=RiskAnalysisResult)
+# 应用状态中保存的链及其创建函数
+CHAIN_FACTORIES = {
+    "security_chain": create_security_chain,
+    "sql_chain": create_sql_chain,
+}
+
+def init_chains(app):
+    """应用启动时创建所有链并保存到 app.state
+    
+    创建失败时只记录日志，请求到来时会再次尝试创建。
+    """
+    for name in CHAIN_FACTORIES:
+        try:
+            _get_or_create_chain(app.state, name)
+        except Exception as e:
+            logger.error(f"启动时创建{name}失败，将在首次请求时重试: {e}")
+
+def close_chains(app):
+    """应用关闭时移除链，共享的LLM客户端由 llm_registry 统一关闭"""
+    for name in CHAIN_FACTORIES:
+        setattr(app.state, name, None)
+
+def _get_or_create_chain(state, name):
+    """从应用状态获取链，不存在时创建"""
+    chain = getattr(state, name, None)
+    if chain is None:
+        with _chain_lock:
+            chain = getattr(state, name, None)
+            if chain is None:
+                logger.info(f"创建{name}")
+                chain = CHAIN_FACTORIES[name]()
+                setattr(state, name, chain)
+    return chain
+
+def get_security_chain(request: Request):
+    """获取安全代理链的依赖注入函数"""
+    return _get_or_create_chain(request.app.state, "security_chain")
+
+def get_sql_chain(request: Request):
+    """获取SQL生成链的依赖注入函数"""
+    return _get_or_create_chain(request.app.state, "sql_chain")
+
+def create_stream_detector():
+    """创建流式检测引擎"""
+    return StreamDetector(
+        window_seconds=settings.STREAM_WINDOW_SECONDS,
+        idle_seconds=settings.STREAM_IDLE_SECONDS,
+        max_keys=settings.STREAM_MAX_KEYS
+    )
+
+def get_stream_detector(request: Request):
+    """获取流式检测引擎的依赖注入函数，整个应用共享一个引擎"""
+    state = request.app.state
+    detector = getattr(state, "stream_detector", None)
+    if detector is None:
+        with _chain_lock:
+            detector = getattr(state, "stream_detector", None)
+            if detector is None:
+                detector = create_stream_detector()
+                state.stream_detector = detector
+    return detector
+
+def create_job_manager(app):
+    """创建后台任务执行器，任务处理函数使用应用状态中的链"""
+    async def _analyze(params):
+        security_chain = _get_or_create_chain(app.state, "security_chain")
+        result = await security_chain.run(params["query"])
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return jsonable_encoder(result)
+    
+    async def _report(params):
+        sql_chain = _get_or_create_chain(app.state, "sql_chain")
+        report = await _build_security_report(SecurityReportRequest(**params), sql_chain)
+        return jsonable_encoder(report)
+    
+    return JobManager(
+        JobStore(settings.JOB_DB_PATH),
+        handlers={"analyze": _analyze, "report": _report},
+        concurrency={"analyze": settings.JOB_ANALYZE_CONCURRENCY, "report": settings.JOB_REPORT_CONCURRENCY},
+        poll_interval=settings.JOB_POLL_INTERVAL,
+        heartbeat_seconds=settings.JOB_HEARTBEAT_SECONDS,
+        retention_seconds=settings.JOB_RETENTION_HOURS * 3600
+    )
+
+def get_job_manager(request: Request):
+    """获取后台任务执行器的依赖注入函数，未启用后台任务时返回503"""
+    job_manager = getattr(request.app.state, "job_manager", None)
+    if job_manager is None:
+        raise HTTPException(status_code=503, detail="后台任务未启用")
+    return job_manager
+
+def create_admission_controller():
+    """创建准入控制器，交互式接口优先级最高，定时报告最低"""
+    def policy(concurrency, timeout, priority):
+        return AdmissionPolicy(concurrency, settings.ADMISSION_QUEUE_SIZE, timeout, priority)
+    
+    interactive = settings.ADMISSION_QUEUE_TIMEOUT
+    background = settings.ADMISSION_BACKGROUND_QUEUE_TIMEOUT
+    return AdmissionController(
+        {
+            "analyze": policy(settings.ADMISSION_ANALYZE_CONCURRENCY, interactive, 0),
+            "query": policy(settings.ADMISSION_ANALYZE_CONCURRENCY, interactive, 0),
+            "batch": policy(settings.ADMISSION_BATCH_CONCURRENCY, background, 1),
+            "report": policy(settings.ADMISSION_REPORT_CONCURRENCY, background, 1),
+            "scheduled_report": policy(settings.ADMISSION_SCHEDULED_REPORT_CONCURRENCY, background, 2),
+        },
+        max_concurrency=settings.ADMISSION_MAX_CONCURRENCY,
+        retry_after=settings.ADMISSION_RETRY_AFTER
+    )
+
+def get_admission_controller(request: Request):
+    """获取准入控制器，整个应用共享一个控制器，未启用准入控制时返回 None"""
+    if not settings.ADMISSION_ENABLED:
+        return None
+    state = request.app.state
+    controller = getattr(state, "admission_controller", None)
+    if controller is None:
+        with _chain_lock:
+            controller = getattr(state, "admission_controller", None)
+            if controller is None:
+                controller = create_admission_controller()
+                state.admission_controller = controller
+    return controller
+
+def admission(endpoint):
+    """申请接口执行名额的依赖，请求（包括流式响应）结束后归还名额
+    
+    未被准入时返回429（等待队列已满）或503（等待超时），并在 Retry-After 中给出建议的重试间隔。
+    """
+    async def dependency(request: Request):
+        controller = get_admission_controller(request)
+        if controller is None:
+            yield
+            return
+        try:
+            await controller.acquire(endpoint)
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=e.status_code, detail=f"服务繁忙，{e}", headers={"Retry-After": str(e.retry_after)}
+            )
+        try:
+            yield
+        finally:
+            controller.release(endpoint)
+    return dependency
+
+@router.post("/security/analyze", response_model=RiskAnalysisResult, dependencies=[Depends(admission("analyze"))])
 async def analyze_security_logs(query: SecurityQuery, security_chain: SecurityAgentChain = Depends(get_security_chain)):
     """分析网络安全日志"""
     try:
@@ -98,7 +331,32 @@ async def analyze_security_logs(query: SecurityQuery, security_chain: SecurityAg
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/security/report", response_model=SecurityReport)
+@router.post("/security/analyze/stream", dependencies=[Depends(admission("analyze"))])
+async def stream_security_analysis(query: SecurityQuery, security_chain: SecurityAgentChain = Depends(get_security_chain)):
+    """流式分析网络安全日志（server-sent events）
+    
+    每个阶段完成时发送一个事件：time_range（时间范围）、data（数据量和统计）、findings（本地检测结果），
+    之后逐个发送模型生成的 token，最后发送 result（与 /security/analyze 的返回相同），出错时发送 error。
+    """
+    return _sse_response(security_chain.astream(query.query))
+
+@router.post("/security/analyze/batch", response_model=BatchAnalysisResult, dependencies=[Depends(admission("batch"))])
+async def analyze_security_batch(query: BatchSecurityQuery, security_chain: SecurityAgentChain = Depends(get_security_chain)):
+    """批量分析同一时间窗口的多个问题
+    
+    只解析一次时间范围并取回一次数据，各问题基于共享的统计、检测结果和日志样本并发回答。
+    """
+    if not query.questions:
+        raise HTTPException(status_code=400, detail="问题列表不能为空")
+    if len(query.questions) > settings.ANALYSIS_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"问题数不能超过 {settings.ANALYSIS_BATCH_MAX_QUESTIONS}")
+    
+    result = await security_chain.run_batch(query.questions, query.time_query)
+    if "error" in result:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
+@router.post("/security/report", response_model=SecurityReport, dependencies=[Depends(admission("report"))])
 async def generate_security_report(
     request: SecurityReportRequest, 
     sql_chain: SQLGeneratorChain = Depends(get_sql_chain)
@@ -112,47 +370,105 @@ async def generate_security_report(
     - attack: 网络攻击事件报告
     """
     try:
-        # 如果提供了自定义时间范围，使用自定义时间范围
-        if request.custom_time_range:
-            time_range = {
-                "start_time": request.custom_time_range.start_time,
-                "end_time": request.custom_time_range.end_time,
-                "description": request.custom_time_range.description or f"自定义时间范围的{request.report_type}安全报告",
-                "formatted_range": f"从 {request.custom_time_range.start_time} 到 {request.custom_time_range.end_time}"
-            }
-            report_content = await sql_chain.analyze_security_logs(
-                time_range["description"], 
-                time_range
-            )
-        else:
-            # 否则使用小时数生成报告
-            report_content = await sql_chain.scheduled_security_report(
-                report_type=request.report_type,
-                hours=request.hours
-            )
-        
-        # 提取报告摘要（取前200个字符）
-        summary = report_content[:200] + "..." if len(report_content) > 200 else report_content
-        
-        # 构建时间范围字符串
-        if request.custom_time_range:
-            time_range_str = f"从 {request.custom_time_range.start_time} 到 {request.custom_time_range.end_time}"
-        else:
-            now = datetime.datetime.now()
-            past_time = now - datetime.timedelta(hours=request.hours)
-            time_range_str = f"从 {past_time.strftime('%Y-%m-%d %H:%M:%S')} 到 {now.strftime('%Y-%m-%d %H:%M:%S')}"
-        
-        return SecurityReport(
-            timestamp=datetime.datetime.now(),
+        return await _build_security_report(request, sql_chain)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _build_security_report(request, sql_chain):
+    """生成安全报告，供同步接口和后台任务使用"""
+    # 如果提供了自定义时间范围，使用自定义时间范围
+    if request.custom_time_range:
+        time_range = {
+            "start_time": request.custom_time_range.start_time,
+            "end_time": request.custom_time_range.end_time,
+            "description": request.custom_time_range.description or f"自定义时间范围的{request.report_type}安全报告",
+            "formatted_range": f"从 {request.custom_time_range.start_time} 到 {request.custom_time_range.end_time}"
+        }
+        report_content = await sql_chain.analyze_security_logs(
+            time_range["description"], 
+            time_range
+        )
+    else:
+        # 否则使用小时数生成报告，显示报告实际使用的时间范围
+        time_range = sql_chain.recent_time_range(request.hours)
+        report_content = await sql_chain.scheduled_security_report(
             report_type=request.report_type,
-            time_range=time_range_str,
-            report_content=report_content,
-            summary=summary
+            hours=request.hours,
+            time_range=time_range
         )
+    
+    return SecurityReport(
+        timestamp=datetime.datetime.now(),
+        report_type=request.report_type,
+        time_range=f"从 {time_range['start_time']} 到 {time_range['end_time']}",
+        report_content=report_content,
+        summary=_report_summary(report_content)
+    )
+
+@router.post("/security/report/stream", dependencies=[Depends(admission("report"))])
+async def stream_security_report(
+    request: SecurityReportRequest, 
+    sql_chain: SQLGeneratorChain = Depends(get_sql_chain)
+):
+    """流式生成安全报告（server-sent events）
+    
+    依次发送 time_range（时间范围）、sql（查询）、rows（数据量）事件，之后逐个发送报告的 token，
+    最后发送 result（与 /security/report 的返回相同），出错时发送 error。
+    """
+    return _sse_response(_report_events(request, sql_chain))
+
+async def _report_events(request, sql_chain):
+    """生成报告的流式事件，将最终结果转换为 SecurityReport"""
+    if request.custom_time_range:
+        # 自定义时间范围生成一般安全报告，与 /security/report 一致
+        report_type = "general"
+        time_range = {
+            "start_time": request.custom_time_range.start_time,
+            "end_time": request.custom_time_range.end_time
+        }
+    else:
+        report_type = request.report_type
+        time_range = None
+    
+    async for event, payload in sql_chain.astream_report(report_type, time_range, hours=request.hours):
+        if event == "time_range":
+            time_range = payload
+        elif event == "result":
+            payload = SecurityReport(
+                timestamp=datetime.datetime.now(),
+                report_type=request.report_type,
+                time_range=f"从 {time_range['start_time']} 到 {time_range['end_time']}",
+                report_content=payload["report_content"],
+                summary=_report_summary(payload["report_content"])
+            )
+        yield event, payload
+
+def _report_summary(report_content):
+    """提取报告摘要（取前200个字符）"""
+    return report_content[:200] + "..." if len(report_content) > 200 else report_content
+
+def _sse_event(event, data):
+    """格式化一条 server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False, default=str)}\n\n"
+
+async def _sse_stream(events):
+    """将 (事件, 数据) 异步迭代器转换为SSE文本，出错时发送 error 事件"""
+    try:
+        async for event, data in events:
+            yield _sse_event(event, data)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"流式输出失败: {e}")
+        yield _sse_event("error", {"detail": str(e)})
+
+def _sse_response(events):
+    """SSE响应，关闭代理缓冲，使每个事件立即发送"""
+    return StreamingResponse(
+        _sse_stream(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-@router.post("/security/query", response_model=SQLQueryResult)
+@router.post("/security/query", response_model=SQLQueryResult, dependencies=[Depends(admission("query"))])
 async def query_security_database(
     request: SQLQueryRequest, 
     sql_chain: SQLGeneratorChain = Depends(get_sql_chain)
@@ -162,28 +478,33 @@ async def query_security_database(
         # 如果提供了时间范围，将其添加到问题中
         if request.time_range:
             question = f"{request.question}，时间范围从{request.time_range.start_time}到{request.time_range.end_time}"
+            time_range = {
+                "start_time": request.time_range.start_time,
+                "end_time": request.time_range.end_time
+            }
         else:
             question = request.question
+            time_range = None
         
-        # 生成SQL查询
-        sql_query = sql_chain.query_chain.invoke({"question": question})
+        # 生成SQL查询（优先使用模板）
+        rendered = await sql_chain.generate_query(time_range, question=request.question)
         
         # 执行查询
-        result = sql_chain.execute_tool.invoke({"query": sql_query})
+        result = await sql_chain.execute_query(rendered)
         
         # 生成回答
-        answer = await sql_chain.query_and_answer(question)
+        answer = await sql_chain.answer_question(question, rendered, result)
         
         return SQLQueryResult(
             question=question,
-            sql_query=sql_query,
+            sql_query=rendered.sql,
             result=result,
             answer=answer
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/security/scheduled_report/{report_type}")
+@router.get("/security/scheduled_report/{report_type}", dependencies=[Depends(admission("scheduled_report"))])
 async def scheduled_report(
     report_type: str = "general", 
     hours: int = 8,
@@ -198,18 +519,18 @@ async def scheduled_report(
     - attack: 网络攻击事件报告
     """
     try:
+        time_range = sql_chain.recent_time_range(hours)
         report_content = await sql_chain.scheduled_security_report(
             report_type=report_type,
-            hours=hours
+            hours=hours,
+            time_range=time_range
         )
         
         # 提取报告摘要
         summary = report_content[:200] + "..." if len(report_content) > 200 else report_content
         
-        # 构建时间范围字符串
-        now = datetime.datetime.now()
-        past_time = now - datetime.timedelta(hours=hours)
-        time_range_str = f"从 {past_time.strftime('%Y-%m-%d %H:%M:%S')} 到 {now.strftime('%Y-%m-%d %H:%M:%S')}"
+        # 报告实际使用的时间范围
+        time_range_str = f"从 {time_range['start_time']} 到 {time_range['end_time']}"
         
         return SecurityReport(
             timestamp=datetime.datetime.now(),
@@ -219,4 +540,79 @@ async def scheduled_report(
             summary=summary
         )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e)) 
+
+@router.post("/security/events", response_model=EventIngestResult)
+async def ingest_security_events(events: List[SecurityEvent], detector: StreamDetector = Depends(get_stream_detector)):
+    """
+    流式检测：按时间顺序处理一批安全事件，返回本批事件触发的告警
+    """
+    ordered = sorted(events, key=lambda event: event.timestamp)
+    alerts = detector.process_many(event.model_dump() for event in ordered)
+    return EventIngestResult(
+        processed=len(ordered),
+        alerts=[StreamAlert(**alert._asdict()) for alert in alerts]
+    )
+
+@router.get("/security/alerts")
+async def recent_stream_alerts(limit: int = 100, detector: StreamDetector = Depends(get_stream_detector)):
+    """
+    最近的流式检测告警和引擎运行统计
+    """
+    alerts = list(detector.recent_alerts)[-limit:] if limit > 0 else []
+    return {
+        "alerts": [StreamAlert(**alert._asdict()) for alert in reversed(alerts)],
+        "stats": detector.stats()
+    }
+
+@router.post("/jobs/analyze", response_model=JobInfo, status_code=202)
+async def submit_analysis_job(query: SecurityQuery, job_manager: JobManager = Depends(get_job_manager)):
+    """
+    提交安全分析任务，立即返回任务ID，通过 GET /jobs/{job_id} 查询状态和结果
+    """
+    return await job_manager.submit("analyze", query.model_dump())
+
+@router.post("/jobs/report", response_model=JobInfo, status_code=202)
+async def submit_report_job(request: SecurityReportRequest, job_manager: JobManager = Depends(get_job_manager)):
+    """
+    提交安全报告任务，立即返回任务ID，通过 GET /jobs/{job_id} 查询状态和结果
+    """
+    return await job_manager.submit("report", request.model_dump())
+
+@router.get("/jobs/{job_id}", response_model=JobInfo)
+async def get_job(job_id: str, job_manager: JobManager = Depends(get_job_manager)):
+    """
+    查询任务状态，任务完成后 result 与同步接口的返回相同，失败时 error 为错误信息
+    """
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job
+
+@router.get("/system/jobs")
+async def job_stats(job_manager: JobManager = Depends(get_job_manager)):
+    """后台任务统计：各任务类型的并发上限、本进程运行中的任务数和各状态的任务数"""
+    return await job_manager.stats()
+
+@router.get("/system/admission")
+async def admission_stats(request: Request):
+    """准入控制统计：各接口的并发上限、运行中和等待中的请求数、准入次数以及队列已满和等待超时的拒绝次数"""
+    controller = get_admission_controller(request)
+    if controller is None:
+        raise HTTPException(status_code=503, detail="准入控制未启用")
+    return controller.stats()
+
+@router.get("/system/db_pools")
+async def database_pool_stats():
+    """数据库连接池统计：连接池大小、已借出连接数、溢出连接数和获取连接的等待时间"""
+    return engine_registry.pool_stats()
+
+@router.get("/system/traces/slowest")
+async def slowest_traces(limit: int = 10):
+    """最近的请求中耗时最长的 limit 个 trace，包括每个阶段、LLM调用和数据库查询的 span"""
+    return tracer.slowest(max(0, limit))
+
+@router.get("/system/llm_cache")
+async def llm_cache_stats():
+    """LLM响应缓存统计：各命名空间的条目数、命中、未命中、写入、淘汰次数和命中率"""
+    return llm_cache.stats()
\ No newline at end of file
@@ -8,23 +8,38 @@ FilePath: \security_agent\chains\log_processor_chain.py
 '''
 """
 日志处理链
+
+默认在本地用 pandas 精确计算日志统计，只有显式开启 use_llm 时才把采样日志交给LLM处理。
 """
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 import json
 import logging
 
+from security_agent.utils.llm_clients import llm_registry
+from security_agent.utils.log_stats import compute_log_statistics
+from security_agent.utils.log_sampler import DEFAULT_TOKEN_BUDGET, sample_logs
+from security_agent.utils.metrics import llm_callbacks, timed_stage
+from security_agent.utils.prompt_codec import encode_logs
+
 logger = logging.getLogger(__name__)
 
 class LogProcessorChain:
     """日志处理链"""
     
-    def __init__(self, api_key, model_name="qwen-plus", base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"):
-        """初始化日志处理链"""
+    def __init__(self, api_key, model_name="qwen-plus", base_url="https://dashscope.aliyuncs.com/compatible-mode/v1", use_llm=False,
+                 sample_token_budget=DEFAULT_TOKEN_BUDGET):
+        """初始化日志处理链
+        
+        Args:
+            use_llm: 是否使用LLM生成统计信息，默认在本地计算
+            sample_token_budget: 交给LLM的日志样本的token预算
+        """
         logger.info("初始化日志处理链")
+        self.use_llm = use_llm
+        self.sample_token_budget = sample_token_budget
         
-        self.llm = ChatOpenAI(
+        self.llm = llm_registry.get_chat_model(
             model_name=model_name,
             api_key=api_key,
             base_url=base_url
@@ -32,10 +47,11 @@ class LogProcessorChain:
         
         # 定义日志处理提示模板
         self.processor_template = ChatPromptTemplate.from_template("""
-        你是一个安全日志处理专家。请分析以下JSON格式的安全日志数据，并生成摘要统计信息。
+        你是一个安全日志处理专家。请分析以下安全日志数据，并生成摘要统计信息。
         
         时间范围: {time_range}
-        日志数据: {logs_json}
+        日志数据（紧凑表格格式，repeat_count 为合并的重复日志条数）:
+        {logs_data}
         
         请提供以下信息：
         1. 日志总数
@@ -52,24 +68,23 @@ class LogProcessorChain:
         self.output_parser = JsonOutputParser()
         
         # 构建链
-        self.chain = self.processor_template | self.llm | self.output_parser
+        self.chain = (self.processor_template | self.llm | self.output_parser).with_config(callbacks=llm_callbacks("log_processor"))
     
+    @timed_stage("log_processor")
     async def process_logs(self, logs_df, time_range):
         """处理日志数据"""
         logger.info(f"处理日志数据，共 {len(logs_df)} 条记录")
         
-        # 将DataFrame转换为JSON
-        logs_json = logs_df.to_json(orient="records")
+        if not self.use_llm:
+            return compute_log_statistics(logs_df)
         
-        # 如果数据量太大，只取一部分样本
-        if len(logs_df) > 1000:
-            logger.info(f"日志数据量过大，采样 1000 条记录进行处理")
-            sample_df = logs_df.sample(1000)
-            logs_json = sample_df.to_json(orient="records")
+        # 在token预算内选取有代表性的日志样本，编码为紧凑的表格文本
+        sample_df = sample_logs(logs_df, token_budget=self.sample_token_budget)
+        logs_data = encode_logs(sample_df).text
         
         try:
             response = await self.chain.ainvoke({
-                "logs_json": logs_json,
+                "logs_data": logs_data,
                 "time_range": time_range
             })
             
@@ -77,12 +92,7 @@ class LogProcessorChain:
             return response
         except Exception as e:
             logger.error(f"日志处理失败: {e}")
-            # 如果处理失败，返回基本统计信息
-            basic_stats = {
-                "total_logs": len(logs_df),
-                "event_types": logs_df["event_type"].value_counts().to_dict() if "event_type" in logs_df.columns else {},
-                "unique_source_ips": logs_df["source_ip"].nunique() if "source_ip" in logs_df.columns else 0,
-                "unique_dest_ips": logs_df["destination_ip"].nunique() if "destination_ip" in logs_df.columns else 0,
-                "error": str(e)
-            }
+            # 如果处理失败，返回本地计算的统计信息
+            basic_stats = compute_log_statistics(logs_df)
+            basic_stats["error"] = str(e)
             return basic_stats
\ No newline at end of file
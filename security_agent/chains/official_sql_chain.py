@@ -1,19 +1,57 @@
 """
 官方SQL查询链 - 使用 LangChain 0.3 官方方法
 """
+import asyncio
 import logging
 import re
 from typing import Dict, Any, Optional, List
 
 from langchain.chains import create_sql_query_chain
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_openai import ChatOpenAI
-from langchain_community.utilities import SQLDatabase
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool
 
+from security_agent.config import settings
+from security_agent.utils.schema_registry import schema_registry
+from security_agent.utils.query_executor import QueryExecutor, AsyncQueryExecutor
+from security_agent.utils.llm_clients import llm_registry
+from security_agent.utils.llm_cache import namespaced_cache
+from security_agent.utils.metrics import llm_callbacks, timed_stage
+from security_agent.utils.tracing import tracer
+
 logger = logging.getLogger(__name__)
 
+def extract_sql(sql_text: str) -> str:
+    """从LLM输出中提取实际的SQL查询
+    
+    Args:
+        sql_text: 包含SQL查询的文本
+        
+    Returns:
+        提取出的SQL查询
+    """
+    logger.info(f"提取SQL查询，原始文本: {sql_text[:100]}...")
+    
+    # 尝试提取SQL代码块
+    sql_pattern = r"```sql\s*(.*?)\s*```"
+    matches = re.search(sql_pattern, sql_text, re.DOTALL)
+    if matches:
+        return matches.group(1).strip()
+    
+    # 尝试提取SQLQuery标记后的内容
+    if "SQLQuery:" in sql_text:
+        parts = sql_text.split("SQLQuery:")
+        if len(parts) > 1:
+            # 检查是否有代码块
+            code_matches = re.search(r"```\s*(.*?)\s*```", parts[1], re.DOTALL)
+            if code_matches:
+                return code_matches.group(1).strip()
+            # 否则取整个内容
+            return parts[1].strip()
+    
+    # 如果没有特定标记，返回原始文本
+    return sql_text
+
 class OfficialSQLChain:
     """使用LangChain官方方法的SQL查询链"""
     
@@ -37,21 +75,34 @@ class OfficialSQLChain:
         logger.info("初始化官方SQL查询链")
         
         # 初始化LLM
-        self.llm = ChatOpenAI(
+        self.llm = llm_registry.get_chat_model(
             api_key=api_key,
             model_name=model_name,
             base_url=base_url,
             temperature=temperature
         )
         
-        # 初始化数据库连接
-        self.db = SQLDatabase.from_uri(db_connection)
+        # SQL生成是确定性的，使用持久化的响应缓存
+        self.sql_llm = llm_registry.get_chat_model(
+            api_key=api_key,
+            model_name=model_name,
+            base_url=base_url,
+            temperature=temperature,
+            cache=namespaced_cache("sql_generation", settings.LLM_CACHE_SQL_TTL)
+        )
+        
+        # 初始化数据库连接（共享的表结构缓存）
+        self.db = schema_registry.get_database(db_connection)
         
         # 创建SQL查询工具
         self.execute_query_tool = QuerySQLDataBaseTool(db=self.db)
         
+        # 直接执行查询，返回带列名的结果
+        self.query_executor = QueryExecutor(self.db._engine)
+        self.async_query_executor = AsyncQueryExecutor.from_url(db_connection)
+        
         # 创建SQL查询链
-        self.sql_chain = create_sql_query_chain(self.llm, self.db)
+        self.sql_chain = create_sql_query_chain(self.sql_llm, self.db).with_config(callbacks=llm_callbacks("sql_generation"))
         
         # 创建回答提示模板
         self.answer_chain = self._create_answer_chain()
@@ -75,69 +126,49 @@ SQL查询: {query}
 """
         
         prompt = ChatPromptTemplate.from_template(template)
-        return prompt | self.llm | StrOutputParser()
+        return (prompt | self.llm | StrOutputParser()).with_config(callbacks=llm_callbacks("sql_answer"))
     
     def _create_query_and_answer_chain(self):
         """创建完整的查询和回答链"""
         def _get_result(inputs):
             """获取查询结果并转换为更友好的格式"""
             query = self._extract_sql(inputs["query"])
-            raw_result = self.execute_query_tool.invoke(query)
             
-            # 尝试将结果转换为更友好的格式
-            try:
-                # 如果结果是字符串形式的列表或元组
-                if raw_result.strip().startswith('[') and raw_result.strip().endswith(']'):
-                    import ast
-                    import pandas as pd
-                    
-                    # 解析结果
-                    parsed_result = ast.literal_eval(raw_result)
-                    
-                    # 如果是空列表，直接返回
-                    if not parsed_result:
-                        return {"result": "[]", **inputs}
-                    
-                    # 获取列名
-                    if query.lower().strip().startswith('select'):
-                        # 从查询中提取列名
-                        columns = self._extract_columns_from_query(query)
-                        
-                        # 如果无法从查询中提取列名，尝试从数据库获取
-                        if not columns and 'table_names_to_use' in inputs:
-                            table_info = self.db.get_table_info(inputs['table_names_to_use'])
-                            columns = self._extract_columns_from_table_info(table_info)
-                        
-                        # 如果仍然没有列名，使用默认列名
-                        if not columns:
-                            columns = [f"column_{i}" for i in range(len(parsed_result[0]))]
-                        
-                        # 确保列名数量与结果列数匹配
-                        if isinstance(parsed_result[0], (list, tuple)) and len(columns) > len(parsed_result[0]):
-                            columns = columns[:len(parsed_result[0])]
-                        
-                        # 创建DataFrame
-                        if isinstance(parsed_result[0], (list, tuple)):
-                            df = pd.DataFrame(parsed_result, columns=columns[:len(parsed_result[0])])
-                        else:
-                            # 处理单列结果
-                            df = pd.DataFrame({columns[0]: parsed_result})
-                        
-                        # 转换为JSON格式
-                        result_json = df.to_json(orient='records')
-                        return {"result": result_json, **inputs}
-            except Exception as e:
-                logger.warning(f"转换查询结果格式失败: {e}")
+            # 直接执行查询，列名来自游标描述，时间等类型不会丢失
+            with tracer.span("query_result"):
+                try:
+                    df = self.query_executor.fetch_dataframe(query)
+                except Exception as e:
+                    logger.warning(f"直接执行查询失败，使用查询工具返回错误信息: {e}")
+                    return {"result": self.execute_query_tool.invoke(query), **inputs}
             
-            # 如果转换失败，返回原始结果
-            return {"result": raw_result, **inputs}
+                return {"result": self._format_result(df), **inputs}
+        
+        async def _aget_result(inputs):
+            """异步获取查询结果"""
+            query = self._extract_sql(inputs["query"])
+            
+            with tracer.span("query_result"):
+                try:
+                    df = await self.async_query_executor.fetch_dataframe(query)
+                except Exception as e:
+                    logger.warning(f"直接执行查询失败，使用查询工具返回错误信息: {e}")
+                    return {"result": await asyncio.to_thread(self.execute_query_tool.invoke, query), **inputs}
+            
+                return {"result": self._format_result(df), **inputs}
         
         return (
             RunnablePassthrough.assign(query=self.sql_chain)
-            | RunnablePassthrough.assign(result=_get_result)
+            | RunnablePassthrough.assign(result=RunnableLambda(_get_result, afunc=_aget_result))
             | self.answer_chain
         )
     
+    def _format_result(self, df) -> str:
+        """将查询结果转换为JSON格式"""
+        if df.empty:
+            return "[]"
+        return df.to_json(orient='records', date_format='iso', force_ascii=False)
+    
     def _extract_sql(self, sql_text: str) -> str:
         """从LLM输出中提取实际的SQL查询
         
@@ -147,28 +178,9 @@ SQL查询: {query}
         Returns:
             提取出的SQL查询
         """
-        logger.info(f"提取SQL查询，原始文本: {sql_text[:100]}...")
-        
-        # 尝试提取SQL代码块
-        sql_pattern = r"```sql\s*(.*?)\s*```"
-        matches = re.search(sql_pattern, sql_text, re.DOTALL)
-        if matches:
-            return matches.group(1).strip()
-        
-        # 尝试提取SQLQuery标记后的内容
-        if "SQLQuery:" in sql_text:
-            parts = sql_text.split("SQLQuery:")
-            if len(parts) > 1:
-                # 检查是否有代码块
-                code_matches = re.search(r"```\s*(.*?)\s*```", parts[1], re.DOTALL)
-                if code_matches:
-                    return code_matches.group(1).strip()
-                # 否则取整个内容
-                return parts[1].strip()
-        
-        # 如果没有特定标记，返回原始文本
-        return sql_text
+        return extract_sql(sql_text)
     
+    @timed_stage("sql_generation")
     def generate_sql(self, question: str, table_names: Optional[List[str]] = None) -> str:
         """生成SQL查询
         
@@ -193,6 +205,7 @@ SQL查询: {query}
             logger.error(f"SQL查询生成失败: {e}")
             raise
     
+    @timed_stage("sql_execution")
     def execute_sql(self, sql_query: str) -> str:
         """执行SQL查询
         
@@ -216,6 +229,7 @@ SQL查询: {query}
             logger.error(f"SQL查询执行失败: {e}")
             raise
     
+    @timed_stage("sql_query_and_answer")
     def query_and_answer(self, question: str, table_names: Optional[List[str]] = None) -> str:
         """查询并回答
         
@@ -239,6 +253,72 @@ SQL查询: {query}
             logger.error(f"查询并回答失败: {e}")
             raise
     
+    @timed_stage("sql_generation")
+    async def agenerate_sql(self, question: str, table_names: Optional[List[str]] = None) -> str:
+        """异步生成SQL查询
+        
+        Args:
+            question: 用户问题
+            table_names: 要使用的表名列表
+        
+        Returns:
+            生成的SQL查询
+        """
+        logger.info(f"生成SQL查询，问题: {question}")
+        
+        inputs = {"question": question}
+        if table_names:
+            inputs["table_names_to_use"] = table_names
+        
+        try:
+            sql_query = await self.sql_chain.ainvoke(inputs)
+            logger.info(f"SQL查询生成成功: {sql_query[:100]}...")
+            return sql_query
+        except Exception as e:
+            logger.error(f"SQL查询生成失败: {e}")
+            raise
+    
+    async def aexecute_sql(self, sql_query: str) -> List[Dict[str, Any]]:
+        """异步执行SQL查询
+        
+        Args:
+            sql_query: SQL查询语句
+        
+        Returns:
+            查询结果，每条记录是一个字典
+        """
+        clean_sql = self._extract_sql(sql_query)
+        logger.info(f"提取的SQL查询: {clean_sql[:100]}...")
+        
+        try:
+            return await self.async_query_executor.fetch_records(clean_sql)
+        except Exception as e:
+            logger.error(f"SQL查询执行失败: {e}")
+            raise
+    
+    @timed_stage("sql_query_and_answer")
+    async def aquery_and_answer(self, question: str, table_names: Optional[List[str]] = None) -> str:
+        """异步查询并回答
+        
+        Args:
+            question: 用户问题
+            table_names: 要使用的表名列表
+        
+        Returns:
+            回答
+        """
+        logger.info(f"查询并回答，问题: {question}")
+        
+        inputs = {"question": question}
+        if table_names:
+            inputs["table_names_to_use"] = table_names
+        
+        try:
+            return await self.query_and_answer_chain.ainvoke(inputs)
+        except Exception as e:
+            logger.error(f"查询并回答失败: {e}")
+            raise
+    
     def get_table_info(self, table_names: Optional[List[str]] = None) -> str:
         """获取表信息
         
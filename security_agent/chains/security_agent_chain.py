@@ -1,21 +1,23 @@
 """
 安全代理主链 - 使用 LangChain 0.3
 """
-from datetime import datetime
+import asyncio
+from datetime import datetime, timedelta
 import logging
-from operator import itemgetter
 
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_openai import ChatOpenAI
-from langchain_community.utilities import SQLDatabase
-from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool
-from langchain.chains import create_sql_query_chain
+import pandas as pd
 
 from security_agent.chains.time_parser_chain import TimeRangeParserChain
 from security_agent.chains.log_processor_chain import LogProcessorChain
 from security_agent.chains.security_analysis_chain import SecurityAnalysisChain
+from security_agent.chains.sql_templates import SQLTemplateLibrary, dialect_from_url
+from security_agent.utils.query_executor import AsyncQueryExecutor
+from security_agent.utils.log_stats import fetch_log_statistics
+from security_agent.utils.rollups import RollupManager
+from security_agent.utils.singleflight import SingleFlight
+from security_agent.utils.pipeline import StageGraph
+from security_agent.utils.time_grammar import TIME_FORMAT, parse_time_expression, shift_time_range
+from security_agent.utils.anomaly_detector import DETECTION_COLUMNS, AnomalyDetector
 
 logger = logging.getLogger(__name__)
 
@@ -32,17 +34,21 @@ class SecurityAgentChain:
         base_url = config.TONGYI_BASE_URL
         db_connection = config.DB_CONNECTION_STRING
         security_logs_table = config.SECURITY_LOGS_TABLE
+        self.security_logs_table = security_logs_table
         
-        # 初始化LLM
-        self.llm = ChatOpenAI(
-            api_key=api_key,
-            model_name=model_name,
-            base_url=base_url
-        )
+        # 摘要模式下统计在数据库中聚合计算，只取回有限的明细样本
+        self.summary_mode = config.ANALYSIS_SUMMARY_MODE
+        self.detail_sample_size = config.ANALYSIS_DETAIL_SAMPLE_SIZE
+        
+        # 日志查询使用异步引擎，不阻塞事件循环
+        self.query_executor = AsyncQueryExecutor.from_url(db_connection)
         
-        # 初始化数据库连接
-        self.db = SQLDatabase.from_uri(db_connection)
-        self.execute_query_tool = QuerySQLDataBaseTool(db=self.db)
+        # 按小时汇总表，已汇总的完整小时直接读取汇总统计
+        self.rollups = RollupManager(
+            db_connection,
+            security_logs_table,
+            time_column=config.SECURITY_LOGS_TIME_COLUMN
+        ) if config.ROLLUP_ENABLED else None
         
         # 初始化各个子链
         self.time_parser = TimeRangeParserChain(
@@ -51,91 +57,345 @@ class SecurityAgentChain:
             base_url=base_url
         )
         
-        # 初始化SQL生成链
-        self.sql_chain = create_sql_query_chain(self.llm, self.db)
+        # 时间窗口查询使用SQL模板，不需要LLM生成
+        self.sql_templates = SQLTemplateLibrary(
+            security_logs_table,
+            time_column=config.SECURITY_LOGS_TIME_COLUMN,
+            dialect=dialect_from_url(db_connection)
+        )
         
         self.log_processor = LogProcessorChain(
             api_key=api_key,
             model_name=model_name,
-            base_url=base_url
+            base_url=base_url,
+            use_llm=config.LOG_STATS_USE_LLM,
+            sample_token_budget=config.LLM_SAMPLE_TOKEN_BUDGET
         )
         
         self.security_analyzer = SecurityAnalysisChain(
             api_key=api_key,
             model_name=model_name,
-            base_url=base_url
+            base_url=base_url,
+            sample_token_budget=config.LLM_SAMPLE_TOKEN_BUDGET,
+            detector=AnomalyDetector(time_column=config.SECURITY_LOGS_TIME_COLUMN),
+            short_circuit=config.ANOMALY_SHORT_CIRCUIT
         )
         
-        # 创建回答提示模板
-        self.answer_prompt = PromptTemplate.from_template(
-            """根据以下用户问题、SQL查询和查询结果，提供详细的安全分析。
-            
-            问题: {question}
-            时间范围: {time_range}
-            SQL查询: {query}
-            查询结果: {result}
-            
-            请提供专业的安全分析和建议:"""
-        )
-    
+        # 合并同一时间范围内进行中的分析和数据库查询，起止时间落在同一时间分桶内视为同一时间范围
+        self.inflight = SingleFlight()
+        self.coalesce_bucket_seconds = config.TIME_RANGE_CACHE_BUCKET_SECONDS
+        
+        # 解析时间范围的同时预取默认时间窗口，解析结果与之相差不超过一个时间分桶时直接使用
+        self.speculative_hours = config.ANALYSIS_SPECULATIVE_HOURS if config.ANALYSIS_SPECULATIVE_FETCH else None
+        self.speculative_tolerance = timedelta(seconds=config.TIME_RANGE_CACHE_BUCKET_SECONDS)
+        
+        # 批量问答时同时调用LLM的问题数
+        self.batch_concurrency = config.ANALYSIS_BATCH_CONCURRENCY
+        
     async def run(self, query):
-        """执行完整的分析流程"""
+        """执行完整的分析流程
+        
+        各阶段按依赖关系组成阶段图并发执行：解析时间范围的同时预取默认时间窗口的数据，
+        取回数据后本地检测和样本选取并发执行。结果的 timings 字段记录各阶段耗时（秒）。
+        分析只取决于解析出的时间范围，起止时间落在同一时间分桶内的并发请求合并为一次计算。
+        """
         logger.info(f"开始处理查询: {query}")
         
         try:
-            # 1. 解析时间范围
-            time_range = await self.time_parser.parse_time_range(query)
+            speculative_range = self._speculative_range(query)
+            matched = False
             
-            # 2. 生成SQL查询
-            sql_query = self.sql_chain.invoke({
-                "question": f"查询时间范围在 {time_range['start_time']} 到 {time_range['end_time']} 之间的安全日志",
-                "table_names_to_use": ["security_logs"]
-            })
+            def resolve_window(time_range):
+                nonlocal matched
+                window = self._match_speculative(time_range, speculative_range)
+                matched = window is not None
+                if not matched and speculative_range is not None:
+                    graph.cancel("speculative_fetch")
+                return window or time_range
             
-            # 3. 执行SQL查询获取日志数据
-            result = self.execute_query_tool.invoke(sql_query)
-            
-            # 将结果转换为DataFrame
-            import pandas as pd
-            import ast
-            try:
-                data = ast.literal_eval(result)
-                if isinstance(data, list) and len(data) > 0:
-                    # 获取列名
-                    columns = self.db.get_usable_column_names(table_names=["security_logs"])
-                    logs_df = pd.DataFrame(data, columns=columns[:len(data[0])] if isinstance(data[0], tuple) else None)
-                else:
-                    logs_df = pd.DataFrame([{"result": result}])
-            except:
-                logs_df = pd.DataFrame([{"result": result}])
+            async def analyze(window):
+                # 在本请求中等待预取结果，合并的分析只使用数据本身，不等待某个请求自己的阶段任务，
+                # 其中一个请求断开时不影响合并到同一次分析的其他请求
+                prefetched = await graph.result("speculative_fetch") if matched else None
+                return await self.inflight.do(
+                    self._inflight_key("analyze", window),
+                    lambda: self._analyze(window, prefetched)
+                )
             
-            # 4. 处理日志数据
-            processed_data = await self.log_processor.process_logs(logs_df, time_range["formatted_range"])
+            # 1. 解析时间范围，同时预取默认时间窗口的数据，并发请求共享同一次预取
+            graph = StageGraph("安全分析")
+            graph.add("time_range", lambda: self.time_parser.parse_time_range(query))
+            if speculative_range is not None:
+                graph.add("speculative_fetch", lambda: self._coalesced("speculative_fetch", speculative_range, self._prefetch))
+            graph.add("window", resolve_window, deps=["time_range"])
             
-            # 5. 安全分析
-            analysis_result = await self.security_analyzer.analyze_security(
-                processed_data, 
-                logs_df, 
-                time_range["formatted_range"]
-            )
+            # 2-6. 分析时间窗口内的日志
+            graph.add("analysis", analyze, deps=["window"])
+            result = await graph.run()
             
-            # 6. 格式化最终结果
-            final_result = {
-                "timestamp": datetime.now(),
-                "time_range": time_range["formatted_range"],
-                "has_risk": analysis_result["has_risk"],
-                "risk_level": analysis_result["risk_level"],
-                "risk_type": analysis_result.get("risk_type"),
-                "analysis": analysis_result["analysis"],
-                "recommendations": analysis_result["recommendations"]
-            }
+            final_result = dict(result.results["analysis"])
+            timings = {name: seconds for name, seconds in final_result.get("timings", {}).items() if name != "total"}
+            timings.update(result.timings)
+            final_result["timings"] = timings
             
             logger.info("查询处理完成")
             return final_result
-            
+        
         except Exception as e:
             logger.error(f"处理查询时出错: {str(e)}")
             return {
                 "error": f"处理查询时出错: {str(e)}",
                 "query": query
-            }
\ No newline at end of file
+            }
+    
+    async def run_batch(self, questions, time_query=None):
+        """批量回答同一时间窗口的多个问题
+        
+        只解析一次时间范围、取回一次数据并完成一次本地检测和样本选取，各问题基于共享的数据并发回答。
+        
+        Args:
+            questions: 问题列表
+            time_query: 用于解析时间范围的描述，默认使用第一个问题
+        """
+        logger.info(f"开始批量处理 {len(questions)} 个问题")
+        analyzer = self.security_analyzer
+        
+        try:
+            graph = StageGraph("批量分析")
+            # 1. 解析一次时间范围
+            graph.add("time_range", lambda: self.time_parser.parse_time_range(time_query or questions[0]))
+            # 2-4. 取回一次日志统计、明细样本和异常检测数据
+            graph.add("data", lambda time_range: self._fetch_data(time_range), deps=["time_range"])
+            # 5. 本地检测和样本选取在线程中并发执行
+            graph.add("findings", lambda data: asyncio.to_thread(analyzer.detect, data[1], data[2]), deps=["data"])
+            graph.add("sample", lambda data: asyncio.to_thread(analyzer.encode_sample, data[1]), deps=["data"])
+            # 6. 各问题基于共享的数据并发回答
+            graph.add("answers", lambda time_range, data, findings, sample: analyzer.answer_questions(
+                questions, data[0], time_range["formatted_range"], findings, sample,
+                max_concurrency=self.batch_concurrency
+            ), deps=["time_range", "data", "findings", "sample"])
+            result = await graph.run()
+            
+            logger.info("批量查询处理完成")
+            return {
+                "timestamp": datetime.now(),
+                "time_range": result.results["time_range"]["formatted_range"],
+                "findings": [finding._asdict() for finding in result.results["findings"]],
+                "answers": result.results["answers"],
+                "timings": result.timings
+            }
+        
+        except Exception as e:
+            logger.error(f"批量处理查询时出错: {str(e)}")
+            return {
+                "error": f"批量处理查询时出错: {str(e)}",
+                "questions": questions
+            }
+    
+    async def astream(self, query):
+        """流式执行分析流程
+        
+        依次产生 ("time_range", 时间范围)、("data", 数据统计)、("findings", 检测结果)、
+        若干 ("token", 文本片段) 和 ("result", 最终结果) 事件。
+        """
+        logger.info(f"开始流式处理查询: {query}")
+        time_range = await self.time_parser.parse_time_range(query)
+        yield "time_range", time_range
+        
+        processed_data, logs_df, detection_df = await self._fetch_data(time_range)
+        yield "data", {
+            "sample_rows": len(logs_df),
+            "detection_rows": len(detection_df) if detection_df is not None else len(logs_df),
+            "statistics": processed_data
+        }
+        
+        async for event, payload in self.security_analyzer.astream_analysis(
+            processed_data,
+            logs_df,
+            time_range["formatted_range"],
+            detection_df=detection_df
+        ):
+            if event == "result":
+                payload = self._format_result(time_range, payload)
+            yield event, payload
+        logger.info("流式查询处理完成")
+    
+    async def _analyze(self, time_range, prefetched=None):
+        """分析时间范围内的日志，返回带各阶段耗时的最终结果
+        
+        Args:
+            time_range: 时间范围
+            prefetched: 预取的数据，与 _fetch_data 的结果相同；为 None（未预取或预取失败）时重新查询
+        """
+        analyzer = self.security_analyzer
+        
+        async def fetch():
+            return prefetched if prefetched is not None else await self._fetch_data(time_range)
+        
+        graph = StageGraph("日志分析")
+        # 2-4. 取回日志统计、明细样本和异常检测数据
+        graph.add("data", fetch)
+        # 5. 本地检测和样本选取互不依赖，在线程中并发执行，不阻塞事件循环
+        graph.add("findings", lambda data: asyncio.to_thread(analyzer.detect, data[1], data[2]), deps=["data"])
+        graph.add("sample", lambda data: asyncio.to_thread(analyzer.encode_sample, data[1]), deps=["data"])
+        graph.add("llm_analysis", lambda data, findings, sample: analyzer.analyze_prepared(
+            data[0], time_range["formatted_range"], findings, sample
+        ), deps=["data", "findings", "sample"])
+        result = await graph.run()
+        
+        # 6. 格式化最终结果
+        final_result = self._format_result(time_range, result.results["llm_analysis"])
+        final_result["timings"] = result.timings
+        return final_result
+    
+    async def _prefetch(self, time_range):
+        """预取时间窗口的数据，失败时返回 None，由分析阶段重新查询"""
+        try:
+            return await self._fetch_data(time_range)
+        except Exception as e:
+            logger.warning(f"预取默认时间窗口失败: {e}")
+            return None
+    
+    def _speculative_range(self, query):
+        """预取的默认时间窗口：截止到当前时间的最近 speculative_hours 小时
+        
+        未开启预取，或问题中的时间描述在本地即可解析且窗口长度与默认窗口不同时返回 None，不做无用的预取。
+        """
+        if self.speculative_hours is None:
+            return None
+        explicit = parse_time_expression(query)
+        if explicit is not None and not self._has_default_length(explicit):
+            return None
+        end_time = datetime.now().replace(microsecond=0)
+        start_time = end_time - timedelta(hours=self.speculative_hours)
+        return {
+            "start_time": start_time.strftime(TIME_FORMAT),
+            "end_time": end_time.strftime(TIME_FORMAT),
+            "formatted_range": f"{start_time.strftime(TIME_FORMAT)} 至 {end_time.strftime(TIME_FORMAT)}"
+        }
+    
+    def _match_speculative(self, time_range, speculative_range):
+        """解析出的时间范围与预取窗口长度相同、结束时间相差不超过容差时，返回对齐到预取窗口的时间范围"""
+        if speculative_range is None or not self._has_default_length(time_range):
+            return None
+        
+        end = datetime.strptime(time_range["end_time"], TIME_FORMAT)
+        speculative_end = datetime.strptime(speculative_range["end_time"], TIME_FORMAT)
+        if abs(end - speculative_end) > self.speculative_tolerance:
+            return None
+        logger.info("时间范围与预取的默认窗口一致，使用预取的数据")
+        return shift_time_range(time_range, speculative_end - end)
+    
+    def _has_default_length(self, time_range):
+        """时间范围的长度是否与预取的默认窗口相同"""
+        try:
+            start = datetime.strptime(time_range["start_time"], TIME_FORMAT)
+            end = datetime.strptime(time_range["end_time"], TIME_FORMAT)
+        except (KeyError, TypeError, ValueError):
+            return False
+        return end - start == timedelta(hours=self.speculative_hours)
+    
+    async def _fetch_data(self, time_range):
+        """取回分析需要的数据，返回 (日志统计, 日志明细, 异常检测数据)
+        
+        异常检测数据达到查询条数上限时，日志统计中的 detection_truncated 为 True，
+        此时检测只覆盖时间窗口内最新的日志，不能据此跳过模型分析。
+        """
+        if self.summary_mode:
+            # 2-4. 在数据库中聚合计算整个时间窗口的统计，同时取回最新日志和高危日志作为明细样本，
+            # 以及异常检测需要的窄列数据
+            processed_data, logs_df, detection_df = await asyncio.gather(
+                self._coalesced("statistics", time_range, self._fetch_statistics),
+                self._coalesced("detail_sample", time_range, self._fetch_detail_sample),
+                self._coalesced("detection_frame", time_range, self._fetch_detection_frame)
+            )
+            return self._mark_truncated(processed_data, detection_df), logs_df, detection_df
+        
+        # 2-3. 使用时间窗口模板查询日志，完整的日志同时用于异常检测
+        logs_df = await self._coalesced("time_window", time_range, self._fetch_time_window)
+        
+        # 4. 处理日志数据
+        processed_data = await self.log_processor.process_logs(logs_df, time_range["formatted_range"])
+        return self._mark_truncated(processed_data, logs_df), logs_df, None
+    
+    def _mark_truncated(self, processed_data, detection_df):
+        """异常检测数据达到查询条数上限时在统计中标记，统计在合并的查询之间共享，标记在副本上"""
+        if len(detection_df) < self.sql_templates.default_limit or not isinstance(processed_data, dict):
+            return processed_data
+        logger.warning(f"异常检测数据达到 {self.sql_templates.default_limit} 条上限，只检测了最新的日志，不跳过模型分析")
+        return {**processed_data, "detection_truncated": True}
+    
+    def _format_result(self, time_range, analysis_result):
+        """将安全分析结果格式化为最终结果"""
+        return {
+            "timestamp": datetime.now(),
+            "time_range": time_range["formatted_range"],
+            "has_risk": analysis_result["has_risk"],
+            "risk_level": analysis_result["risk_level"],
+            "risk_type": analysis_result.get("risk_type"),
+            "analysis": analysis_result["analysis"],
+            "recommendations": analysis_result["recommendations"],
+            "findings": analysis_result.get("findings", [])
+        }
+    
+    async def _coalesced(self, name, time_range, fetch):
+        """同一时间窗口的相同查询同时进行时只执行一次"""
+        return await self.inflight.do(self._inflight_key(name, time_range), lambda: fetch(time_range))
+    
+    def _inflight_key(self, name, time_range):
+        """合并进行中请求的键，起止时间对齐到时间分桶；相对时间范围的请求相差几秒也能合并"""
+        try:
+            return (name, *(
+                int(datetime.strptime(time_range[key], TIME_FORMAT).timestamp()) // self.coalesce_bucket_seconds
+                for key in ("start_time", "end_time")
+            ))
+        except (KeyError, TypeError, ValueError):
+            return (name, time_range.get("start_time"), time_range.get("end_time"))
+    
+    async def _fetch_time_window(self, time_range):
+        """使用时间窗口模板取回时间范围内的日志"""
+        rendered = self.sql_templates.render("time_window", time_range)
+        logs_df = await self.query_executor.fetch_dataframe(
+            rendered.sql,
+            rendered.params,
+            parse_dates=[self.sql_templates.time_column]
+        )
+        if len(logs_df) >= self.sql_templates.default_limit:
+            logger.warning(f"查询结果达到 {self.sql_templates.default_limit} 条上限，统计结果可能不完整")
+        return logs_df
+    
+    async def _fetch_detail_sample(self, time_range):
+        """取回交给LLM的明细样本：最新日志和高危日志各 detail_sample_size 条，按 id 去重"""
+        queries = [
+            self.sql_templates.render(name, time_range, limit=self.detail_sample_size)
+            for name in ("time_window", "high_risk")
+        ]
+        frames = await asyncio.gather(*(
+            self.query_executor.fetch_dataframe(query.sql, query.params, parse_dates=[self.sql_templates.time_column])
+            for query in queries
+        ))
+        logs_df = pd.concat([frame for frame in frames if not frame.empty] or frames[:1], ignore_index=True)
+        if "id" in logs_df.columns:
+            logs_df = logs_df.drop_duplicates(subset="id", ignore_index=True)
+        return logs_df
+    
+    async def _fetch_detection_frame(self, time_range):
+        """取回整个时间窗口内异常检测需要的列"""
+        rendered = self.sql_templates.render("detection_window", time_range, columns=DETECTION_COLUMNS)
+        return await self.query_executor.fetch_dataframe(
+            rendered.sql,
+            rendered.params,
+            parse_dates=[self.sql_templates.time_column]
+        )
+    
+    async def _fetch_statistics(self, time_range):
+        """获取时间范围内的日志统计，优先读取汇总表"""
+        if self.rollups is not None:
+            try:
+                stats = await self.rollups.fetch_statistics(time_range)
+                if stats is not None:
+                    logger.info("使用按小时汇总表的统计结果")
+                    return stats
+            except Exception as e:
+                logger.warning(f"读取汇总表失败，回退到原始日志表: {e}")
+        return await fetch_log_statistics(self.query_executor, self.sql_templates, time_range)
\ No newline at end of file
@@ -1,22 +1,39 @@
 """
 安全分析链
 """
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+import asyncio
 import json
 import logging
 
+from security_agent.chains.sql_templates import ATTACK_EVENT_TYPES, HIGH_RISK_SEVERITIES
+from security_agent.utils.anomaly_detector import AnomalyDetector, findings_verdict
+from security_agent.utils.llm_clients import llm_registry
+from security_agent.utils.log_sampler import DEFAULT_TOKEN_BUDGET, sample_logs
+from security_agent.utils.metrics import llm_callbacks, timed_stage
+from security_agent.utils.prompt_codec import encode_logs
+
 logger = logging.getLogger(__name__)
 
 class SecurityAnalysisChain:
     """安全分析链"""
     
-    def __init__(self, api_key, model_name="qwen-max", base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"):
-        """初始化安全分析链"""
+    def __init__(self, api_key, model_name="qwen-max", base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+                 sample_token_budget=DEFAULT_TOKEN_BUDGET, detector=None, short_circuit=True):
+        """初始化安全分析链
+        
+        Args:
+            sample_token_budget: 日志样本的token预算
+            detector: 本地异常检测器，默认使用 AnomalyDetector()
+            short_circuit: 本地检测没有命中、统计中也没有高危日志和攻击事件时是否直接返回无风险结论，不调用LLM
+        """
         logger.info("初始化安全分析链")
+        self.sample_token_budget = sample_token_budget
+        self.detector = detector or AnomalyDetector()
+        self.short_circuit = short_circuit
         
-        self.llm = ChatOpenAI(
+        self.llm = llm_registry.get_chat_model(
             model_name=model_name,
             api_key=api_key,
             base_url=base_url
@@ -31,7 +48,10 @@ class SecurityAnalysisChain:
         日志统计摘要:
         {processed_data}
         
-        日志样本:
+        本地异常检测结果（基于整个时间窗口的规则检测）:
+        {anomaly_findings}
+        
+        日志样本（紧凑表格格式，repeat_count 为合并的重复日志条数）:
         {sample_logs}
         
         请根据以上信息，对网络安全状况进行分析。特别关注:
@@ -49,32 +69,195 @@ class SecurityAnalysisChain:
         # 创建解析器
         self.output_parser = JsonOutputParser()
         
-        # 构建链
-        self.chain = self.analysis_template | self.llm | self.output_parser
+        # 构建链，回调记录LLM耗时和 token 用量
+        callbacks = llm_callbacks("security_analysis")
+        self.chain = (self.analysis_template | self.llm | self.output_parser).with_config(callbacks=callbacks)
     
-    async def analyze_security(self, processed_data, logs_df, time_range):
-        """分析安全风险"""
+        # 流式输出时逐个返回模型生成的文本片段，结束后再解析JSON
+        self.stream_chain = (self.analysis_template | self.llm).with_config(callbacks=callbacks)
+    
+        # 批量问答提示模板，多个问题共享同一份统计、检测结果和日志样本
+        self.question_template = ChatPromptTemplate.from_template("""
+        你是一位网络安全专家，请根据指定时间范围内的网络安全日志回答用户的问题。
+        
+        问题: {question}
+        
+        时间范围: {time_range}
+        
+        日志统计摘要:
+        {processed_data}
+        
+        本地异常检测结果（基于整个时间窗口的规则检测）:
+        {anomaly_findings}
+        
+        日志样本（紧凑表格格式，repeat_count 为合并的重复日志条数）:
+        {sample_logs}
+        
+        请只根据以上信息回答问题，并给出具体的数据依据（如IP、次数、时间）；信息不足时说明缺少哪些数据。
+        """)
+        self.question_chain = (self.question_template | self.llm | StrOutputParser()).with_config(callbacks=callbacks)
+    
+    async def analyze_security(self, processed_data, logs_df, time_range, detection_df=None):
+        """分析安全风险
+        
+        Args:
+            processed_data: 日志摘要统计
+            logs_df: 日志明细，用于选取交给LLM的样本
+            time_range: 格式化的时间范围
+            detection_df: 异常检测使用的日志，默认使用 logs_df
+        """
         logger.info("开始安全风险分析")
         
-        # 获取日志样本
-        sample_logs = logs_df.head(50).to_string() if not logs_df.empty else "无日志数据"
+        # 本地异常检测，没有命中且统计中没有高危迹象时直接返回无风险结论，不需要选取样本
+        findings = self.detect(logs_df, detection_df)
+        if self.can_short_circuit(findings, processed_data):
+            logger.info("本地异常检测未发现风险，跳过模型分析")
+            return findings_verdict(findings)
+        
+        return await self.analyze_prepared(processed_data, time_range, findings, self.encode_sample(logs_df))
+    
+    def detect(self, logs_df, detection_df=None):
+        """本地异常检测，detection_df 默认使用 logs_df"""
+        return self.detector.detect(logs_df if detection_df is None else detection_df)
+    
+    def can_short_circuit(self, findings, processed_data):
+        """是否可以不调用LLM直接返回无风险结论
+        
+        规则检测只覆盖几类攻击模式，只有本地检测没有命中，且统计中没有高危日志和攻击类事件时才跳过模型分析；
+        统计缺少严重程度或事件类型分布、或者检测数据被截断（detection_truncated）时不跳过。
+        """
+        if not self.short_circuit or findings or not isinstance(processed_data, dict):
+            return False
+        if processed_data.get("detection_truncated"):
+            return False
+        severities = processed_data.get("severity_levels")
+        event_types = processed_data.get("event_types")
+        if not isinstance(severities, dict) or not isinstance(event_types, dict):
+            return False
+        return (not any(severities.get(severity) for severity in HIGH_RISK_SEVERITIES)
+                and not any(event_types.get(event_type) for event_type in ATTACK_EVENT_TYPES))
+    
+    def encode_sample(self, logs_df):
+        """在token预算内选取有代表性的日志样本，编码为紧凑的表格文本"""
+        sample_df = sample_logs(logs_df, token_budget=self.sample_token_budget)
+        return encode_logs(sample_df).text
+    
+    @timed_stage("security_analysis")
+    async def analyze_prepared(self, processed_data, time_range, findings, sample_text):
+        """使用已经完成的本地检测结果和日志样本分析安全风险
+        
+        检测和选取样本互不依赖，调用方可以并发执行后再调用本方法。
+        
+        Args:
+            processed_data: 日志摘要统计
+            time_range: 格式化的时间范围
+            findings: detect 的结果
+            sample_text: encode_sample 的结果
+        """
+        if self.can_short_circuit(findings, processed_data):
+            logger.info("本地异常检测未发现风险，跳过模型分析")
+            return findings_verdict(findings)
+        finding_dicts = [finding._asdict() for finding in findings]
         
         try:
-            response = await self.chain.ainvoke({
-                "processed_data": json.dumps(processed_data, indent=2, ensure_ascii=False),
-                "time_range": time_range,
-                "sample_logs": sample_logs
-            })
+            response = await self.chain.ainvoke(self._prompt_inputs(processed_data, time_range, finding_dicts, sample_text))
             
             logger.info("安全风险分析完成")
+            if isinstance(response, dict):
+                response["findings"] = finding_dicts
             return response
         except Exception as e:
             logger.error(f"安全风险分析失败: {e}")
-            # 返回一个默认的结果
-            return {
-                "has_risk": False,
-                "risk_level": "未知",
-                "risk_type": None,
-                "analysis": f"无法解析分析结果，请稍后重试。错误: {str(e)}",
-                "recommendations": ["检查系统日志", "联系安全团队"]
-            } 
\ No newline at end of file
+            return self._fallback(findings, e)
+    
+    @timed_stage("security_analysis")
+    async def answer_questions(self, questions, processed_data, time_range, findings, sample_text, max_concurrency=None):
+        """基于同一份统计、检测结果和日志样本并发回答多个问题
+        
+        Args:
+            questions: 问题列表
+            processed_data: 日志摘要统计
+            time_range: 格式化的时间范围
+            findings: detect 的结果
+            sample_text: encode_sample 的结果
+            max_concurrency: 同时调用LLM的问题数，None 表示不限制
+        
+        Returns:
+            与问题顺序一致的 {"question", "answer", "error"} 列表，单个问题失败不影响其他问题
+        """
+        logger.info(f"开始并发回答 {len(questions)} 个问题")
+        shared_inputs = self._prompt_inputs(processed_data, time_range, [finding._asdict() for finding in findings], sample_text)
+        answers = await self.question_chain.abatch(
+            [{**shared_inputs, "question": question} for question in questions],
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True
+        )
+        
+        results = []
+        for question, answer in zip(questions, answers):
+            if isinstance(answer, Exception):
+                logger.error(f"回答问题失败: {question} {answer}")
+                results.append({"question": question, "answer": None, "error": str(answer)})
+            else:
+                results.append({"question": question, "answer": answer, "error": None})
+        return results
+    
+    async def astream_analysis(self, processed_data, logs_df, time_range, detection_df=None):
+        """流式分析安全风险，参数与 analyze_security 相同
+        
+        依次产生 ("findings", 检测结果列表)、若干 ("token", 文本片段) 和 ("result", 分析结果) 事件，
+        can_short_circuit 为 True 时不产生 token 事件。
+        检测和样本编码在线程中执行，不阻塞事件循环中的其他流式请求。
+        """
+        logger.info("开始流式安全风险分析")
+        findings = await asyncio.to_thread(self.detect, logs_df, detection_df)
+        finding_dicts = [finding._asdict() for finding in findings]
+        yield "findings", finding_dicts
+        
+        if self.can_short_circuit(findings, processed_data):
+            logger.info("本地异常检测未发现风险，跳过模型分析")
+            yield "result", findings_verdict(findings)
+            return
+        
+        sample_text = await asyncio.to_thread(self.encode_sample, logs_df)
+        chunks = []
+        try:
+            async for chunk in self.stream_chain.astream(
+                self._prompt_inputs(processed_data, time_range, finding_dicts, sample_text)
+            ):
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    yield "token", chunk.content
+            response = self.output_parser.parse("".join(chunks))
+            if isinstance(response, dict):
+                response["findings"] = finding_dicts
+            logger.info("流式安全风险分析完成")
+        except Exception as e:
+            logger.error(f"流式安全风险分析失败: {e}")
+            response = self._fallback(findings, e)
+        yield "result", response
+    
+    def _prompt_inputs(self, processed_data, time_range, finding_dicts, sample_text):
+        """构造分析提示的输入"""
+        anomaly_findings = json.dumps(finding_dicts, ensure_ascii=False) if finding_dicts else "未发现异常"
+        if isinstance(processed_data, dict) and processed_data.get("detection_truncated"):
+            anomaly_findings += "\n（检测数据达到条数上限，只覆盖时间窗口内最新的日志，其余日志请结合统计摘要判断）"
+        return {
+            "processed_data": json.dumps(processed_data, indent=2, ensure_ascii=False),
+            "time_range": time_range,
+            "anomaly_findings": anomaly_findings,
+            "sample_logs": sample_text
+        }
+    
+    def _fallback(self, findings, error):
+        """模型分析失败时的结论，本地检测有命中时使用检测结果"""
+        if findings:
+            return findings_verdict(findings)
+        # 返回一个默认的结果
+        return {
+            "has_risk": False,
+            "risk_level": "未知",
+            "risk_type": None,
+            "analysis": f"无法解析分析结果，请稍后重试。错误: {str(error)}",
+            "recommendations": ["检查系统日志", "联系安全团队"]
+        }
\ No newline at end of file
@@ -1,77 +1,319 @@
 """
 SQL生成链 - 使用 LangChain 0.3
 """
+import json
+from datetime import datetime, timedelta
+from typing import Any, NamedTuple, Optional
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_community.utilities.sql_database import SQLDatabase
+from langchain_core.output_parsers import StrOutputParser
+from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool
+from langchain.chains import create_sql_query_chain
 import logging
 
+from security_agent.chains.official_sql_chain import extract_sql
+from security_agent.chains.sql_templates import SQLTemplateLibrary, RenderedQuery, REPORT_FILTERS, dialect_from_url
+from security_agent.utils.schema_registry import schema_registry
+from security_agent.config import settings
+from security_agent.utils.llm_clients import llm_registry
+from security_agent.utils.llm_cache import namespaced_cache
+from security_agent.utils.metrics import llm_callbacks, timed_stage
+from security_agent.utils.query_executor import AsyncQueryExecutor
+from security_agent.utils.rollups import RollupManager
+from security_agent.utils.time_grammar import parse_time_expression
+
 logger = logging.getLogger(__name__)
 
+# 报告类型名称
+REPORT_NAMES = {
+    "general": "一般安全概况报告",
+    "high_risk": "高风险安全事件报告",
+    "login_failure": "登录失败记录报告",
+    "attack": "网络攻击事件报告",
+}
+
+# 报告中使用的最大明细记录数
+REPORT_ROW_LIMIT = 500
+
+class ReportData(NamedTuple):
+    """报告使用的数据"""
+    query: str  # SQL查询或汇总表描述
+    result: Any  # 查询结果（字典列表）或汇总统计的JSON
+    source: str  # 数据来源：logs 或 rollup
+    rows: Optional[int]  # 返回的记录数，汇总统计时为统计的日志条数
+
 class SQLGeneratorChain:
     """SQL生成链"""
     
-    def __init__(self, api_key, table_name="security_logs", model_name="qwen-plus", base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"):
+    def __init__(self, api_key, table_name="security_logs", model_name="qwen-plus", base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+                 time_column="event_time"):
         """初始化SQL生成链"""
         logger.info(f"初始化SQL生成链，表名: {table_name}")
         
-        self.llm = ChatOpenAI(
+        self.llm = llm_registry.get_chat_model(
             model_name=model_name,
             api_key=api_key,
             base_url=base_url
         )
         
+        # SQL生成是确定性的，使用持久化的响应缓存
+        self.sql_llm = llm_registry.get_chat_model(
+            model_name=model_name,
+            api_key=api_key,
+            base_url=base_url,
+            cache=namespaced_cache("sql_generation", settings.LLM_CACHE_SQL_TTL)
+        )
+        
         self.table_name = table_name
+        self.time_column = time_column
+        
+        # SQL模板库，匹配到模板时不调用LLM
+        self.templates = SQLTemplateLibrary(table_name, time_column=time_column)
+        
+        # 数据库连接，由 connect_to_database 设置
+        self.db = None
+        self.execute_tool = None
+        self.query_chain = None
+        self.query_executor = None
+        self.rollups = None
         
-        # 定义SQL生成提示模板
-        self.sql_prompt = ChatPromptTemplate.from_template("""
-        你是一个SQL专家。请根据以下信息生成一个SQL查询：
+        # 定义报告和回答提示模板
+        self.report_prompt = ChatPromptTemplate.from_template("""
+        你是一位网络安全分析专家。请根据以下数据库查询结果撰写一份{report_name}。
+        
+        时间范围: {time_range}
+        SQL查询: {query}
+        查询结果: {result}
+        
+        报告应包括：安全概况、主要发现、风险评估和建议的应对措施。如果结果为空，请说明该时间范围内没有相关记录。
+        """)
+        self.report_chain = (self.report_prompt | self.llm | StrOutputParser()).with_config(callbacks=llm_callbacks("report"))
         
-        数据库表: {table_name}
-        时间范围: 从 {start_time} 到 {end_time}
+        self.answer_prompt = ChatPromptTemplate.from_template("""
+        根据以下信息回答用户的问题:
         
-        请生成一个SQL查询，查询该表中时间在指定范围内的所有记录，使用event_time字段作为时间字段，按event_time降序排序，限制返回10000条记录。
+        用户问题: {question}
+        SQL查询: {query}
+        查询结果: {result}
         
-        仅返回SQL查询语句，不要有其他解释。
+        请提供详细的回答，解释查询结果的含义。如果结果为空，请说明可能的原因。
         """)
+        self.answer_chain = (self.answer_prompt | self.llm | StrOutputParser()).with_config(callbacks=llm_callbacks("sql_answer"))
+    
+    def connect_to_database(self, db_connection, use_rollups=False):
+        """连接到数据库
+        
+        Args:
+            db_connection: 数据库连接字符串
+            use_rollups: 是否在报告中读取按小时汇总表
+        """
+        logger.info("SQL生成链连接数据库")
+        self.db = schema_registry.get_database(db_connection)
+        self.execute_tool = QuerySQLDataBaseTool(db=self.db)
+        self.query_chain = create_sql_query_chain(self.sql_llm, self.db).with_config(callbacks=llm_callbacks("sql_generation"))
+        self.query_executor = AsyncQueryExecutor.from_url(db_connection)
+        self.templates.dialect = dialect_from_url(db_connection)
+        if use_rollups:
+            self.rollups = RollupManager(db_connection, self.table_name, time_column=self.time_column)
+    
+    def render_template(self, report_type, time_range, **options):
+        """使用模板渲染SQL查询
+        
+        Args:
+            report_type: 报告类型或模板名称
+            time_range: 时间范围
+            options: 模板参数，如 limit、top_n
+        
+        Returns:
+            RenderedQuery
+        """
+        return self.templates.render(report_type, time_range, **options)
+    
+    @timed_stage("sql_generation")
+    async def generate_query(self, time_range=None, question=None, report_type=None):
+        """生成SQL查询，优先使用模板
+        
+        指定 report_type 或问题能够匹配模板时直接渲染模板，不调用LLM；
+        两者都未指定时使用时间窗口模板；自由形式的问题交给LLM生成。
+        问题匹配的明细模板最多返回 SQL_ANSWER_ROW_LIMIT 条记录，这些记录会交给LLM回答问题。
+        
+        Args:
+            time_range: 时间范围，未指定时使用问题中的时间描述，问题中没有时使用最近24小时
+            question: 自然语言问题
+            report_type: 报告类型或模板名称
+        
+        Returns:
+            RenderedQuery，LLM生成的查询没有绑定参数
+        """
+        if time_range is None and question is not None:
+            time_range = parse_time_expression(question)
+            if time_range is not None:
+                logger.info(f"问题中的时间范围: {time_range['formatted_range']}")
+        time_range = time_range or self.recent_time_range(24)
+        
+        if report_type is not None:
+            return self.render_template(report_type, time_range)
+        
+        if question is None:
+            return self.render_template("time_window", time_range)
+        
+        matched = self.templates.match(question)
+        if matched is not None:
+            name, options = matched
+            logger.info(f"问题匹配SQL模板: {name}")
+            return self.render_template(name, time_range, limit=settings.SQL_ANSWER_ROW_LIMIT, **options)
         
-        # 构建链
-        self.chain = self.sql_prompt | self.llm
+        if self.query_chain is None:
+            raise RuntimeError("自由形式的问题需要先调用 connect_to_database")
         
+        logger.info(f"问题未匹配模板，使用LLM生成SQL: {question}")
+        sql_query = await self.query_chain.ainvoke({"question": question})
+        return RenderedQuery(sql=extract_sql(sql_query), params={}, template=None)
+    
+    async def execute_query(self, rendered):
+        """异步执行渲染后的查询，返回字典列表形式的结果"""
+        if self.query_executor is None:
+            raise RuntimeError("执行查询前需要先调用 connect_to_database")
+        return await self.query_executor.fetch_records(rendered.sql, rendered.params)
+    
+    @timed_stage("sql_generation")
     async def generate_sql(self, time_range, table_schema, db_connection):
-        """生成SQL查询"""
+        """生成查询时间范围内所有记录的SQL
+        
+        直接渲染时间窗口模板，不调用LLM。
+        
+        Args:
+            time_range: 时间范围
+            table_schema: 表结构描述，保留参数以兼容旧的调用方式
+            db_connection: 数据库连接字符串，用于按方言内联参数
+        
+        Returns:
+            可直接执行的SQL文本
+        """
         logger.info(f"生成SQL查询，时间范围: {time_range['start_time']} 到 {time_range['end_time']}")
+        self.templates.dialect = dialect_from_url(db_connection)
+        return self.templates.to_literal_sql(self.render_template("time_window", time_range))
+    
+    async def scheduled_security_report(self, report_type="general", hours=8, time_range=None):
+        """生成最近若干小时的安全报告
+        
+        Args:
+            report_type: 报告类型，general、high_risk、login_failure 或 attack
+            hours: 报告时间范围（小时）
+            time_range: 报告实际使用的时间范围，未指定时使用 recent_time_range(hours)；
+                调用方需要显示时间范围时先调用 recent_time_range 再传入
+        
+        Returns:
+            报告内容
+        """
+        logger.info(f"生成{report_type}安全报告，时间范围: {hours}小时")
+        time_range = time_range or self.recent_time_range(hours)
+        return await self._generate_report(report_type, time_range)
+    
+    async def analyze_security_logs(self, description, time_range):
+        """生成指定时间范围的一般安全报告
+        
+        Args:
+            description: 时间范围描述
+            time_range: 包含 start_time、end_time 的时间范围
+        
+        Returns:
+            报告内容
+        """
+        logger.info(f"分析安全日志: {description}")
+        return await self._generate_report("general", time_range)
+    
+    async def query_and_answer(self, question, time_range=None):
+        """查询数据库并回答问题"""
+        logger.info(f"查询并回答，问题: {question}")
+        rendered = await self.generate_query(time_range, question=question)
+        result = await self.execute_query(rendered)
+        return await self.answer_question(question, rendered, result)
+    
+    @timed_stage("sql_answer")
+    async def answer_question(self, question, rendered, result):
+        """根据查询结果回答问题"""
+        return await self.answer_chain.ainvoke({
+            "question": question,
+            "query": rendered.sql,
+            "result": result
+        })
+    
+    async def astream_report(self, report_type="general", time_range=None, hours=8):
+        """流式生成安全报告
+        
+        依次产生 ("time_range", 时间范围)、("sql", 查询信息)、("rows", 数据量)、
+        若干 ("token", 文本片段) 和 ("result", {"report_content": 报告内容}) 事件。
+        
+        Args:
+            report_type: 报告类型
+            time_range: 时间范围，未指定时使用最近 hours 小时
+            hours: 报告时间范围（小时）
+        """
+        if time_range is None:
+            time_range = self.recent_time_range(hours)
+        yield "time_range", time_range
+        
+        data = await self._report_data(report_type, time_range)
+        yield "sql", {"query": data.query, "source": data.source}
+        yield "rows", {"count": data.rows, "source": data.source}
+        
+        chunks = []
+        async for chunk in self.report_chain.astream(self._report_inputs(report_type, time_range, data)):
+            if chunk:
+                chunks.append(chunk)
+                yield "token", chunk
+        yield "result", {"report_content": "".join(chunks)}
+    
+    @timed_stage("report")
+    async def _generate_report(self, report_type, time_range):
+        """执行报告模板查询并生成报告"""
+        data = await self._report_data(report_type, time_range)
+        return await self.report_chain.ainvoke(self._report_inputs(report_type, time_range, data))
+    
+    async def _report_data(self, report_type, time_range):
+        """执行报告模板查询，启用汇总表时完整的小时读取汇总表"""
+        template = self.templates.resolve(report_type)
+        if template is None:
+            raise ValueError(f"未知的报告类型: {report_type}")
+        
+        stats = await self._fetch_rollup_statistics(template, time_range)
+        if stats is not None:
+            return ReportData(
+                query=f"按小时汇总表 {self.rollups.rollup_table.name} 的统计结果",
+                result=json.dumps(stats, ensure_ascii=False),
+                source="rollup",
+                rows=stats.get("total_logs")
+            )
         
+        rendered = self.render_template(report_type, time_range, limit=REPORT_ROW_LIMIT)
+        records = await self.execute_query(rendered)
+        return ReportData(query=rendered.sql, result=records, source="logs", rows=len(records))
+    
+    def _report_inputs(self, report_type, time_range, data):
+        """构造报告提示的输入"""
+        return {
+            "report_name": REPORT_NAMES.get(report_type, f"{report_type}安全报告"),
+            "time_range": f"从 {time_range['start_time']} 到 {time_range['end_time']}",
+            "query": data.query,
+            "result": data.result
+        }
+    
+    async def _fetch_rollup_statistics(self, template, time_range):
+        """从按小时汇总表读取报告统计，不可用时返回 None"""
+        if self.rollups is None or template not in REPORT_FILTERS:
+            return None
         try:
-            # 创建临时数据库连接
-            db = SQLDatabase.from_uri(db_connection)
-            
-            # 获取表结构信息
-            table_info = db.get_table_info([self.table_name])
-            
-            # 生成查询
-            sql_query = await self.chain.ainvoke({
-                "table_name": self.table_name,
-                "start_time": time_range["start_time"],
-                "end_time": time_range["end_time"],
-                "table_info": table_info
-            })
-            
-            # 提取内容
-            if hasattr(sql_query, 'content'):
-                sql_query = sql_query.content
-            
-            logger.info(f"SQL查询生成成功: {sql_query}")
-            return sql_query
+            return await self.rollups.fetch_statistics(time_range, filters=REPORT_FILTERS[template])
         except Exception as e:
-            logger.error(f"SQL查询生成失败: {e}")
-            # 如果生成失败，返回默认SQL
-            default_sql = f"""
-            SELECT * FROM {self.table_name}
-            WHERE event_time >= '{time_range["start_time"]}'
-            AND event_time <= '{time_range["end_time"]}'
-            ORDER BY event_time DESC
-            LIMIT 10000
-            """
-            return default_sql.strip()
\ No newline at end of file
+            logger.warning(f"读取汇总表失败，回退到原始日志表: {e}")
+            return None
+    
+    def recent_time_range(self, hours):
+        """截止到当前时间的最近若干小时的时间范围"""
+        end_time = datetime.now().replace(microsecond=0)
+        start_time = end_time - timedelta(hours=hours)
+        return {
+            "start_time": start_time.strftime("%Y-%m-%d %H:%M:%S"),
+            "end_time": end_time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
@@ -0,0 +1,277 @@
+"""
+SQL模板库
+
+为常见的报告类型提供参数化的SQL模板（时间窗口、高风险事件、登录失败、网络攻击、
+最活跃源IP、按小时统计），在数据库中计算日志摘要统计的聚合模板，
+以及只取回异常检测所需列的窄查询模板，
+使用绑定参数而不是字符串拼接。
+匹配到模板时无需调用LLM生成SQL，自由形式的问题仍交给LLM处理。
+"""
+import re
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects import mysql, sqlite
+
+logger = logging.getLogger(__name__)
+
+# 报告类型使用的过滤条件
+HIGH_RISK_SEVERITIES = ("高", "严重")
+LOGIN_FAILURE_EVENT_TYPES = ("登录失败",)
+ATTACK_EVENT_TYPES = ("端口扫描", "DDoS攻击", "恶意软件检测", "防火墙警报", "权限提升")
+
+# 报告类型到模板名称的别名
+REPORT_TYPE_ALIASES = {
+    "general": "time_window",
+}
+
+# 报告类型对应的过滤条件（列名 -> 取值）
+REPORT_FILTERS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "time_window": {},
+    "high_risk": {"severity": HIGH_RISK_SEVERITIES},
+    "login_failure": {"event_type": LOGIN_FAILURE_EVENT_TYPES},
+    "attack": {"event_type": ATTACK_EVENT_TYPES},
+}
+
+# 问题关键词到模板名称的映射，按优先级排列；
+# 单独的"攻击"、"严重"等词常见于自由形式的问题（如"这些攻击有多严重"），只使用明确指向某类记录的短语
+TEMPLATE_KEYWORDS: List[Tuple[str, Tuple[str, ...]]] = [
+    ("top_source_ips", ("最活跃", "排名", "排行", "最多的源ip", "top")),
+    ("hourly_counts", ("每小时", "按小时", "小时分布", "趋势", "hourly", "per hour")),
+    ("login_failure", ("登录失败", "登陆失败", "失败的登录", "暴力破解", "login failure", "failed login")),
+    ("high_risk", ("高危", "高风险", "严重级别", "严重等级", "high risk", "critical")),
+    ("attack", ("攻击事件", "攻击记录", "攻击日志", "攻击告警", "网络攻击", "入侵事件", "入侵记录", "端口扫描",
+                "attack event", "intrusion")),
+]
+
+# 明细模板只按时间和固定条件过滤；问题中包含IP、统计或是非判断时模板无法回答，交给LLM生成SQL
+_FREE_FORM_RE = re.compile(
+    r"\d{1,3}(?:\.\d{1,3}){3}|最多|最少|多少|几次|几个|分布|平均|占比|比例|为什么|是否|有没有|有无|how many|\bwhy\b"
+)
+
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_TOP_N_RE = re.compile(r"前\s*(\d+)\s*(?:个|名|位)|top\s*(\d+)")
+
+HOUR_FORMAT = "%Y-%m-%d %H:00:00"
+_HOUR_EXPRESSIONS = {
+    "mysql": "DATE_FORMAT({column}, :hour_format)",
+    "sqlite": "strftime(:hour_format, {column})",
+}
+_DIALECTS = {
+    "mysql": mysql.dialect,
+    "sqlite": sqlite.dialect,
+}
+
+class RenderedQuery(NamedTuple):
+    """渲染后的SQL查询"""
+    sql: str
+    params: Dict[str, Any]
+    template: Optional[str] = None
+
+def dialect_from_url(db_connection: str) -> str:
+    """从数据库连接字符串中获取方言名称，如 mysql、sqlite"""
+    return make_url(db_connection).get_backend_name()
+
+def hour_bucket_expression(dialect: str, column: str) -> str:
+    """按小时截断时间的SQL表达式，使用 :hour_format 绑定参数（取值为 HOUR_FORMAT）"""
+    if dialect not in _HOUR_EXPRESSIONS:
+        raise ValueError(f"按小时统计不支持该数据库方言: {dialect}")
+    return _HOUR_EXPRESSIONS[dialect].format(column=check_identifier(column))
+
+def _contains_keyword(text_value: str, keyword: str) -> bool:
+    """判断文本是否包含关键词，英文关键词按单词边界匹配"""
+    if keyword.isascii():
+        return re.search(rf"\b{re.escape(keyword)}", text_value) is not None
+    return keyword in text_value
+
+def check_identifier(name: str) -> str:
+    """校验表名和列名，防止注入"""
+    if not _IDENTIFIER_RE.match(name):
+        raise ValueError(f"非法的SQL标识符: {name}")
+    return name
+
+class SQLTemplateLibrary:
+    """参数化SQL模板库"""
+    
+    def __init__(
+        self,
+        table_name: str,
+        time_column: str = "event_time",
+        dialect: str = "mysql",
+        default_limit: int = 10000
+    ):
+        """初始化模板库
+        
+        Args:
+            table_name: 安全日志表名
+            time_column: 时间字段名
+            dialect: 数据库方言，mysql 或 sqlite
+            default_limit: 明细查询默认返回的最大记录数
+        """
+        self.table_name = check_identifier(table_name)
+        self.time_column = check_identifier(time_column)
+        self.dialect = dialect
+        self.default_limit = default_limit
+        
+        self._builders = {
+            "time_window": self._time_window,
+            "high_risk": self._high_risk,
+            "login_failure": self._login_failure,
+            "attack": self._attack,
+            "top_source_ips": self._top_source_ips,
+            "hourly_counts": self._hourly_counts,
+            "summary_totals": self._summary_totals,
+            "event_type_counts": self._event_type_counts,
+            "severity_counts": self._severity_counts,
+            "detection_window": self._detection_window,
+        }
+    
+    @property
+    def names(self) -> List[str]:
+        """所有模板名称"""
+        return list(self._builders)
+    
+    def resolve(self, report_type: str) -> Optional[str]:
+        """将报告类型解析为模板名称，未知类型返回 None"""
+        name = REPORT_TYPE_ALIASES.get(report_type, report_type)
+        return name if name in self._builders else None
+    
+    def match(self, question: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """根据问题中的关键词匹配模板
+        
+        Args:
+            question: 自然语言问题
+        
+        Returns:
+            (模板名称, 模板参数)，无法匹配或问题超出明细模板的过滤能力时返回 None
+        """
+        lowered = question.lower()
+        for name, keywords in TEMPLATE_KEYWORDS:
+            if any(_contains_keyword(lowered, keyword) for keyword in keywords):
+                if name in REPORT_FILTERS and _FREE_FORM_RE.search(lowered):
+                    return None
+                options = {}
+                if name == "top_source_ips":
+                    top_match = _TOP_N_RE.search(lowered)
+                    if top_match:
+                        options["top_n"] = int(top_match.group(1) or top_match.group(2))
+                return name, options
+        return None
+    
+    def render(self, name: str, time_range: Dict[str, Any], **options) -> RenderedQuery:
+        """渲染模板
+        
+        Args:
+            name: 模板名称或报告类型
+            time_range: 包含 start_time 和 end_time 的时间范围
+            options: 模板参数，如 limit、top_n
+        
+        Returns:
+            渲染后的SQL和绑定参数
+        """
+        template = self.resolve(name)
+        if template is None:
+            raise ValueError(f"未知的SQL模板: {name}")
+        
+        params = {
+            "start_time": time_range["start_time"],
+            "end_time": time_range["end_time"],
+        }
+        sql = self._builders[template](params, **options)
+        return RenderedQuery(sql=sql, params=params, template=template)
+    
+    def to_literal_sql(self, rendered: RenderedQuery) -> str:
+        """将绑定参数按方言安全地内联，得到可直接执行的SQL文本"""
+        statement = text(rendered.sql).bindparams(**rendered.params)
+        dialect = _DIALECTS.get(self.dialect, sqlite.dialect)(paramstyle="named")
+        return str(statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    
+    def _where_time(self) -> str:
+        return f"{self.time_column} BETWEEN :start_time AND :end_time"
+    
+    def _in_clause(self, column: str, values: Sequence[str], params: Dict[str, Any]) -> str:
+        placeholders = []
+        for i, value in enumerate(values):
+            key = f"{column}_{i}"
+            params[key] = value
+            placeholders.append(f":{key}")
+        return f"{column} IN ({', '.join(placeholders)})"
+    
+    def _detail(self, params: Dict[str, Any], condition: Optional[str] = None, limit: Optional[int] = None) -> str:
+        params["limit"] = int(limit or self.default_limit)
+        where = self._where_time()
+        if condition:
+            where = f"{where} AND {condition}"
+        return (
+            f"SELECT * FROM {self.table_name} "
+            f"WHERE {where} "
+            f"ORDER BY {self.time_column} DESC "
+            f"LIMIT :limit"
+        )
+    
+    def _time_window(self, params, limit=None, **_):
+        return self._detail(params, limit=limit)
+    
+    def _high_risk(self, params, limit=None, **_):
+        return self._detail(params, self._in_clause("severity", HIGH_RISK_SEVERITIES, params), limit)
+    
+    def _login_failure(self, params, limit=None, **_):
+        return self._detail(params, self._in_clause("event_type", LOGIN_FAILURE_EVENT_TYPES, params), limit)
+    
+    def _attack(self, params, limit=None, **_):
+        return self._detail(params, self._in_clause("event_type", ATTACK_EVENT_TYPES, params), limit)
+    
+    def _detection_window(self, params, columns=(), limit=None, **_):
+        selected = [self.time_column] + [check_identifier(name) for name in columns if name != self.time_column]
+        params["limit"] = int(limit or self.default_limit)
+        return (
+            f"SELECT {', '.join(selected)} FROM {self.table_name} "
+            f"WHERE {self._where_time()} "
+            f"ORDER BY {self.time_column} DESC "
+            f"LIMIT :limit"
+        )
+    
+    def _top_source_ips(self, params, top_n=10, **_):
+        params["top_n"] = int(top_n)
+        return (
+            f"SELECT source_ip, COUNT(*) AS event_count FROM {self.table_name} "
+            f"WHERE {self._where_time()} "
+            f"GROUP BY source_ip "
+            f"ORDER BY event_count DESC, source_ip "
+            f"LIMIT :top_n"
+        )
+    
+    def _hourly_counts(self, params, **_):
+        hour_expression = hour_bucket_expression(self.dialect, self.time_column)
+        params["hour_format"] = HOUR_FORMAT
+        return (
+            f"SELECT {hour_expression} AS hour_bucket, COUNT(*) AS event_count FROM {self.table_name} "
+            f"WHERE {self._where_time()} "
+            f"GROUP BY hour_bucket "
+            f"ORDER BY hour_bucket"
+        )
+
+    def _summary_totals(self, params, **_):
+        return (
+            f"SELECT COUNT(*) AS total_logs, "
+            f"COUNT(DISTINCT source_ip) AS unique_source_ips, "
+            f"COUNT(DISTINCT destination_ip) AS unique_dest_ips "
+            f"FROM {self.table_name} "
+            f"WHERE {self._where_time()}"
+        )
+    
+    def _event_type_counts(self, params, **_):
+        return self._group_counts(params, "event_type")
+    
+    def _severity_counts(self, params, **_):
+        return self._group_counts(params, "severity")
+    
+    def _group_counts(self, params, column):
+        return (
+            f"SELECT {column}, COUNT(*) AS event_count FROM {self.table_name} "
+            f"WHERE {self._where_time()} "
+            f"GROUP BY {column} "
+            f"ORDER BY event_count DESC, {column}"
+        )
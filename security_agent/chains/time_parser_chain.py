@@ -9,27 +9,49 @@ FilePath: \security_agent\chains\time_parser_chain.py
 """
 时间解析链
 """
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from datetime import datetime, timedelta
 import json
 import logging
 
+from security_agent.config import settings
+from security_agent.utils.cache import TTLCache
+from security_agent.utils.time_grammar import (
+    TIME_FORMAT, has_relative_start, parse_time_expression, normalize_query, shift_time_range
+)
+from security_agent.utils.llm_clients import llm_registry
+from security_agent.utils.llm_cache import namespaced_cache
+from security_agent.utils.metrics import llm_callbacks, record_cache, timed_stage
+
 logger = logging.getLogger(__name__)
 
+# 进程内共享的时间范围缓存
+time_range_cache = TTLCache(
+    max_size=settings.TIME_RANGE_CACHE_SIZE,
+    ttl=settings.TIME_RANGE_CACHE_TTL
+)
+
 class TimeRangeParserChain:
     """时间范围解析链"""
     
-    def __init__(self, api_key, model_name="qwen-plus", base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"):
-        """初始化时间解析链"""
+    def __init__(self, api_key, model_name="qwen-plus", base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+                 cache=None, cache_bucket_seconds=None):
+        """初始化时间解析链
+        
+        cache 默认使用进程内共享的 time_range_cache；cache_bucket_seconds 为缓存键的时间分桶宽度。
+        """
         logger.info("初始化时间解析链")
         
-        # 初始化LLM (使用通义千问API)
-        self.llm = ChatOpenAI(
+        self.cache = cache if cache is not None else time_range_cache
+        self.cache_bucket_seconds = cache_bucket_seconds or settings.TIME_RANGE_CACHE_BUCKET_SECONDS
+        
+        # 初始化LLM (使用通义千问API)，同一时间分桶内的相同提示使用持久化的响应缓存
+        self.llm = llm_registry.get_chat_model(
             model_name=model_name,
             api_key=api_key,
-            base_url=base_url
+            base_url=base_url,
+            cache=namespaced_cache("time_range", settings.LLM_CACHE_TIME_RANGE_TTL)
         )
         
         # 定义时间解析提示模板
@@ -57,23 +79,48 @@ class TimeRangeParserChain:
         self.output_parser = JsonOutputParser()
         
         # 构建链
-        self.chain = self.parser_template | self.llm | self.output_parser
+        self.chain = (self.parser_template | self.llm | self.output_parser).with_config(callbacks=llm_callbacks("time_parser"))
     
+    @timed_stage("time_parser")
     async def parse_time_range(self, query):
-        """解析时间范围"""
+        """解析时间范围
+        
+        优先使用本地规则解析常见的时间描述，只有规则无法识别时才调用LLM。
+        """
         # 获取当前时间
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now = datetime.now()
         logger.info(f"解析查询中的时间范围: {query}")
         
-        # 调用链处理查询
+        # 查询缓存
+        cache_key = (normalize_query(query), int(now.timestamp()) // self.cache_bucket_seconds)
+        cached = self.cache.get(cache_key)
+        record_cache("time_range", cached is not None)
+        if cached is not None:
+            result = self._reanchor(cached, now)
+            logger.info(f"时间范围缓存命中: {result}")
+            return result
+        
+        # 规则解析
+        result = parse_time_expression(query, now)
+        if result is not None:
+            logger.info(f"规则解析时间范围成功: {result}")
+            anchor = now.replace(microsecond=0)
+            self.cache.set(cache_key, (result, anchor, has_relative_start(result, anchor)))
+            return result
+        
+        # 调用链处理查询，提示中的当前时间取时间分桶的起点，使相同的提示能命中持久化缓存
+        anchor = now.replace(microsecond=0)
+        anchor -= timedelta(seconds=int(anchor.timestamp()) % self.cache_bucket_seconds)
         try:
             result = await self.chain.ainvoke({
                 "query": query,
-                "current_time": current_time
+                "current_time": anchor.strftime("%Y-%m-%d %H:%M:%S")
             })
             
             logger.info(f"时间范围解析成功: {result}")
-            return result
+            cached = (result, anchor, has_relative_start(result, anchor))
+            self.cache.set(cache_key, cached)
+            return self._reanchor(cached, now)
         except Exception as e:
             logger.error(f"时间范围解析失败: {e}")
             # 如果解析失败，返回默认时间范围
@@ -88,4 +135,25 @@ class TimeRangeParserChain:
                 "error": str(e)
             }
             
-            return default_result 
\ No newline at end of file
+            return default_result
+    
+    def _reanchor(self, cached, now):
+        """将缓存的时间范围重新锚定到当前时间
+        
+        结束时间等于解析时刻的范围中，起始时间相对于解析时刻的（如"前8小时"）随当前时间整体平移，
+        起始时间固定的（如"今天"、"本周"）只把结束时间延伸到当前时间，其余范围原样返回。
+        """
+        result, anchor, relative = cached
+        if result.get("end_time") != anchor.strftime(TIME_FORMAT):
+            return dict(result)
+        now = now.replace(microsecond=0)
+        if relative:
+            return shift_time_range(result, now - anchor)
+        extended = dict(result)
+        extended["end_time"] = now.strftime(TIME_FORMAT)
+        extended["formatted_range"] = f"{extended['start_time']} 至 {extended['end_time']}"
+        return extended
+    
+    def cache_stats(self):
+        """返回缓存命中统计"""
+        return self.cache.stats()
\ No newline at end of file
@@ -30,6 +30,22 @@ class Settings(BaseSettings):
     TONGYI_MODEL_NAME: str = "qwen-plus"  # 默认值
     TONGYI_BASE_URL: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"  # 默认值
     
+    # LLM客户端连接池配置，所有链共享同一个连接池
+    LLM_MAX_CONNECTIONS: int = 20  # 每个API地址的最大连接数
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 10  # 保持的空闲长连接数
+    LLM_KEEPALIVE_EXPIRY: float = 60  # 空闲长连接的保持时间（秒）
+    LLM_TIMEOUT: float = 60  # 请求超时时间（秒）
+    LLM_HTTP2: bool = True  # 是否启用HTTP/2，需要安装 h2，未安装时使用HTTP/1.1
+    LLM_WARMUP_ENABLED: bool = True  # 启动时预先建立到API的连接
+    LLM_WARMUP_TIMEOUT: float = 5  # 预热请求超时时间（秒）
+    
+    # LLM响应缓存配置，只缓存SQL生成和时间解析等确定性的提示
+    LLM_CACHE_ENABLED: bool = True  # 是否启用持久化的LLM响应缓存
+    LLM_CACHE_PATH: str = "./llm_cache.db"  # SQLite缓存文件，多个worker共享
+    LLM_CACHE_MAX_ENTRIES: int = 10000  # 最大条目数，超过时淘汰最久未访问的条目
+    LLM_CACHE_SQL_TTL: int = 86400  # SQL生成结果的有效期（秒）
+    LLM_CACHE_TIME_RANGE_TTL: int = 3600  # 时间解析结果的有效期（秒）
+    
     # 数据库配置
     # 旧的SQLite配置
     # DB_CONNECTION_STRING: str = "sqlite:///./security_logs.db"  # 默认值
@@ -44,10 +60,77 @@ class Settings(BaseSettings):
     # 构建连接字符串
     DB_CONNECTION_STRING: str = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
     SECURITY_LOGS_TABLE: str = os.getenv("SECURITY_LOGS_TABLE", "ids_ai")
+    SECURITY_LOGS_TIME_COLUMN: str = os.getenv("SECURITY_LOGS_TIME_COLUMN", "event_time")
+    SCHEMA_CACHE_TTL: int = 3600  # 表结构缓存有效期（秒），过期后重新反射
+    SQL_ANSWER_ROW_LIMIT: int = 20  # 问答接口匹配到明细模板时取回并交给LLM的最大记录数
+    
+    # 数据库连接池配置，所有链共享同一个连接池
+    DB_POOL_SIZE: int = 5  # 常驻连接数
+    DB_MAX_OVERFLOW: int = 10  # 突发时允许额外创建的连接数
+    DB_POOL_TIMEOUT: float = 30  # 获取连接的最长等待时间（秒）
+    DB_POOL_RECYCLE: int = 1800  # 连接最长使用时间（秒），应小于 MySQL 的 wait_timeout
+    DB_POOL_PRE_PING: bool = True  # 取出连接前检测连接是否可用
+    DB_STATEMENT_TIMEOUT_MS: int = 30000  # 单条查询最长执行时间（毫秒），0 表示不限制
     
     # 日志配置
     LOG_LEVEL: str = "INFO"  # 默认值
     
+    # 日志统计配置
+    LOG_STATS_USE_LLM: bool = False  # 是否由LLM生成日志统计，默认在本地精确计算
+    ANALYSIS_SUMMARY_MODE: bool = True  # 统计在数据库中聚合计算，不再取回整个时间窗口的日志
+    ANALYSIS_DETAIL_SAMPLE_SIZE: int = 200  # 摘要模式下取回的最新日志和高危日志条数
+    LLM_SAMPLE_TOKEN_BUDGET: int = 2000  # 交给LLM的日志样本的token预算
+    ANOMALY_SHORT_CIRCUIT: bool = True  # 本地异常检测没有命中、统计中也没有高危日志和攻击事件时直接返回无风险结论，不调用LLM
+    ANALYSIS_SPECULATIVE_FETCH: bool = True  # 解析时间范围的同时预取默认时间窗口的数据
+    ANALYSIS_SPECULATIVE_HOURS: int = 24  # 预取的默认时间窗口（小时），与时间解析的默认范围一致
+    ANALYSIS_BATCH_MAX_QUESTIONS: int = 20  # 批量分析每次最多的问题数
+    ANALYSIS_BATCH_CONCURRENCY: int = 5  # 批量分析时同时调用LLM的问题数
+    
+    # 按小时汇总表配置
+    ROLLUP_ENABLED: bool = True  # 是否维护按小时汇总表，报告和分析中已汇总的完整小时直接读取汇总表
+    ROLLUP_INTERVAL_SECONDS: int = 300  # 后台增量更新间隔（秒）
+    ROLLUP_BACKFILL_HOURS: int = 168  # 首次汇总最多回溯的小时数
+    ROLLUP_LOOKBACK_HOURS: int = 1  # 每次更新重新汇总的已完成小时数，用于收录迟到的日志
+    
+    # 流式检测配置
+    STREAM_WINDOW_SECONDS: int = 3600  # 滑动窗口长度（秒）
+    STREAM_IDLE_SECONDS: int = 7200  # 键空闲多久后淘汰（秒）
+    STREAM_MAX_KEYS: int = 100000  # 每类键最多保留的数量
+    
+    # 后台任务配置
+    JOBS_ENABLED: bool = True  # 是否启动后台任务执行器
+    JOB_DB_PATH: str = "./jobs.db"  # SQLite任务表文件，多个worker共享
+    JOB_ANALYZE_CONCURRENCY: int = 2  # 每个进程同时执行的分析任务数
+    JOB_REPORT_CONCURRENCY: int = 2  # 每个进程同时执行的报告任务数
+    JOB_POLL_INTERVAL: float = 1.0  # 没有新任务时轮询任务表的间隔（秒）
+    JOB_HEARTBEAT_SECONDS: float = 10  # 运行中任务的心跳间隔（秒），超过三个间隔没有心跳的任务被重新执行
+    JOB_RETENTION_HOURS: int = 24  # 已完成任务的保留时间（小时）
+    
+    # 准入控制配置，限制调用LLM的接口同时执行和排队的请求数
+    ADMISSION_ENABLED: bool = True  # 是否启用准入控制
+    ADMISSION_MAX_CONCURRENCY: int = 16  # 所有受控接口同时执行的请求总数
+    ADMISSION_ANALYZE_CONCURRENCY: int = 12  # 交互式分析（含流式）和数据库问答各自同时执行的请求数，优先级最高
+    ADMISSION_BATCH_CONCURRENCY: int = 2  # 批量分析同时执行的请求数
+    ADMISSION_REPORT_CONCURRENCY: int = 4  # 安全报告（含流式）同时执行的请求数
+    ADMISSION_SCHEDULED_REPORT_CONCURRENCY: int = 2  # 定时报告同时执行的请求数，优先级最低
+    ADMISSION_QUEUE_SIZE: int = 32  # 每个接口等待队列的长度，已满时返回429
+    ADMISSION_QUEUE_TIMEOUT: float = 15  # 交互式请求在队列中等待的最长时间（秒），超过时返回503
+    ADMISSION_BACKGROUND_QUEUE_TIMEOUT: float = 60  # 批量分析、报告和定时报告在队列中等待的最长时间（秒）
+    ADMISSION_RETRY_AFTER: int = 5  # 队列已满时 Retry-After 建议的重试间隔（秒）
+    
+    # 链路追踪配置
+    TRACING_ENABLED: bool = True  # 是否为每个请求记录 trace
+    TRACE_HEADER: str = "X-Trace-Id"  # 传入和返回 trace id 的请求头
+    TRACE_EXPORT_PATH: str = "./traces.jsonl"  # 结束的 trace 追加写入的JSONL文件，为空时不导出
+    TRACE_EXPORT_MAX_BYTES: int = 50 * 1024 * 1024  # JSONL文件超过该大小时轮转
+    TRACE_RECENT_SIZE: int = 1000  # 内存中保留的最近 trace 数，用于查询最慢的请求
+    TRACE_MAX_SPANS: int = 500  # 每个 trace 最多记录的 span 数
+    
+    # 时间范围解析缓存配置
+    TIME_RANGE_CACHE_SIZE: int = 1024  # 最大缓存条目数
+    TIME_RANGE_CACHE_TTL: int = 3600  # 缓存有效期（秒）
+    TIME_RANGE_CACHE_BUCKET_SECONDS: int = 60  # 时间分桶宽度（秒），同一桶内的相同查询直接命中缓存
+    
     # 使用新的配置方式
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -9,32 +9,99 @@ FilePath: \security_agent\main.py
 """
 网络安全AI代理主入口文件
 """
+import asyncio
 import os
+from contextlib import asynccontextmanager, suppress
+
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 
 # 加载环境变量
 load_dotenv()
 
 # 导入API路由
-from security_agent.api.routes import router as api_router
+from security_agent.api.routes import router as api_router, init_chains, close_chains, create_job_manager
+from security_agent.utils.schema_registry import schema_registry
+from security_agent.utils.engine_registry import engine_registry
+from security_agent.utils.llm_clients import llm_registry
+from security_agent.utils.metrics import registry as metrics_registry
+from security_agent.utils.rollups import RollupManager
+from security_agent.utils.tracing import TracingMiddleware, install_log_record_factory, tracer
+from security_agent.config import settings
+
+# 每条日志记录带上当前请求的 trace id
+install_log_record_factory()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建链、预热LLM连接、汇总表和任务执行器后台任务，关闭时释放LLM客户端和数据库连接池"""
+    init_chains(app)
+    
+    app.state.job_manager = None
+    if settings.JOBS_ENABLED:
+        app.state.job_manager = create_job_manager(app)
+        await app.state.job_manager.start()
+    
+    warmup_task = None
+    if settings.LLM_WARMUP_ENABLED:
+        warmup_task = asyncio.create_task(llm_registry.warm_up(settings.LLM_WARMUP_TIMEOUT))
+    
+    rollup_task = None
+    if settings.ROLLUP_ENABLED:
+        rollups = RollupManager(
+            settings.DB_CONNECTION_STRING,
+            settings.SECURITY_LOGS_TABLE,
+            time_column=settings.SECURITY_LOGS_TIME_COLUMN,
+            backfill_hours=settings.ROLLUP_BACKFILL_HOURS,
+            lookback_hours=settings.ROLLUP_LOOKBACK_HOURS
+        )
+        rollup_task = asyncio.create_task(rollups.run_periodically(settings.ROLLUP_INTERVAL_SECONDS))
+    
+    yield
+    
+    if app.state.job_manager is not None:
+        await app.state.job_manager.stop()
+        app.state.job_manager = None
+    for task in (warmup_task, rollup_task):
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    close_chains(app)
+    await llm_registry.aclose_all()
+    schema_registry.clear()
+    await engine_registry.dispose_all()
+    await asyncio.to_thread(tracer.flush)
 
 # 创建FastAPI应用
 app = FastAPI(
     title="网络安全AI代理",
     description="基于通义千问API的网络安全日志分析和入侵检测系统",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 注册路由
 app.include_router(api_router, prefix="/api")
 
+# 不记录 trace 的路径
+UNTRACED_PATHS = {"/health", "/metrics"}
+
+# 为每个请求创建 trace，流式响应发送完毕后才结束
+app.add_middleware(TracingMiddleware, tracer=tracer, header=settings.TRACE_HEADER, untraced_paths=UNTRACED_PATHS)
+
 # 健康检查端点
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+# Prometheus 指标端点：各阶段耗时、SQL取回行数、LLM token 用量、缓存命中和错误次数
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     # 从环境变量获取主机和端口，如果不存在则使用默认值
     host = os.getenv("HOST", "0.0.0.0")
@@ -1,14 +1,45 @@
 """
 API端点集成测试
 """
+import asyncio
 import unittest
 from fastapi.testclient import TestClient
 import os
 import json
-from unittest.mock import patch, MagicMock
+import tempfile
+from unittest.mock import patch, MagicMock, AsyncMock
 
 from security_agent.main import app
+from security_agent.api.routes import get_security_chain, get_sql_chain, get_stream_detector, get_job_manager
 from security_agent.chains.security_agent_chain import SecurityAgentChain
+from security_agent.utils.admission import AdmissionController, AdmissionPolicy
+from security_agent.utils.jobs import JobManager, JobStore
+from security_agent.utils.stream_detector import StreamDetector
+from security_agent.utils.tracing import tracer
+
+def _parse_sse(text):
+    """解析SSE响应，返回 (事件, 数据) 列表"""
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+# 测试中的请求不写入默认的 trace 文件
+_exporter_patcher = patch.object(tracer, "exporter", None)
+
+def setUpModule():
+    _exporter_patcher.start()
+
+def tearDownModule():
+    _exporter_patcher.stop()
+
+async def _events(*events, error=None):
+    """模拟链的流式输出"""
+    for event in events:
+        yield event
+    if error is not None:
+        raise error
 
 class TestAPIEndpoints(unittest.TestCase):
     """API端点集成测试"""
@@ -17,17 +48,15 @@ class TestAPIEndpoints(unittest.TestCase):
         """测试前准备"""
         self.client = TestClient(app)
         
-        # 模拟安全代理链
-        self.patcher = patch('security_agent.api.routes.SecurityAgentChain')
-        self.mock_chain_class = self.patcher.start()
-        
-        # 创建模拟链实例
+        # 模拟安全代理链实例
         self.mock_chain = MagicMock()
-        self.mock_chain_class.return_value = self.mock_chain
+        self.mock_chain.run = AsyncMock()
+        app.dependency_overrides[get_security_chain] = lambda: self.mock_chain
     
     def tearDown(self):
         """测试后清理"""
-        self.patcher.stop()
+        app.dependency_overrides.clear()
+        app.state.admission_controller = None
     
     def test_health_check(self):
         """测试健康检查端点"""
@@ -35,6 +64,95 @@ class TestAPIEndpoints(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json(), {"status": "healthy"})
     
+    def test_metrics(self):
+        """测试指标端点以 Prometheus 文本格式返回各阶段指标"""
+        response = self.client.get("/metrics")
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn("# TYPE security_agent_stage_duration_seconds histogram", response.text)
+        self.assertIn("# TYPE security_agent_llm_tokens_total counter", response.text)
+    
+    def test_trace_id_header(self):
+        """测试请求头中的 trace id 原样返回，并可在最慢的 trace 中查询"""
+        self.mock_chain.run.return_value = {
+            "timestamp": "2025-03-01T12:00:00",
+            "time_range": "2025-03-01 04:00:00 至 2025-03-01 12:00:00",
+            "has_risk": False,
+            "risk_level": "低",
+            "risk_type": "无",
+            "analysis": "未发现异常",
+            "recommendations": []
+        }
+        response = self.client.post(
+            "/api/security/analyze", json={"query": "前8小时"}, headers={"X-Trace-Id": "api-trace-1"}
+        )
+        self.assertEqual(response.headers["X-Trace-Id"], "api-trace-1")
+        self.assertEqual(len(self.client.get("/health").headers.get("X-Trace-Id", "")), 0)
+        
+        response = self.client.get("/api/system/traces/slowest", params={"limit": 1000})
+        self.assertEqual(response.status_code, 200)
+        traces = {trace["trace_id"]: trace for trace in response.json()}
+        self.assertEqual(traces["api-trace-1"]["name"], "POST /api/security/analyze")
+        self.assertEqual(traces["api-trace-1"]["attributes"]["status_code"], 200)
+    
+    def test_stream_trace_covers_response_body(self):
+        """测试流式响应的 trace 在响应体发送完毕后才结束，响应体生成过程中的 span 记录在同一个 trace 中"""
+        async def astream(query):
+            yield "time_range", {"start_time": "2025-03-01 04:00:00", "end_time": "2025-03-01 12:00:00"}
+            with tracer.span("stream_analysis"):
+                await asyncio.sleep(0.05)
+            yield "result", {"has_risk": False, "risk_level": "无"}
+        
+        self.mock_chain.astream = astream
+        response = self.client.post(
+            "/api/security/analyze/stream", json={"query": "前8小时"}, headers={"X-Trace-Id": "stream-trace-1"}
+        )
+        self.assertEqual(response.headers["X-Trace-Id"], "stream-trace-1")
+        self.assertEqual([event for event, _ in _parse_sse(response.text)], ["time_range", "result"])
+        
+        traces = {trace["trace_id"]: trace for trace in self.client.get("/api/system/traces/slowest", params={"limit": 1000}).json()}
+        trace = traces["stream-trace-1"]
+        spans = {span["name"]: span for span in trace["spans"]}
+        self.assertEqual(spans["stream_analysis"]["parent_id"], trace["spans"][0]["span_id"])
+        self.assertGreaterEqual(trace["duration"], spans["stream_analysis"]["start_offset"] + spans["stream_analysis"]["duration"])
+        self.assertEqual(trace["attributes"]["status_code"], 200)
+    
+    def test_admission_rejects_when_busy(self):
+        """测试没有执行名额时立即返回429，排队超时返回503，都带有 Retry-After"""
+        app.state.admission_controller = AdmissionController(
+            {
+                "analyze": AdmissionPolicy(concurrency=0, queue_size=0, timeout=0.05, priority=0),
+                "scheduled_report": AdmissionPolicy(concurrency=0, queue_size=1, timeout=0.05, priority=2),
+            },
+            max_concurrency=4,
+            retry_after=7
+        )
+        
+        response = self.client.post("/api/security/analyze", json={"query": "前8小时"})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "7")
+        self.mock_chain.run.assert_not_called()
+        
+        response = self.client.get("/api/security/scheduled_report/general")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        
+        stats = self.client.get("/api/system/admission").json()["endpoints"]
+        self.assertEqual(stats["analyze"]["queue_full"], 1)
+        self.assertEqual(stats["scheduled_report"]["timed_out"], 1)
+    
+    def test_admission_releases_slot(self):
+        """测试请求结束（包括失败）后归还执行名额"""
+        self.mock_chain.run.side_effect = RuntimeError("模型超时")
+        for _ in range(3):
+            response = self.client.post("/api/security/analyze", json={"query": "前8小时"})
+            self.assertEqual(response.status_code, 500)
+        
+        stats = self.client.get("/api/system/admission").json()
+        self.assertEqual(stats["running"], 0)
+        self.assertEqual(stats["endpoints"]["analyze"]["admitted"], 3)
+    
     def test_analyze_security_logs_success(self):
         """测试安全日志分析端点成功情况"""
         # 模拟分析结果
@@ -64,7 +182,7 @@ class TestAPIEndpoints(unittest.TestCase):
         self.assertEqual(response.json()["risk_type"], "端口扫描")
         
         # 验证链被正确调用
-        self.mock_chain.run.assert_called_once_with("前8小时是否有网络安全攻击风险")
+        self.mock_chain.run.assert_awaited_once_with("前8小时是否有网络安全攻击风险")
     
     def test_analyze_security_logs_failure(self):
         """测试安全日志分析端点失败情况"""
@@ -80,6 +198,236 @@ class TestAPIEndpoints(unittest.TestCase):
         # 验证结果
         self.assertEqual(response.status_code, 500)
         self.assertIn("detail", response.json())
+    
+    def test_stream_security_analysis(self):
+        """测试流式分析端点按阶段发送事件"""
+        time_range = {"start_time": "2025-03-01 04:00:00", "end_time": "2025-03-01 12:00:00"}
+        self.mock_chain.astream = MagicMock(return_value=_events(
+            ("time_range", time_range),
+            ("data", {"sample_rows": 20, "detection_rows": 500}),
+            ("token", "{\"has_risk\""),
+            ("token", ": true}"),
+            ("result", {"has_risk": True, "risk_level": "高"}),
+        ))
+        
+        response = self.client.post("/api/security/analyze/stream", json={"query": "前8小时是否有网络安全攻击风险"})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/event-stream"))
+        events = _parse_sse(response.text)
+        self.assertEqual([event for event, _ in events], ["time_range", "data", "token", "token", "result"])
+        self.assertEqual(events[0][1], time_range)
+        self.assertEqual(events[-1][1]["risk_level"], "高")
+        self.mock_chain.astream.assert_called_once_with("前8小时是否有网络安全攻击风险")
+    
+    def test_stream_security_analysis_error(self):
+        """测试流式分析出错时发送 error 事件"""
+        self.mock_chain.astream = MagicMock(return_value=_events(
+            ("time_range", {"start_time": "2025-03-01 04:00:00", "end_time": "2025-03-01 12:00:00"}),
+            error=Exception("数据库不可用")
+        ))
+        
+        response = self.client.post("/api/security/analyze/stream", json={"query": "前8小时是否有网络安全攻击风险"})
+        
+        events = _parse_sse(response.text)
+        self.assertEqual(events[-1], ("error", {"detail": "数据库不可用"}))
+    
+    def test_analyze_security_batch(self):
+        """测试批量分析端点返回每个问题的回答"""
+        self.mock_chain.run_batch = AsyncMock(return_value={
+            "timestamp": "2025-03-01T12:00:00",
+            "time_range": "2025-03-01 04:00:00 至 2025-03-01 12:00:00",
+            "findings": [],
+            "answers": [
+                {"question": "是否有网络安全攻击风险", "answer": "未发现攻击", "error": None},
+                {"question": "登录失败最多的IP有哪些", "answer": None, "error": "LLM超时"},
+            ],
+            "timings": {"total": 1.5},
+        })
+        questions = ["是否有网络安全攻击风险", "登录失败最多的IP有哪些"]
+        
+        response = self.client.post("/api/security/analyze/batch", json={"questions": questions, "time_query": "前8小时"})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([answer["question"] for answer in response.json()["answers"]], questions)
+        self.assertEqual(response.json()["answers"][1]["error"], "LLM超时")
+        self.mock_chain.run_batch.assert_awaited_once_with(questions, "前8小时")
+        
+        response = self.client.post("/api/security/analyze/batch", json={"questions": []})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_stream_security_report(self):
+        """测试流式报告端点发送查询信息、报告 token 和最终报告"""
+        sql_chain = MagicMock()
+        sql_chain.astream_report = MagicMock(return_value=_events(
+            ("time_range", {"start_time": "2025-03-01 04:00:00", "end_time": "2025-03-01 12:00:00"}),
+            ("sql", {"query": "SELECT * FROM security_logs", "source": "logs"}),
+            ("rows", {"count": 42, "source": "logs"}),
+            ("token", "安全概况"),
+            ("result", {"report_content": "安全概况：正常"}),
+        ))
+        app.dependency_overrides[get_sql_chain] = lambda: sql_chain
+        
+        response = self.client.post("/api/security/report/stream", json={"report_type": "high_risk", "hours": 8})
+        
+        events = _parse_sse(response.text)
+        self.assertEqual([event for event, _ in events], ["time_range", "sql", "rows", "token", "result"])
+        self.assertEqual(events[2][1]["count"], 42)
+        report = events[-1][1]
+        self.assertEqual(report["report_type"], "high_risk")
+        self.assertEqual(report["time_range"], "从 2025-03-01 04:00:00 到 2025-03-01 12:00:00")
+        self.assertEqual(report["summary"], "安全概况：正常")
+        sql_chain.astream_report.assert_called_once_with("high_risk", None, hours=8)
+    
+    def test_report_shows_effective_time_range(self):
+        """测试报告和定时报告返回报告实际使用的时间范围"""
+        time_range = {"start_time": "2025-03-01 04:17:05", "end_time": "2025-03-01 12:17:05"}
+        sql_chain = MagicMock()
+        sql_chain.recent_time_range = MagicMock(return_value=time_range)
+        sql_chain.scheduled_security_report = AsyncMock(return_value="安全概况：正常")
+        app.dependency_overrides[get_sql_chain] = lambda: sql_chain
+        
+        report = self.client.post("/api/security/report", json={"report_type": "attack", "hours": 8}).json()
+        scheduled = self.client.get("/api/security/scheduled_report/general", params={"hours": 8}).json()
+        
+        self.assertEqual(report["time_range"], "从 2025-03-01 04:17:05 到 2025-03-01 12:17:05")
+        self.assertEqual(scheduled["time_range"], "从 2025-03-01 04:17:05 到 2025-03-01 12:17:05")
+        sql_chain.scheduled_security_report.assert_called_with(report_type="general", hours=8, time_range=time_range)
+    
+    def test_ingest_security_events(self):
+        """测试流式检测端点按时间顺序处理事件并返回告警"""
+        detector = StreamDetector(window_seconds=600)
+        app.dependency_overrides[get_stream_detector] = lambda: detector
+        events = [
+            {
+                "timestamp": f"2025-03-01T10:00:{59 - i:02d}",
+                "source_ip": "203.0.113.37",
+                "event_type": "登录失败",
+                "protocol": "SSH",
+                "destination_port": 22,
+                "user_id": "root",
+                "status": "失败"
+            }
+            for i in range(10)
+        ]
+        
+        response = self.client.post("/api/security/events", json=events)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["processed"], 10)
+        self.assertEqual(
+            sorted(alert["key_type"] for alert in response.json()["alerts"]),
+            ["source_ip", "user_id"]
+        )
+        self.assertEqual(detector.stats()["events_dropped"], 0)
+        
+        response = self.client.get("/api/security/alerts", params={"limit": 1})
+        self.assertEqual(len(response.json()["alerts"]), 1)
+        self.assertEqual(response.json()["stats"]["alerts_emitted"], 2)
+
+    def test_ingest_mixed_timezones(self):
+        """测试同一批事件中带时区和不带时区的时间统一按UTC排序"""
+        detector = StreamDetector(window_seconds=600)
+        app.dependency_overrides[get_stream_detector] = lambda: detector
+        events = [
+            {"timestamp": "2025-03-01T18:00:05+08:00", "source_ip": "203.0.113.37", "event_type": "登录失败"},
+            {"timestamp": "2025-03-01T10:00:00", "source_ip": "203.0.113.37", "event_type": "登录失败"},
+            {"timestamp": "2025-03-01T10:00:10Z", "source_ip": "203.0.113.37", "event_type": "登录失败"},
+        ]
+        
+        response = self.client.post("/api/security/events", json=events)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["processed"], 3)
+        self.assertEqual(detector.stats()["events_dropped"], 0)
+    
+    def test_submit_and_get_jobs(self):
+        """测试提交任务立即返回任务ID，并可以查询任务状态"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            job_manager = JobManager(
+                JobStore(os.path.join(tmpdir, "jobs.db")),
+                handlers={"analyze": AsyncMock(), "report": AsyncMock()},
+                concurrency={"analyze": 1, "report": 1}
+            )
+            app.dependency_overrides[get_job_manager] = lambda: job_manager
+            
+            response = self.client.post("/api/jobs/analyze", json={"query": "前8小时是否有网络安全攻击风险"})
+            self.assertEqual(response.status_code, 202)
+            job = response.json()
+            self.assertEqual(job["job_type"], "analyze")
+            self.assertEqual(job["status"], "pending")
+            self.assertEqual(job["params"], {"query": "前8小时是否有网络安全攻击风险"})
+            
+            response = self.client.post("/api/jobs/report", json={"report_type": "attack", "hours": 4})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json()["params"]["report_type"], "attack")
+            
+            response = self.client.get(f"/api/jobs/{job['id']}")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["id"], job["id"])
+            self.assertIsNone(response.json()["result"])
+            
+            self.assertEqual(self.client.get("/api/jobs/missing").status_code, 404)
+            response = self.client.get("/api/system/jobs")
+            self.assertEqual(response.json()["analyze"]["jobs"], {"pending": 1})
+    
+    def test_jobs_unavailable_when_disabled(self):
+        """测试未启用后台任务时任务接口返回503"""
+        response = self.client.post("/api/jobs/analyze", json={"query": "前8小时是否有网络安全攻击风险"})
+        self.assertEqual(response.status_code, 503)
+
+class TestChainLifecycle(unittest.TestCase):
+    """链生命周期测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        app.state.security_chain = None
+        self.patcher = patch('security_agent.api.routes.SecurityAgentChain')
+        self.mock_chain_class = self.patcher.start()
+        self.mock_chain = MagicMock()
+        self.mock_chain.run = AsyncMock(side_effect=Exception("分析失败"))
+        self.mock_chain_class.return_value = self.mock_chain
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.patcher.stop()
+        app.state.security_chain = None
+    
+    def test_chain_created_once_across_requests(self):
+        """测试多次请求复用同一个链实例"""
+        client = TestClient(app)
+        for _ in range(3):
+            client.post("/api/security/analyze", json={"query": "前8小时是否有网络安全攻击风险"})
+        
+        self.mock_chain_class.assert_called_once()
+        self.assertEqual(self.mock_chain.run.await_count, 3)
+    
+    def test_lifespan_creates_and_closes_chains(self):
+        """测试应用启动时创建链、预热LLM连接并启动任务执行器，关闭时停止任务执行器、释放客户端和连接池"""
+        with patch('security_agent.api.routes.SQLGeneratorChain') as mock_sql_class, \
+                patch('security_agent.main.engine_registry') as mock_engines, \
+                patch('security_agent.main.llm_registry') as mock_llms, \
+                patch('security_agent.main.create_job_manager') as mock_create_jobs:
+            mock_sql_chain = MagicMock()
+            mock_sql_class.return_value = mock_sql_chain
+            mock_engines.dispose_all = AsyncMock()
+            mock_llms.warm_up = AsyncMock()
+            mock_llms.aclose_all = AsyncMock()
+            mock_jobs = mock_create_jobs.return_value
+            mock_jobs.start = AsyncMock()
+            mock_jobs.stop = AsyncMock()
+            
+            with TestClient(app):
+                self.assertIs(app.state.security_chain, self.mock_chain)
+                self.assertIs(app.state.sql_chain, mock_sql_chain)
+                self.assertIs(app.state.job_manager, mock_jobs)
+            
+            mock_jobs.start.assert_awaited_once()
+            mock_jobs.stop.assert_awaited_once()
+            mock_llms.warm_up.assert_awaited_once()
+            mock_llms.aclose_all.assert_awaited_once()
+            mock_engines.dispose_all.assert_awaited_once()
+            self.assertIsNone(app.state.security_chain)
 
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
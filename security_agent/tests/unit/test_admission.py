@@ -0,0 +1,109 @@
+"""
+准入控制单元测试
+"""
+import asyncio
+import unittest
+
+from security_agent.utils.admission import AdmissionController, AdmissionPolicy, AdmissionRejected
+
+class TestAdmissionController(unittest.IsolatedAsyncioTestCase):
+    """准入控制器测试"""
+    
+    def _controller(self, max_concurrency=2, timeout=1.0):
+        return AdmissionController(
+            {
+                "analyze": AdmissionPolicy(concurrency=2, queue_size=2, timeout=timeout, priority=0),
+                "scheduled_report": AdmissionPolicy(concurrency=2, queue_size=1, timeout=timeout, priority=2),
+            },
+            max_concurrency=max_concurrency,
+            retry_after=3
+        )
+    
+    async def test_queue_full_and_timeout(self):
+        """测试达到并发上限后排队，队列已满时返回429，等待超时返回503"""
+        controller = self._controller(timeout=0.05)
+        await controller.acquire("analyze")
+        await controller.acquire("analyze")
+        waiters = [asyncio.create_task(controller.acquire("analyze")) for _ in range(2)]
+        await asyncio.sleep(0)
+        
+        with self.assertRaises(AdmissionRejected) as rejected:
+            await controller.acquire("analyze")
+        self.assertEqual(rejected.exception.status_code, 429)
+        self.assertEqual(rejected.exception.retry_after, 3)
+        
+        for waiter in waiters:
+            with self.assertRaises(AdmissionRejected) as rejected:
+                await waiter
+            self.assertEqual(rejected.exception.status_code, 503)
+            self.assertEqual(rejected.exception.retry_after, 1)
+        
+        stats = controller.stats()["endpoints"]["analyze"]
+        self.assertEqual((stats["running"], stats["waiting"]), (2, 0))
+        self.assertEqual((stats["admitted"], stats["queue_full"], stats["timed_out"]), (2, 1, 2))
+    
+    async def test_interactive_requests_have_priority(self):
+        """测试空出名额时优先唤醒交互式请求，同一优先级先到先得"""
+        controller = self._controller()
+        order = []
+        
+        async def request(endpoint, name):
+            async with controller.slot(endpoint):
+                order.append(name)
+        
+        await controller.acquire("scheduled_report")
+        await controller.acquire("scheduled_report")
+        tasks = [asyncio.create_task(request("scheduled_report", "report"))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(request("analyze", f"analyze{i}")) for i in range(2)]
+        await asyncio.sleep(0)
+        self.assertEqual(controller.stats()["endpoints"]["analyze"]["waiting"], 2)
+        
+        controller.release("scheduled_report")
+        controller.release("scheduled_report")
+        await asyncio.gather(*tasks)
+        
+        self.assertEqual(order, ["analyze0", "analyze1", "report"])
+        self.assertEqual(controller.stats()["running"], 0)
+    
+    async def test_endpoint_limit_does_not_block_other_endpoints(self):
+        """测试等待中的请求所在接口已满时，其他接口的请求可以使用空出的名额"""
+        controller = AdmissionController(
+            {
+                "analyze": AdmissionPolicy(concurrency=1, queue_size=2, timeout=1.0, priority=0),
+                "report": AdmissionPolicy(concurrency=2, queue_size=2, timeout=1.0, priority=1),
+            },
+            max_concurrency=2
+        )
+        await controller.acquire("analyze")
+        await controller.acquire("report")
+        analyze = asyncio.create_task(controller.acquire("analyze"))
+        report = asyncio.create_task(controller.acquire("report"))
+        await asyncio.sleep(0)
+        
+        controller.release("report")
+        await report
+        self.assertFalse(analyze.done())
+        
+        controller.release("analyze")
+        await analyze
+        self.assertEqual(controller.stats()["running"], 2)
+    
+    async def test_cancelled_waiter_leaves_queue(self):
+        """测试客户端断开时等待中的请求离开队列，不占用名额"""
+        controller = self._controller(max_concurrency=1)
+        await controller.acquire("analyze")
+        waiter = asyncio.create_task(controller.acquire("analyze"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        
+        controller.release("analyze")
+        stats = controller.stats()
+        self.assertEqual(stats["running"], 0)
+        self.assertEqual(stats["endpoints"]["analyze"]["waiting"], 0)
+        await controller.acquire("analyze")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,238 @@
+"""
+本地异常检测单元测试
+"""
+import random
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from langchain_core.messages import AIMessageChunk
+
+from security_agent.chains.security_analysis_chain import SecurityAnalysisChain
+from security_agent.chains.sql_templates import SQLTemplateLibrary
+from security_agent.models.security_log import Base
+from security_agent.utils.anomaly_detector import AnomalyDetector, DETECTION_COLUMNS, findings_verdict
+from security_agent.utils.db_init import generate_sample_data
+
+SUSPICIOUS_SOURCES = ("203.0.113.42", "203.0.113.37", "192.168.1.25")
+
+# 没有高危日志和攻击类事件的统计
+QUIET_STATS = {"total_logs": 100, "event_types": {"登录成功": 60, "文件访问": 40}, "severity_levels": {"低": 90, "中": 10}}
+
+def _sample_logs(seed=0):
+    """使用 db_init 生成示例数据（包含端口扫描、暴力破解和数据外泄）"""
+    random.seed(seed)
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    generate_sample_data(engine)
+    logs_df = pd.read_sql("SELECT * FROM security_logs", engine, parse_dates=["timestamp"])
+    engine.dispose()
+    return logs_df
+
+class TestAnomalyDetector(unittest.TestCase):
+    """本地异常检测测试"""
+    
+    @classmethod
+    def setUpClass(cls):
+        """生成示例数据"""
+        cls.logs_df = _sample_logs()
+    
+    def setUp(self):
+        """测试前准备"""
+        self.detector = AnomalyDetector()
+    
+    def test_detects_generated_attacks(self):
+        """测试识别 db_init 生成的三类可疑活动"""
+        findings = self.detector.detect(self.logs_df)
+        detected = sorted((finding.rule, finding.source_ip) for finding in findings)
+        self.assertEqual(detected, [
+            ("data_exfiltration", "192.168.1.25"),
+            ("port_scan", "203.0.113.42"),
+            ("ssh_brute_force", "203.0.113.37"),
+        ])
+        
+        brute_force = next(finding for finding in findings if finding.rule == "ssh_brute_force")
+        self.assertEqual(brute_force.risk_level, "高")
+        self.assertIn("root", brute_force.evidence["target_users"])
+        self.assertEqual(brute_force.evidence["failure_ratio"], 1.0)
+        
+        exfiltration = next(finding for finding in findings if finding.rule == "data_exfiltration")
+        self.assertEqual(exfiltration.event_count, 5)
+        self.assertEqual(exfiltration.evidence["destinations"], ["198.51.100.23"])
+    
+    def test_normal_traffic_has_no_findings(self):
+        """测试正常流量不触发规则"""
+        normal = self.logs_df[~self.logs_df["source_ip"].isin(SUSPICIOUS_SOURCES)]
+        self.assertEqual(self.detector.detect(normal), [])
+    
+    def test_detection_columns_are_enough(self):
+        """测试只使用窄查询返回的列也能得到同样的结果"""
+        narrow = self.logs_df[["timestamp", *DETECTION_COLUMNS]]
+        self.assertEqual(
+            [finding.rule for finding in self.detector.detect(narrow)],
+            [finding.rule for finding in self.detector.detect(self.logs_df)]
+        )
+    
+    def test_missing_columns(self):
+        """测试缺少列时跳过对应规则"""
+        self.assertEqual(self.detector.detect(pd.DataFrame()), [])
+        self.assertEqual(self.detector.detect(self.logs_df[["source_ip", "event_type"]]), [])
+    
+    def test_findings_verdict(self):
+        """测试根据检测结果生成结论"""
+        verdict = findings_verdict(self.detector.detect(self.logs_df))
+        self.assertTrue(verdict["has_risk"])
+        self.assertEqual(verdict["risk_level"], "高")
+        self.assertIn("SSH暴力破解", verdict["risk_type"])
+        self.assertEqual(len(verdict["findings"]), 3)
+        
+        no_risk = findings_verdict([])
+        self.assertFalse(no_risk["has_risk"])
+        self.assertEqual(no_risk["risk_level"], "无")
+    
+    def test_detection_window_template(self):
+        """测试异常检测的窄查询模板"""
+        templates = SQLTemplateLibrary("security_logs", time_column="timestamp", dialect="sqlite")
+        rendered = templates.render(
+            "detection_window",
+            {"start_time": "2025-03-01 00:00:00", "end_time": "2025-03-02 00:00:00"},
+            columns=DETECTION_COLUMNS
+        )
+        self.assertTrue(rendered.sql.startswith("SELECT timestamp, source_ip, destination_ip"))
+        self.assertNotIn("raw_log", rendered.sql)
+        with self.assertRaises(ValueError):
+            templates.render(
+                "detection_window",
+                {"start_time": "2025-03-01 00:00:00", "end_time": "2025-03-02 00:00:00"},
+                columns=["source_ip; DROP TABLE security_logs"]
+            )
+
+class TestSecurityAnalysisShortCircuit(unittest.IsolatedAsyncioTestCase):
+    """安全分析链使用本地检测结果的测试"""
+    
+    @classmethod
+    def setUpClass(cls):
+        """生成示例数据"""
+        cls.logs_df = _sample_logs()
+    
+    def setUp(self):
+        """测试前准备"""
+        self.patcher = patch('security_agent.chains.security_analysis_chain.llm_registry')
+        self.patcher.start()
+        self.chain = SecurityAnalysisChain("fake_api_key")
+        self.chain.chain = MagicMock()
+        self.chain.chain.ainvoke = AsyncMock(return_value={
+            "has_risk": True,
+            "risk_level": "高",
+            "risk_type": "暴力破解",
+            "analysis": "发现暴力破解",
+            "recommendations": ["封禁IP"],
+        })
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.patcher.stop()
+    
+    async def test_no_findings_skips_llm(self):
+        """测试没有命中时不调用LLM"""
+        normal = self.logs_df[~self.logs_df["source_ip"].isin(SUSPICIOUS_SOURCES)]
+        result = await self.chain.analyze_security(QUIET_STATS, normal, "最近7天")
+        
+        self.assertFalse(result["has_risk"])
+        self.assertEqual(result["risk_level"], "无")
+        self.chain.chain.ainvoke.assert_not_called()
+    
+    async def test_high_risk_stats_call_llm(self):
+        """测试没有命中但统计中有高危日志、攻击类事件或缺少分布时仍调用LLM"""
+        normal = self.logs_df[~self.logs_df["source_ip"].isin(SUSPICIOUS_SOURCES)]
+        for stats in (
+            {**QUIET_STATS, "severity_levels": {"低": 90, "严重": 1}},
+            {**QUIET_STATS, "event_types": {"登录成功": 60, "权限提升": 1}},
+            {"total_logs": 100},
+        ):
+            self.chain.chain.ainvoke.reset_mock()
+            result = await self.chain.analyze_security(stats, normal, "最近7天")
+            self.assertEqual(result["risk_level"], "高")
+            self.chain.chain.ainvoke.assert_called_once()
+        
+        self.chain.short_circuit = False
+        self.assertFalse(self.chain.can_short_circuit([], QUIET_STATS))
+    
+    async def test_truncated_detection_calls_llm(self):
+        """测试检测数据被截断时不跳过模型分析，并在提示中说明"""
+        normal = self.logs_df[~self.logs_df["source_ip"].isin(SUSPICIOUS_SOURCES)]
+        await self.chain.analyze_security({**QUIET_STATS, "detection_truncated": True}, normal, "最近7天")
+        
+        prompt_inputs = self.chain.chain.ainvoke.call_args[0][0]
+        self.assertIn("检测数据达到条数上限", prompt_inputs["anomaly_findings"])
+    
+    async def test_findings_are_passed_to_llm(self):
+        """测试命中的检测结果写入提示并附在结论中"""
+        result = await self.chain.analyze_security({}, self.logs_df.head(20), "最近7天", detection_df=self.logs_df)
+        
+        prompt_inputs = self.chain.chain.ainvoke.call_args[0][0]
+        self.assertIn("203.0.113.37", prompt_inputs["anomaly_findings"])
+        self.assertEqual(len(result["findings"]), 3)
+    
+    async def test_llm_failure_uses_findings(self):
+        """测试LLM失败时使用本地检测结论"""
+        self.chain.chain.ainvoke = AsyncMock(side_effect=Exception("LLM不可用"))
+        result = await self.chain.analyze_security({}, self.logs_df, "最近7天")
+        
+        self.assertTrue(result["has_risk"])
+        self.assertEqual(result["risk_level"], "高")
+
+    async def test_stream_analysis(self):
+        """测试流式分析先返回检测结果，再逐个返回 token，最后返回解析后的结论"""
+        async def astream(inputs):
+            for text in ['{"has_risk": true, ', '"risk_level": "高", "analysis": "暴力破解", ', '"recommendations": []}']:
+                yield AIMessageChunk(content=text)
+        
+        self.chain.stream_chain = MagicMock()
+        self.chain.stream_chain.astream = astream
+        events = [event async for event in self.chain.astream_analysis({}, self.logs_df, "最近7天")]
+        
+        self.assertEqual([name for name, _ in events], ["findings", "token", "token", "token", "result"])
+        self.assertEqual(len(events[0][1]), 3)
+        self.assertEqual(events[-1][1]["risk_level"], "高")
+        self.assertEqual(len(events[-1][1]["findings"]), 3)
+    
+    async def test_answer_questions_share_inputs(self):
+        """测试批量问答共享同一份输入，单个问题失败不影响其他问题"""
+        async def abatch(inputs, config=None, return_exceptions=False):
+            return [Exception("LLM超时") if item["question"] == "失败" else f"回答: {item['question']}" for item in inputs]
+        
+        self.chain.question_chain = MagicMock()
+        self.chain.question_chain.abatch = AsyncMock(side_effect=abatch)
+        findings = self.chain.detect(self.logs_df)
+        answers = await self.chain.answer_questions(["攻击来源", "失败"], {"total_logs": 10}, "最近7天", findings, "样本")
+        
+        inputs = self.chain.question_chain.abatch.call_args[0][0]
+        self.assertEqual([item["question"] for item in inputs], ["攻击来源", "失败"])
+        self.assertEqual(inputs[0]["sample_logs"], inputs[1]["sample_logs"])
+        self.assertIn("203.0.113.37", inputs[0]["anomaly_findings"])
+        self.assertEqual(answers[0], {"question": "攻击来源", "answer": "回答: 攻击来源", "error": None})
+        self.assertEqual(answers[1], {"question": "失败", "answer": None, "error": "LLM超时"})
+    
+    async def test_stream_analysis_short_circuit(self):
+        """测试没有命中时流式分析不调用LLM"""
+        normal = self.logs_df[~self.logs_df["source_ip"].isin(SUSPICIOUS_SOURCES)]
+        events = [event async for event in self.chain.astream_analysis(QUIET_STATS, normal, "最近7天")]
+        
+        self.assertEqual([name for name, _ in events], ["findings", "result"])
+        self.assertFalse(events[-1][1]["has_risk"])
+
+    async def test_stream_analysis_detects_in_thread(self):
+        """测试流式分析在线程中执行本地检测，不阻塞事件循环"""
+        with patch("security_agent.chains.security_analysis_chain.asyncio.to_thread",
+                   AsyncMock(return_value=[])) as to_thread:
+            events = [event async for event in self.chain.astream_analysis(QUIET_STATS, self.logs_df, "最近7天")]
+        
+        to_thread.assert_awaited_once_with(self.chain.detect, self.logs_df, None)
+        self.assertEqual(events[0], ("findings", []))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+内存缓存单元测试
+"""
+import unittest
+from unittest.mock import patch
+
+from security_agent.utils.cache import TTLCache
+
+class TestTTLCache(unittest.TestCase):
+    """TTLCache 单元测试"""
+    
+    def test_hit_and_miss(self):
+        """测试命中和未命中计数"""
+        cache = TTLCache(max_size=4)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+    
+    def test_lru_eviction(self):
+        """测试超过容量时淘汰最久未使用的条目"""
+        cache = TTLCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+    
+    def test_ttl_expiry(self):
+        """测试过期条目视为未命中"""
+        cache = TTLCache(max_size=2, ttl=10)
+        with patch("security_agent.utils.cache.time.monotonic", return_value=100.0):
+            cache.set("a", 1)
+        with patch("security_agent.utils.cache.time.monotonic", return_value=105.0):
+            self.assertEqual(cache.get("a"), 1)
+        with patch("security_agent.utils.cache.time.monotonic", return_value=111.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+if __name__ == "__main__":
+    unittest.main()
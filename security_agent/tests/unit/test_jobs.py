@@ -0,0 +1,155 @@
+"""
+后台任务子系统单元测试
+"""
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from security_agent.utils.jobs import FAILED, PENDING, RUNNING, SUCCEEDED, JobManager, JobStore
+
+class TestJobStore(unittest.TestCase):
+    """任务表测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "jobs.db")
+        self.store = JobStore(self.path)
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.tmpdir.cleanup()
+    
+    def test_claim_is_exclusive(self):
+        """测试每个任务只能被领取一次，按提交顺序领取"""
+        first = self.store.create("analyze", {"query": "第一个"})
+        second = self.store.create("analyze", {"query": "第二个"})
+        other = JobStore(self.path)
+        
+        claimed = self.store.claim("analyze")
+        self.assertEqual(claimed["id"], first["id"])
+        self.assertEqual(claimed["status"], RUNNING)
+        self.assertEqual(other.claim("analyze")["id"], second["id"])
+        self.assertIsNone(self.store.claim("analyze"))
+        self.assertIsNone(self.store.claim("report"))
+    
+    def test_finish_records_result_or_error(self):
+        """测试记录任务结果和错误"""
+        ok = self.store.create("report", {"report_type": "general"})
+        bad = self.store.create("report", {"report_type": "attack"})
+        self.store.finish(ok["id"], result={"report_content": "正常"})
+        self.store.finish(bad["id"], error="数据库不可用")
+        
+        self.assertEqual(self.store.get(ok["id"])["status"], SUCCEEDED)
+        self.assertEqual(self.store.get(ok["id"])["result"], {"report_content": "正常"})
+        self.assertEqual(self.store.get(bad["id"])["status"], FAILED)
+        self.assertEqual(self.store.get(bad["id"])["error"], "数据库不可用")
+        self.assertIsNone(self.store.get("missing"))
+        self.assertEqual(self.store.counts(), {"report": {SUCCEEDED: 1, FAILED: 1}})
+    
+    def test_requeue_stale_and_prune(self):
+        """测试心跳超时的任务重新等待，过期的已完成任务被删除"""
+        job = self.store.create("analyze", {"query": "前8小时"})
+        self.store.claim("analyze")
+        self.assertEqual(self.store.requeue_stale(60), 0)
+        time.sleep(0.05)
+        self.assertEqual(self.store.requeue_stale(0.01), 1)
+        self.assertEqual(self.store.get(job["id"])["status"], PENDING)
+        
+        self.store.claim("analyze")
+        self.store.finish(job["id"], result={})
+        self.assertEqual(self.store.prune(3600), 0)
+        time.sleep(0.05)
+        self.assertEqual(self.store.prune(0.01), 1)
+        self.assertIsNone(self.store.get(job["id"]))
+
+class TestJobManager(unittest.IsolatedAsyncioTestCase):
+    """任务执行器测试"""
+    
+    async def asyncSetUp(self):
+        """测试前准备"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = JobStore(os.path.join(self.tmpdir.name, "jobs.db"))
+        self.release = asyncio.Event()
+        self.running = 0
+        self.max_running = 0
+    
+    async def asyncTearDown(self):
+        """测试后清理"""
+        self.tmpdir.cleanup()
+    
+    async def _analyze(self, params):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await self.release.wait()
+            if params["query"] == "失败":
+                raise RuntimeError("分析失败")
+            return {"analysis": params["query"]}
+        finally:
+            self.running -= 1
+    
+    def _manager(self, **options):
+        return JobManager(self.store, handlers={"analyze": self._analyze}, poll_interval=0.05, **options)
+    
+    async def _wait_for(self, manager, job_id, status):
+        for _ in range(100):
+            job = await manager.get(job_id)
+            if job["status"] == status:
+                return job
+            await asyncio.sleep(0.02)
+        self.fail(f"任务 {job_id} 未变为 {status}")
+    
+    async def test_jobs_run_with_concurrency_limit(self):
+        """测试任务在后台执行，同时执行的任务数不超过并发上限"""
+        manager = self._manager(concurrency={"analyze": 2})
+        await manager.start()
+        try:
+            jobs = [await manager.submit("analyze", {"query": f"查询{i}"}) for i in range(4)]
+            jobs.append(await manager.submit("analyze", {"query": "失败"}))
+            self.assertEqual(jobs[0]["status"], PENDING)
+            
+            await self._wait_for(manager, jobs[1]["id"], RUNNING)
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.running, 2)
+            self.assertEqual((await manager.stats())["analyze"]["running_here"], 2)
+            
+            self.release.set()
+            for i, job in enumerate(jobs[:4]):
+                finished = await self._wait_for(manager, job["id"], SUCCEEDED)
+                self.assertEqual(finished["result"], {"analysis": f"查询{i}"})
+            failed = await self._wait_for(manager, jobs[4]["id"], FAILED)
+            self.assertEqual(failed["error"], "分析失败")
+            self.assertEqual(self.max_running, 2)
+        finally:
+            await manager.stop()
+        
+        with self.assertRaises(ValueError):
+            await manager.submit("unknown", {})
+    
+    async def test_interrupted_job_resumes_after_restart(self):
+        """测试执行器停止时运行中的任务在重新启动后被重新执行"""
+        manager = self._manager(concurrency={"analyze": 1})
+        await manager.start()
+        job = await manager.submit("analyze", {"query": "前8小时"})
+        await self._wait_for(manager, job["id"], RUNNING)
+        await manager.stop()
+        self.assertEqual(self.store.get(job["id"])["status"], RUNNING)
+        
+        await asyncio.sleep(0.05)
+        restarted = JobManager(
+            JobStore(self.store.path), handlers={"analyze": self._analyze}, concurrency={"analyze": 1},
+            poll_interval=0.05, heartbeat_seconds=0.01
+        )
+        self.release.set()
+        await restarted.start()
+        try:
+            finished = await self._wait_for(restarted, job["id"], SUCCEEDED)
+            self.assertEqual(finished["result"], {"analysis": "前8小时"})
+        finally:
+            await restarted.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+LLM响应持久化缓存单元测试
+"""
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+from security_agent.config import settings
+from security_agent.utils.llm_cache import SQLiteLLMCache
+
+def _generations(text):
+    return [ChatGeneration(message=AIMessage(content=text))]
+
+class TestSQLiteLLMCache(unittest.IsolatedAsyncioTestCase):
+    """LLM响应缓存测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "llm_cache.db")
+        self.cache = SQLiteLLMCache(self.path, max_entries=3)
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.tmpdir.cleanup()
+    
+    def test_round_trip_and_stats(self):
+        """测试写入后命中，并按命名空间统计命中率"""
+        self.assertIsNone(self.cache.get("sql_generation", "prompt", "qwen-plus"))
+        self.cache.set("sql_generation", "prompt", "qwen-plus", _generations("SELECT 1"))
+        
+        cached = self.cache.get("sql_generation", "prompt", "qwen-plus")
+        self.assertEqual(cached[0].message.content, "SELECT 1")
+        self.assertIsNone(self.cache.get("sql_generation", "prompt", "qwen-turbo"))
+        self.assertIsNone(self.cache.get("time_range", "prompt", "qwen-plus"))
+        
+        stats = self.cache.stats()["namespaces"]["sql_generation"]
+        self.assertEqual((stats["size"], stats["hits"], stats["misses"], stats["writes"]), (1, 1, 2, 1))
+        self.assertAlmostEqual(stats["hit_rate"], 1 / 3)
+    
+    def test_shared_between_instances(self):
+        """测试缓存保存在文件中，其他进程（实例）可以读取"""
+        self.cache.set("sql_generation", "prompt", "qwen-plus", _generations("SELECT 1"))
+        other = SQLiteLLMCache(self.path)
+        self.assertEqual(other.get("sql_generation", "prompt", "qwen-plus")[0].text, "SELECT 1")
+    
+    def test_namespace_views_are_shared(self):
+        """测试相同的命名空间和有效期返回同一个缓存视图"""
+        self.assertIs(self.cache.namespace("sql_generation", 60), self.cache.namespace("sql_generation", 60))
+        self.assertIsNot(self.cache.namespace("sql_generation", 60), self.cache.namespace("sql_generation", 30))
+        self.assertIsNot(self.cache.namespace("sql_generation", 60), self.cache.namespace("time_range", 60))
+    
+    def test_default_path_opened_lazily(self):
+        """测试未指定路径时在首次使用时才读取配置中的路径并创建文件"""
+        cache = SQLiteLLMCache()
+        with patch.object(settings, "LLM_CACHE_PATH", self.path):
+            self.assertFalse(os.path.exists(self.path))
+            cache.set("sql_generation", "prompt", "qwen-plus", _generations("SELECT 1"))
+        self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(self.cache.get("sql_generation", "prompt", "qwen-plus")[0].text, "SELECT 1")
+    
+    def test_ttl(self):
+        """测试过期条目视为未命中并被删除"""
+        self.cache.set("time_range", "prompt", "qwen-plus", _generations("{}"), ttl=60)
+        with patch("security_agent.utils.llm_cache.time.time", return_value=time.time() + 120):
+            self.assertIsNone(self.cache.get("time_range", "prompt", "qwen-plus"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+        
+        self.cache.set("time_range", "old", "qwen-plus", _generations("{}"), ttl=-1)
+        self.cache.set("time_range", "new", "qwen-plus", _generations("{}"), ttl=60)
+        self.assertEqual(self.cache.prune(), 1)
+    
+    def test_size_eviction(self):
+        """测试超过最大条目数时淘汰最久未访问的条目"""
+        for i in range(3):
+            self.cache.set("sql_generation", f"prompt{i}", "qwen-plus", _generations(str(i)))
+            time.sleep(0.01)
+        self.cache.get("sql_generation", "prompt0", "qwen-plus")
+        self.cache.set("sql_generation", "prompt3", "qwen-plus", _generations("3"))
+        
+        self.assertIsNotNone(self.cache.get("sql_generation", "prompt0", "qwen-plus"))
+        self.assertIsNone(self.cache.get("sql_generation", "prompt1", "qwen-plus"))
+        self.assertEqual(self.cache.stats()["size"], 3)
+        self.assertEqual(self.cache.stats()["namespaces"]["sql_generation"]["evictions"], 1)
+    
+    async def test_chat_model_uses_cache(self):
+        """测试作为聊天模型的 cache 参数时，相同的提示只调用一次模型"""
+        model = FakeListChatModel(responses=["SELECT 1", "SELECT 2"], cache=self.cache.namespace("sql_generation", ttl=60))
+        first = await model.ainvoke("统计最近一小时的日志")
+        second = await model.ainvoke("统计最近一小时的日志")
+        third = await model.ainvoke("统计最近一天的日志")
+        
+        self.assertEqual((first.content, second.content, third.content), ("SELECT 1", "SELECT 1", "SELECT 2"))
+        self.assertEqual(self.cache.stats()["namespaces"]["sql_generation"]["hits"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
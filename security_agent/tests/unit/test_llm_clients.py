@@ -0,0 +1,70 @@
+"""
+LLM客户端注册表单元测试
+"""
+import unittest
+from unittest.mock import patch
+
+from security_agent.utils.llm_cache import SQLiteLLMCache
+from security_agent.utils.llm_clients import LLMClientRegistry
+
+BASE_URL = "https://llm.example.com/v1"
+
+class TestLLMClientRegistry(unittest.IsolatedAsyncioTestCase):
+    """LLM客户端注册表测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.registry = LLMClientRegistry(max_connections=8, max_keepalive_connections=4, http2=False)
+    
+    async def asyncTearDown(self):
+        """测试后清理"""
+        await self.registry.aclose_all()
+    
+    def test_same_model_is_shared(self):
+        """测试相同的模型和地址返回同一个实例"""
+        first = self.registry.get_chat_model("fake_api_key", "qwen-plus", BASE_URL)
+        second = self.registry.get_chat_model("fake_api_key", "qwen-plus", BASE_URL)
+        self.assertIs(first, second)
+        
+        other = self.registry.get_chat_model("fake_api_key", "qwen-plus", BASE_URL, temperature=0)
+        self.assertIsNot(first, other)
+    
+    def test_same_cache_namespace_is_shared(self):
+        """测试使用同一缓存命名空间的链共享同一个实例"""
+        cache = SQLiteLLMCache("unused.db")
+        first = self.registry.get_chat_model("fake_api_key", "qwen-plus", BASE_URL, cache=cache.namespace("sql_generation", 60))
+        second = self.registry.get_chat_model("fake_api_key", "qwen-plus", BASE_URL, cache=cache.namespace("sql_generation", 60))
+        other = self.registry.get_chat_model("fake_api_key", "qwen-plus", BASE_URL, cache=cache.namespace("time_range", 60))
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+    
+    def test_http_clients_shared_per_base_url(self):
+        """测试同一地址的不同模型共用连接池"""
+        plus = self.registry.get_chat_model("fake_api_key", "qwen-plus", BASE_URL)
+        turbo = self.registry.get_chat_model("fake_api_key", "qwen-turbo", BASE_URL)
+        other = self.registry.get_chat_model("fake_api_key", "qwen-plus", "https://other.example.com/v1")
+        
+        self.assertIs(plus.http_async_client, turbo.http_async_client)
+        self.assertIs(plus.http_client, turbo.http_client)
+        self.assertIsNot(plus.http_async_client, other.http_async_client)
+        self.assertEqual(len(self.registry.stats()["base_urls"]), 2)
+        self.assertEqual(self.registry.stats()["max_connections"], 8)
+    
+    async def test_warm_up_failure_is_ignored(self):
+        """测试预热失败不抛出异常"""
+        model = self.registry.get_chat_model("fake_api_key", "qwen-plus", BASE_URL)
+        with patch.object(model.http_async_client, "head", side_effect=OSError("连接失败")) as mock_head:
+            await self.registry.warm_up(timeout=1)
+        mock_head.assert_awaited_once()
+    
+    async def test_aclose_all(self):
+        """测试关闭后清空模型并关闭HTTP客户端"""
+        model = self.registry.get_chat_model("fake_api_key", "qwen-plus", BASE_URL)
+        await self.registry.aclose_all()
+        
+        self.assertTrue(model.http_async_client.is_closed)
+        self.assertEqual(self.registry.stats()["models"], [])
+        self.assertIsNot(self.registry.get_chat_model("fake_api_key", "qwen-plus", BASE_URL), model)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+日志采样单元测试
+"""
+import unittest
+
+import pandas as pd
+
+from security_agent.utils.log_sampler import (
+    REPEAT_COLUMN, _row_text, collapse_duplicates, estimate_tokens, sample_logs
+)
+
+def _make_logs():
+    """大量重复的低危扫描日志，夹杂少量高危事件和一个异常活跃的源IP"""
+    rows = []
+    for i in range(300):
+        rows.append({
+            "id": len(rows) + 1,
+            "event_time": f"2025-03-01 10:{i % 60:02d}:00",
+            "source_ip": f"192.168.1.{i % 30}",
+            "destination_ip": "10.0.0.1",
+            "event_type": "port_scan",
+            "severity": "低",
+            "destination_port": 1000 + i,
+        })
+    for i in range(200):
+        rows.append({
+            "id": len(rows) + 1,
+            "event_time": f"2025-03-01 11:{i % 60:02d}:00",
+            "source_ip": "203.0.113.42",
+            "destination_ip": "10.0.0.2",
+            "event_type": "login_failure",
+            "severity": "中",
+            "destination_port": 22,
+        })
+    rows.append({
+        "id": len(rows) + 1,
+        "event_time": "2025-03-01 12:00:00",
+        "source_ip": "198.51.100.7",
+        "destination_ip": "10.0.0.3",
+        "event_type": "malware",
+        "severity": "严重",
+        "destination_port": 445,
+    })
+    return pd.DataFrame(rows)
+
+class TestLogSampler(unittest.TestCase):
+    """日志采样测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.logs_df = _make_logs()
+    
+    def test_estimate_tokens(self):
+        """测试token估算"""
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("abcdefgh"), 2)
+        self.assertEqual(estimate_tokens("高危"), 2)
+    
+    def test_collapse_duplicates(self):
+        """测试合并重复日志并记录重复次数"""
+        collapsed = collapse_duplicates(self.logs_df)
+        login_failures = collapsed[collapsed["event_type"] == "login_failure"]
+        self.assertEqual(len(login_failures), 1)
+        self.assertEqual(int(login_failures[REPEAT_COLUMN].iloc[0]), 200)
+        self.assertEqual(int(collapsed[REPEAT_COLUMN].sum()), len(self.logs_df))
+    
+    def test_sample_respects_budget(self):
+        """测试样本不超过token预算"""
+        sample = sample_logs(self.logs_df, token_budget=300)
+        used = sum(estimate_tokens(_row_text(row)) for _, row in sample.iterrows())
+        self.assertLessEqual(used, 300)
+        self.assertLess(len(sample), len(self.logs_df))
+    
+    def test_sample_covers_rare_events_and_outliers(self):
+        """测试罕见的高危事件和异常活跃的源IP出现在样本中"""
+        sample = sample_logs(self.logs_df, token_budget=200)
+        self.assertIn("malware", sample["event_type"].tolist())
+        self.assertIn("203.0.113.42", sample["source_ip"].tolist())
+    
+    def test_sample_is_deterministic(self):
+        """测试相同种子得到相同样本"""
+        first = sample_logs(self.logs_df, token_budget=500, seed=7)
+        second = sample_logs(self.logs_df, token_budget=500, seed=7)
+        self.assertEqual(first["id"].tolist(), second["id"].tolist())
+    
+    def test_sample_empty(self):
+        """测试空数据"""
+        sample = sample_logs(self.logs_df.iloc[0:0])
+        self.assertTrue(sample.empty)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+日志统计单元测试
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+
+import pandas as pd
+
+from security_agent.chains.log_processor_chain import LogProcessorChain
+from security_agent.chains.sql_templates import SQLTemplateLibrary
+from security_agent.utils.engine_registry import EngineRegistry
+from security_agent.utils.log_stats import compute_log_statistics, fetch_log_statistics
+from security_agent.utils.query_executor import AsyncQueryExecutor
+
+class TestLogStatistics(unittest.TestCase):
+    """日志统计测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.logs_df = pd.DataFrame([
+            {"source_ip": "203.0.113.42", "destination_ip": "10.0.0.1", "event_type": "端口扫描", "severity": "高"},
+            {"source_ip": "203.0.113.42", "destination_ip": "10.0.0.2", "event_type": "端口扫描", "severity": "高"},
+            {"source_ip": "203.0.113.42", "destination_ip": "10.0.0.3", "event_type": "端口扫描", "severity": "中"},
+            {"source_ip": "192.168.1.10", "destination_ip": "10.0.0.1", "event_type": "登录失败", "severity": "中"},
+            {"source_ip": "192.168.1.11", "destination_ip": "10.0.0.1", "event_type": "登录成功", "severity": "低"},
+        ])
+    
+    def test_exact_counts(self):
+        """测试统计结果精确"""
+        stats = compute_log_statistics(self.logs_df)
+        
+        self.assertEqual(stats["total_logs"], 5)
+        self.assertEqual(stats["event_types"], {"端口扫描": 3, "登录失败": 1, "登录成功": 1})
+        self.assertEqual(stats["severity_levels"], {"高": 2, "中": 2, "低": 1})
+        self.assertEqual(stats["unique_source_ips"], 3)
+        self.assertEqual(stats["unique_dest_ips"], 3)
+        self.assertEqual(stats["top_source_ips"][0], {"source_ip": "203.0.113.42", "count": 3})
+        self.assertEqual(stats["top_event_types"][0], {"event_type": "端口扫描", "count": 3})
+    
+    def test_top_n(self):
+        """测试排行长度"""
+        stats = compute_log_statistics(self.logs_df, top_n=2)
+        self.assertEqual(len(stats["top_source_ips"]), 2)
+    
+    def test_json_serializable(self):
+        """测试结果可以直接序列化为JSON"""
+        json.dumps(compute_log_statistics(self.logs_df), ensure_ascii=False)
+    
+    def test_empty_and_missing_columns(self):
+        """测试空数据和缺少列的数据"""
+        stats = compute_log_statistics(pd.DataFrame())
+        self.assertEqual(stats["total_logs"], 0)
+        self.assertEqual(stats["top_source_ips"], [])
+        
+        stats = compute_log_statistics(pd.DataFrame([{"result": "[]"}]))
+        self.assertEqual(stats["total_logs"], 1)
+        self.assertEqual(stats["event_types"], {})
+
+class TestFetchLogStatistics(unittest.IsolatedAsyncioTestCase):
+    """数据库聚合统计测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.temp_db_file.close()
+        db_connection = f"sqlite:///{self.temp_db_file.name}"
+        
+        self.engines = EngineRegistry()
+        self.logs_df = pd.DataFrame([
+            {"event_time": "2025-03-01 01:00:00", "source_ip": "203.0.113.42", "destination_ip": "10.0.0.1", "event_type": "端口扫描", "severity": "高"},
+            {"event_time": "2025-03-01 02:00:00", "source_ip": "203.0.113.42", "destination_ip": "10.0.0.2", "event_type": "端口扫描", "severity": "高"},
+            {"event_time": "2025-03-01 03:00:00", "source_ip": "192.168.1.10", "destination_ip": "10.0.0.1", "event_type": "登录失败", "severity": "中"},
+            {"event_time": "2025-03-02 03:00:00", "source_ip": "192.168.1.99", "destination_ip": "10.0.0.9", "event_type": "登录成功", "severity": "低"},
+        ])
+        self.logs_df.to_sql("security_logs", self.engines.get_engine(db_connection), index=False)
+        
+        self.executor = AsyncQueryExecutor(self.engines.get_async_engine(db_connection))
+        self.templates = SQLTemplateLibrary("security_logs", dialect="sqlite")
+        self.time_range = {"start_time": "2025-03-01 00:00:00", "end_time": "2025-03-01 23:59:59"}
+    
+    async def asyncTearDown(self):
+        """测试后清理"""
+        await self.engines.dispose_all()
+        os.unlink(self.temp_db_file.name)
+    
+    async def test_matches_local_statistics(self):
+        """测试数据库聚合结果与本地计算一致"""
+        stats = await fetch_log_statistics(self.executor, self.templates, self.time_range)
+        expected = compute_log_statistics(self.logs_df.iloc[:3])
+        
+        self.assertEqual(stats, expected)
+    
+    async def test_empty_window(self):
+        """测试时间窗口内没有日志"""
+        stats = await fetch_log_statistics(
+            self.executor,
+            self.templates,
+            {"start_time": "2024-01-01 00:00:00", "end_time": "2024-01-01 23:59:59"}
+        )
+        self.assertEqual(stats["total_logs"], 0)
+        self.assertEqual(stats["event_types"], {})
+
+class TestLogProcessorChain(unittest.IsolatedAsyncioTestCase):
+    """日志处理链测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.patcher = patch('security_agent.chains.log_processor_chain.llm_registry')
+        self.patcher.start()
+        self.logs_df = pd.DataFrame([{"source_ip": "203.0.113.42", "event_type": "端口扫描"}])
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.patcher.stop()
+    
+    async def test_local_statistics_by_default(self):
+        """测试默认在本地计算，不调用LLM"""
+        chain = LogProcessorChain("fake_api_key")
+        chain.chain = MagicMock()
+        chain.chain.ainvoke = AsyncMock()
+        
+        result = await chain.process_logs(self.logs_df, "最近1小时")
+        
+        self.assertEqual(result["total_logs"], 1)
+        chain.chain.ainvoke.assert_not_called()
+    
+    async def test_llm_failure_falls_back_to_local(self):
+        """测试开启LLM后失败时返回本地统计"""
+        chain = LogProcessorChain("fake_api_key", use_llm=True)
+        chain.chain = MagicMock()
+        chain.chain.ainvoke = AsyncMock(side_effect=Exception("LLM不可用"))
+        
+        result = await chain.process_logs(self.logs_df, "最近1小时")
+        
+        self.assertEqual(result["unique_source_ips"], 1)
+        self.assertEqual(result["error"], "LLM不可用")
+
+if __name__ == "__main__":
+    unittest.main()
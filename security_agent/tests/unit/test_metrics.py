@@ -0,0 +1,124 @@
+"""
+进程内指标单元测试
+"""
+import unittest
+from uuid import uuid4
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.outputs import LLMResult
+from langchain_core.prompts import ChatPromptTemplate
+from sqlalchemy import create_engine
+
+from security_agent.utils.metrics import (
+    CACHE_REQUESTS, LLM_DURATION, LLM_ERRORS, LLM_TOKENS, SQL_ROWS, STAGE_DURATION, STAGE_ERRORS,
+    LLMMetricsHandler, MetricsRegistry, llm_callbacks, observe_stage, record_cache, timed_stage
+)
+from security_agent.utils.query_executor import QueryExecutor
+
+class TestMetricsRegistry(unittest.TestCase):
+    """指标注册表测试"""
+    
+    def test_render_prometheus_text(self):
+        """测试计数器和直方图按 Prometheus 文本格式输出"""
+        registry = MetricsRegistry()
+        counter = registry.counter("requests_total", "请求数", ["path"])
+        histogram = registry.histogram("latency_seconds", "耗时", ["stage"], buckets=(0.1, 1))
+        counter.inc(path='/api/"x"')
+        counter.inc(2, path='/api/"x"')
+        histogram.observe(0.05, stage="sql")
+        histogram.observe(0.5, stage="sql")
+        histogram.observe(5, stage="sql")
+        
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE requests_total counter", lines)
+        self.assertIn('requests_total{path="/api/\\"x\\""} 3', lines)
+        self.assertIn("# TYPE latency_seconds histogram", lines)
+        self.assertIn('latency_seconds_bucket{stage="sql",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{stage="sql",le="1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{stage="sql",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{stage="sql"} 5.55', lines)
+        self.assertIn('latency_seconds_count{stage="sql"} 3', lines)
+    
+    def test_invalid_labels_and_duplicates(self):
+        """测试标签不一致和重复注册时抛出异常"""
+        registry = MetricsRegistry()
+        counter = registry.counter("errors_total", "错误数", ["stage"])
+        with self.assertRaises(ValueError):
+            counter.inc(path="/")
+        with self.assertRaises(ValueError):
+            registry.counter("errors_total", "错误数")
+
+class TestStageMetrics(unittest.IsolatedAsyncioTestCase):
+    """阶段耗时、SQL、LLM和缓存指标测试"""
+    
+    async def test_timed_stage_records_latency_and_errors(self):
+        """测试装饰器记录耗时，抛出异常时增加错误次数"""
+        @timed_stage("test_stage")
+        async def work(fail=False):
+            if fail:
+                raise RuntimeError("失败")
+            return "完成"
+        
+        count = STAGE_DURATION.count(stage="test_stage")
+        errors = STAGE_ERRORS.value(stage="test_stage")
+        self.assertEqual(await work(), "完成")
+        with self.assertRaises(RuntimeError):
+            await work(fail=True)
+        with self.assertRaises(KeyError), observe_stage("test_stage"):
+            raise KeyError("缺少字段")
+        
+        self.assertEqual(STAGE_DURATION.count(stage="test_stage"), count + 3)
+        self.assertEqual(STAGE_ERRORS.value(stage="test_stage"), errors + 2)
+    
+    def test_query_executor_records_rows(self):
+        """测试执行查询时记录耗时和取回的行数"""
+        engine = create_engine("sqlite://")
+        count = SQL_ROWS.count()
+        rows = SQL_ROWS.sum()
+        executions = STAGE_DURATION.count(stage="sql_execution")
+        QueryExecutor(engine).execute("SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3")
+        engine.dispose()
+        
+        self.assertEqual(SQL_ROWS.count(), count + 1)
+        self.assertEqual(SQL_ROWS.sum(), rows + 3)
+        self.assertEqual(STAGE_DURATION.count(stage="sql_execution"), executions + 1)
+    
+    async def test_llm_callbacks_record_latency(self):
+        """测试绑定到链上的回调记录LLM调用耗时"""
+        llm = FakeListChatModel(responses=["回答"])
+        chain = (ChatPromptTemplate.from_template("{question}") | llm).with_config(callbacks=llm_callbacks("test_llm"))
+        count = LLM_DURATION.count(stage="test_llm")
+        await chain.ainvoke({"question": "问题"})
+        
+        self.assertEqual(LLM_DURATION.count(stage="test_llm"), count + 1)
+    
+    def test_llm_handler_records_tokens_and_errors(self):
+        """测试回调记录 token 用量和错误次数，没有 llm_output（缓存命中）时不计 token"""
+        handler = LLMMetricsHandler("test_tokens")
+        run_id = uuid4()
+        handler.on_chat_model_start({}, [[]], run_id=run_id)
+        handler.on_llm_end(
+            LLMResult(generations=[[]], llm_output={"token_usage": {"prompt_tokens": 120, "completion_tokens": 30}}),
+            run_id=run_id
+        )
+        handler.on_chat_model_start({}, [[]], run_id=run_id)
+        handler.on_llm_end(LLMResult(generations=[[]]), run_id=run_id)
+        handler.on_chat_model_start({}, [[]], run_id=run_id)
+        handler.on_llm_error(RuntimeError("超时"), run_id=run_id)
+        
+        self.assertEqual(LLM_TOKENS.value(stage="test_tokens", type="prompt"), 120)
+        self.assertEqual(LLM_TOKENS.value(stage="test_tokens", type="completion"), 30)
+        self.assertEqual(LLM_ERRORS.value(stage="test_tokens"), 1)
+        self.assertEqual(LLM_DURATION.count(stage="test_tokens"), 3)
+    
+    def test_record_cache(self):
+        """测试记录缓存命中和未命中"""
+        record_cache("test_cache", True)
+        record_cache("test_cache", False)
+        record_cache("test_cache", True)
+        
+        self.assertEqual(CACHE_REQUESTS.value(cache="test_cache", result="hit"), 2)
+        self.assertEqual(CACHE_REQUESTS.value(cache="test_cache", result="miss"), 1)
+
+if __name__ == "__main__":
+    unittest.main()
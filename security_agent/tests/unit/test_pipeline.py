@@ -0,0 +1,212 @@
+"""
+阶段图和分析流程并发执行单元测试
+"""
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import pandas as pd
+
+from security_agent.chains.security_agent_chain import SecurityAgentChain
+from security_agent.chains.sql_templates import SQLTemplateLibrary
+from security_agent.utils.pipeline import StageGraph
+from security_agent.utils.singleflight import SingleFlight
+from security_agent.utils.time_grammar import TIME_FORMAT
+
+class TestStageGraph(unittest.IsolatedAsyncioTestCase):
+    """阶段图测试"""
+    
+    async def test_dependencies_and_concurrency(self):
+        """测试依赖结果按参数名传入，没有依赖关系的阶段并发执行"""
+        running = set()
+        overlapped = []
+        
+        async def stage(name, value):
+            running.add(name)
+            await asyncio.sleep(0.01)
+            overlapped.append(set(running))
+            running.discard(name)
+            return value
+        
+        graph = StageGraph("测试")
+        graph.add("a", lambda: stage("a", 1))
+        graph.add("b", lambda: stage("b", 2))
+        graph.add("sum", lambda a, b: a + b, deps=["a", "b"])
+        result = await graph.run()
+        
+        self.assertEqual(result.results, {"a": 1, "b": 2, "sum": 3})
+        self.assertIn({"a", "b"}, overlapped)
+        self.assertEqual(set(result.timings), {"a", "b", "sum", "total"})
+        self.assertGreaterEqual(result.timings["a"], 0.01)
+    
+    async def test_failure_cancels_other_stages(self):
+        """测试任一阶段失败时取消其余阶段并抛出异常"""
+        slow = asyncio.Event()
+        
+        async def fail():
+            raise ValueError("查询失败")
+        
+        async def wait_forever():
+            await slow.wait()
+        
+        graph = StageGraph("测试")
+        graph.add("fail", fail)
+        graph.add("slow", wait_forever)
+        with self.assertRaises(ValueError):
+            await graph.run()
+        self.assertTrue(graph._tasks["slow"].cancelled())
+    
+    async def test_cancel_stage(self):
+        """测试取消的阶段结果为 None，不影响其他阶段"""
+        graph = StageGraph("测试")
+        graph.add("prefetch", lambda: asyncio.sleep(10))
+        graph.add("decide", lambda: graph.cancel("prefetch"))
+        result = await graph.run()
+        self.assertIsNone(result.results["prefetch"])
+    
+    def test_unknown_dependency(self):
+        """测试依赖未定义的阶段时报错"""
+        with self.assertRaises(ValueError):
+            StageGraph("测试").add("b", lambda a: a, deps=["a"])
+
+class TestSingleFlightCancellation(unittest.IsolatedAsyncioTestCase):
+    """并发请求合并的取消测试"""
+    
+    async def test_all_callers_cancelled(self):
+        """测试所有调用方都取消后计算也被取消"""
+        inflight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+        
+        async def work():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        
+        caller = asyncio.create_task(inflight.do("key", work))
+        await started.wait()
+        caller.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.sleep(0)
+        self.assertEqual(inflight.in_flight(), 0)
+
+class TestSecurityAgentChainPipeline(unittest.IsolatedAsyncioTestCase):
+    """安全代理链分析流程测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.chain = SecurityAgentChain.__new__(SecurityAgentChain)
+        self.chain.inflight = SingleFlight()
+        self.chain.speculative_hours = 24
+        self.chain.speculative_tolerance = timedelta(seconds=60)
+        self.chain.coalesce_bucket_seconds = 60
+        self.chain.time_parser = MagicMock()
+        self.logs_df = pd.DataFrame({"id": [1, 2]})
+        self.chain._fetch_data = AsyncMock(return_value=({"total_logs": 2}, self.logs_df, self.logs_df))
+        
+        analyzer = MagicMock()
+        analyzer.detect.return_value = []
+        analyzer.encode_sample.return_value = "样本"
+        analyzer.analyze_prepared = AsyncMock(return_value={
+            "has_risk": False,
+            "risk_level": "无",
+            "analysis": "未发现风险",
+            "recommendations": [],
+        })
+        self.chain.security_analyzer = analyzer
+    
+    def _time_range(self, hours):
+        end_time = datetime.now().replace(microsecond=0)
+        start_time = end_time - timedelta(hours=hours)
+        return {
+            "start_time": start_time.strftime(TIME_FORMAT),
+            "end_time": end_time.strftime(TIME_FORMAT),
+            "formatted_range": f"{start_time.strftime(TIME_FORMAT)} 至 {end_time.strftime(TIME_FORMAT)}",
+        }
+    
+    async def test_default_window_uses_prefetched_data(self):
+        """测试解析出默认时间窗口时使用预取的数据，不再重新查询"""
+        self.chain.time_parser.parse_time_range = AsyncMock(return_value=self._time_range(24))
+        result = await self.chain.run("最近的网络安全状况")
+        
+        self.chain._fetch_data.assert_awaited_once()
+        self.chain.security_analyzer.encode_sample.assert_called_once_with(self.logs_df)
+        self.chain.security_analyzer.analyze_prepared.assert_awaited_once_with({"total_logs": 2}, result["time_range"], [], "样本")
+        self.assertFalse(result["has_risk"])
+        for stage in ("time_range", "speculative_fetch", "data", "findings", "sample", "llm_analysis", "total"):
+            self.assertIn(stage, result["timings"])
+    
+    async def test_other_window_fetches_again(self):
+        """测试问题中的时间描述不是默认时间窗口时不预取，只查询该窗口"""
+        time_range = self._time_range(8)
+        self.chain.time_parser.parse_time_range = AsyncMock(return_value=time_range)
+        result = await self.chain.run("前8小时是否有网络安全攻击风险")
+        
+        self.chain._fetch_data.assert_awaited_once_with(time_range)
+        self.assertEqual(result["time_range"], time_range["formatted_range"])
+        self.assertNotIn("speculative_fetch", result["timings"])
+    
+    async def test_without_speculation(self):
+        """测试关闭预取时只查询解析出的时间窗口"""
+        self.chain.speculative_hours = None
+        self.chain.time_parser.parse_time_range = AsyncMock(return_value=self._time_range(24))
+        result = await self.chain.run("最近的网络安全状况")
+        
+        self.chain._fetch_data.assert_awaited_once()
+        self.assertNotIn("speculative_fetch", result["timings"])
+
+    async def test_batch_shares_one_fetch(self):
+        """测试批量分析只解析一次时间范围、取回一次数据，所有问题共享检测结果和样本"""
+        time_range = self._time_range(8)
+        questions = ["是否有网络安全攻击风险", "登录失败最多的IP有哪些", "是否有数据外泄"]
+        self.chain.batch_concurrency = 2
+        self.chain.time_parser.parse_time_range = AsyncMock(return_value=time_range)
+        self.chain.security_analyzer.answer_questions = AsyncMock(return_value=[
+            {"question": question, "answer": "回答", "error": None} for question in questions
+        ])
+        result = await self.chain.run_batch(questions, "前8小时")
+        
+        self.chain.time_parser.parse_time_range.assert_awaited_once_with("前8小时")
+        self.chain._fetch_data.assert_awaited_once_with(time_range)
+        self.chain.security_analyzer.detect.assert_called_once()
+        self.chain.security_analyzer.answer_questions.assert_awaited_once_with(
+            questions, {"total_logs": 2}, time_range["formatted_range"], [], "样本", max_concurrency=2
+        )
+        self.assertEqual(result["time_range"], time_range["formatted_range"])
+        self.assertEqual(len(result["answers"]), 3)
+        self.assertIn("answers", result["timings"])
+    
+    async def test_batch_failure_returns_error(self):
+        """测试批量分析取回数据失败时返回错误信息"""
+        self.chain.time_parser.parse_time_range = AsyncMock(return_value=self._time_range(8))
+        self.chain._fetch_data = AsyncMock(side_effect=Exception("数据库不可用"))
+        result = await self.chain.run_batch(["前8小时是否有网络安全攻击风险"])
+        
+        self.assertIn("数据库不可用", result["error"])
+
+    async def test_truncated_detection_frame_is_marked(self):
+        """测试异常检测数据达到条数上限时在统计副本中标记"""
+        stats = {"total_logs": 5}
+        chain = SecurityAgentChain.__new__(SecurityAgentChain)
+        chain.inflight = SingleFlight()
+        chain.coalesce_bucket_seconds = 60
+        chain.summary_mode = True
+        chain.sql_templates = SQLTemplateLibrary("security_logs", default_limit=2)
+        chain._fetch_statistics = AsyncMock(return_value=stats)
+        chain._fetch_detail_sample = AsyncMock(return_value=self.logs_df)
+        chain._fetch_detection_frame = AsyncMock(return_value=self.logs_df)
+        
+        processed_data, _, _ = await chain._fetch_data(self._time_range(8))
+        self.assertEqual(processed_data, {"total_logs": 5, "detection_truncated": True})
+        self.assertEqual(stats, {"total_logs": 5})
+        
+        chain.sql_templates = SQLTemplateLibrary("security_logs")
+        processed_data, _, _ = await chain._fetch_data(self._time_range(4))
+        self.assertNotIn("detection_truncated", processed_data)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+日志提示编码单元测试
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from security_agent.utils.prompt_codec import FIELD_SEPARATOR, encode_logs
+
+class TestPromptCodec(unittest.TestCase):
+    """日志提示编码测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.logs_df = pd.DataFrame({
+            "id": range(1, 101),
+            "timestamp": pd.date_range("2025-03-01 10:00:00", periods=100, freq="min"),
+            "source_ip": ["203.0.113.42"] * 90 + [f"192.168.1.{i}" for i in range(10)],
+            "event_type": ["login_failure"] * 100,
+            "severity": ["中"] * 100,
+            "destination_port": [22] * 100,
+            "user_id": [np.nan] * 100,
+            "raw_log": ["sshd[1234]: Failed password for root from 203.0.113.42 port 52144 ssh2 | retry"] * 100,
+        })
+    
+    def _table(self, text):
+        """返回表头和数据行"""
+        lines = text.splitlines()
+        header_index = next(i for i, line in enumerate(lines) if line.startswith("id" + FIELD_SEPARATOR))
+        return lines[header_index].split(FIELD_SEPARATOR), lines[header_index + 1:]
+    
+    def test_header_and_rows(self):
+        """测试列名只写一次，全部为空的列被省略"""
+        encoded = encode_logs(self.logs_df)
+        header, rows = self._table(encoded.text)
+        self.assertEqual(header, ["id", "timestamp", "source_ip", "event_type", "severity", "destination_port", "raw_log"])
+        self.assertEqual(len(rows), 100)
+        self.assertEqual(encoded.rows, 100)
+        self.assertEqual(encoded.text.count("event_type"), 2)
+    
+    def test_dictionary_coding(self):
+        """测试重复取值使用字典编码，只出现一次的取值保留原文"""
+        encoded = encode_logs(self.logs_df)
+        self.assertIn("source_ip: #0=203.0.113.42", encoded.text)
+        self.assertIn("event_type: #0=login_failure", encoded.text)
+        _, rows = self._table(encoded.text)
+        self.assertEqual(rows[0].split(FIELD_SEPARATOR)[2:4], ["#0", "#0"])
+        self.assertEqual(rows[-1].split(FIELD_SEPARATOR)[2], "192.168.1.9")
+        self.assertEqual(rows[0].split(FIELD_SEPARATOR)[1], "2025-03-01 10:00:00")
+    
+    def test_truncates_long_text(self):
+        """测试截断长文本并替换字段中的分隔符"""
+        encoded = encode_logs(self.logs_df, dict_columns=(), truncate_columns={"raw_log": 20})
+        _, rows = self._table(encoded.text)
+        raw_log = rows[0].split(FIELD_SEPARATOR)[-1]
+        self.assertEqual(len(raw_log), 20)
+        self.assertTrue(raw_log.endswith("…"))
+        self.assertEqual(len(rows[0].split(FIELD_SEPARATOR)), 7)
+        self.assertNotIn("字典:", encoded.text)
+    
+    def test_reports_token_savings(self):
+        """测试编码后的token数明显少于 JSON"""
+        encoded = encode_logs(self.logs_df)
+        self.assertGreater(encoded.original_tokens, 0)
+        self.assertLess(encoded.encoded_tokens * 3, encoded.original_tokens)
+        self.assertGreater(encoded.savings, 0.66)
+    
+    def test_empty(self):
+        """测试空数据"""
+        encoded = encode_logs(self.logs_df.iloc[0:0])
+        self.assertEqual(encoded.text, "无日志数据")
+        self.assertEqual(encoded.savings, 0.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+"""
+按小时汇总表单元测试
+"""
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+import pandas as pd
+
+from security_agent.utils.engine_registry import EngineRegistry
+from security_agent.utils.log_stats import compute_log_statistics
+from security_agent.utils.rollups import RollupManager, split_rollup_range
+
+def _log(event_time, source_ip, event_type, severity, destination_ip="10.0.0.1"):
+    return {
+        "event_time": event_time,
+        "source_ip": source_ip,
+        "destination_ip": destination_ip,
+        "event_type": event_type,
+        "severity": severity,
+        "protocol": "TCP",
+        "destination_port": 22,
+    }
+
+class TestSplitRollupRange(unittest.TestCase):
+    """时间范围拆分测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.high_water = datetime(2025, 3, 2, 0)
+    
+    def test_aligned(self):
+        """测试整点对齐并且已经汇总的时间范围完全读取汇总表"""
+        split = split_rollup_range({"start_time": "2025-03-01 04:00:00", "end_time": "2025-03-01 12:00:00"}, self.high_water)
+        self.assertEqual(split, ((datetime(2025, 3, 1, 4), datetime(2025, 3, 1, 12)), []))
+        
+        split = split_rollup_range({"start_time": "2025-03-01 00:00:00", "end_time": "2025-03-01 23:59:59"}, self.high_water)
+        self.assertEqual(split, ((datetime(2025, 3, 1, 0), datetime(2025, 3, 2, 0)), []))
+    
+    def test_partial_hours(self):
+        """测试两端不足一小时的部分和高水位线之后的部分读取原始表"""
+        split = split_rollup_range({"start_time": "2025-03-01 04:30:00", "end_time": "2025-03-01 12:15:00"}, self.high_water)
+        self.assertEqual(split, (
+            (datetime(2025, 3, 1, 5), datetime(2025, 3, 1, 12)),
+            [(datetime(2025, 3, 1, 4, 30), datetime(2025, 3, 1, 5), False),
+             (datetime(2025, 3, 1, 12), datetime(2025, 3, 1, 12, 15), True)]
+        ))
+        
+        split = split_rollup_range({"start_time": "2025-03-01 20:00:00", "end_time": "2025-03-02 02:00:00"}, self.high_water)
+        self.assertEqual(split, (
+            (datetime(2025, 3, 1, 20), datetime(2025, 3, 2, 0)),
+            [(datetime(2025, 3, 2, 0), datetime(2025, 3, 2, 2), False)]
+        ))
+    
+    def test_no_full_hours(self):
+        """测试没有已汇总的完整小时或时间无效时返回 None"""
+        self.assertIsNone(split_rollup_range({"start_time": "2025-03-01 04:10:00", "end_time": "2025-03-01 04:50:00"}, self.high_water))
+        self.assertIsNone(split_rollup_range({"start_time": "2025-03-02 00:00:00", "end_time": "2025-03-02 06:00:00"}, self.high_water))
+        self.assertIsNone(split_rollup_range({"start_time": "无效时间", "end_time": "2025-03-01 12:00:00"}, self.high_water))
+
+class TestRollupManager(unittest.IsolatedAsyncioTestCase):
+    """按小时汇总表测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.temp_db_file.close()
+        self.db_connection = f"sqlite:///{self.temp_db_file.name}"
+        
+        self.engines = EngineRegistry()
+        self.patcher = patch('security_agent.utils.rollups.engine_registry', self.engines)
+        self.patcher.start()
+        
+        self.logs_df = pd.DataFrame([
+            _log(datetime(2025, 3, 1, 4, 10), "203.0.113.42", "端口扫描", "高", "10.0.0.1"),
+            _log(datetime(2025, 3, 1, 4, 20), "203.0.113.42", "端口扫描", "高", "10.0.0.2"),
+            _log(datetime(2025, 3, 1, 5, 5), "192.168.1.10", "登录失败", "中", "10.0.0.1"),
+            _log(datetime(2025, 3, 1, 6, 59), "192.168.1.11", "登录成功", "低", "10.0.0.3"),
+        ])
+        self._append(self.logs_df)
+        
+        self.rollups = RollupManager(self.db_connection, "security_logs", backfill_hours=48)
+        self.window = {"start_time": "2025-03-01 04:00:00", "end_time": "2025-03-01 07:00:00"}
+    
+    async def asyncTearDown(self):
+        """测试后清理"""
+        self.patcher.stop()
+        await self.engines.dispose_all()
+        os.unlink(self.temp_db_file.name)
+    
+    def _append(self, logs_df):
+        logs_df.to_sql("security_logs", self.engines.get_engine(self.db_connection), if_exists="append", index=False)
+    
+    async def test_statistics_match_raw_logs(self):
+        """测试汇总表统计与原始日志一致"""
+        hours = await self.rollups.update(now=datetime(2025, 3, 1, 8, 30))
+        
+        self.assertEqual(hours, 4)
+        self.assertEqual(await self.rollups.get_watermark(), datetime(2025, 3, 1, 8))
+        
+        stats = await self.rollups.fetch_statistics(self.window)
+        self.assertEqual(stats, compute_log_statistics(self.logs_df))
+    
+    async def test_filters(self):
+        """测试按报告类型过滤"""
+        await self.rollups.update(now=datetime(2025, 3, 1, 8, 30))
+        
+        stats = await self.rollups.fetch_statistics(self.window, filters={"severity": ("高", "严重")})
+        self.assertEqual(stats["total_logs"], 2)
+        self.assertEqual(stats["unique_dest_ips"], 2)
+        self.assertEqual(stats["event_types"], {"端口扫描": 2})
+    
+    async def test_partial_hours_read_raw_logs(self):
+        """测试未对齐和高水位线之后的部分从原始表读取，与原始日志统计一致"""
+        await self.rollups.update(now=datetime(2025, 3, 1, 6, 30))
+        
+        self.assertEqual(await self.rollups.fetch_statistics(self.window), compute_log_statistics(self.logs_df))
+        stats = await self.rollups.fetch_statistics({"start_time": "2025-03-01 04:15:00", "end_time": "2025-03-01 06:00:00"})
+        self.assertEqual(stats, compute_log_statistics(self.logs_df.iloc[1:3]))
+        stats = await self.rollups.fetch_statistics(
+            {"start_time": "2025-03-01 04:15:00", "end_time": "2025-03-01 06:00:00"}, filters={"severity": ("高",)}
+        )
+        self.assertEqual((stats["total_logs"], stats["unique_dest_ips"]), (1, 1))
+        
+        self.assertIsNone(await self.rollups.fetch_statistics(
+            {"start_time": "2025-03-01 04:15:00", "end_time": "2025-03-01 04:45:00"}
+        ))
+        self.assertIsNone(await self.rollups.fetch_statistics(self.window, filters={"protocol": ("TCP",)}))
+    
+    async def test_single_lease_holder(self):
+        """测试同时只有一个 worker 持有更新租约，租约过期后其他 worker 可以接手"""
+        other = RollupManager(self.db_connection, "security_logs")
+        self.assertTrue(await self.rollups.acquire_lease(60))
+        self.assertFalse(await other.acquire_lease(60))
+        self.assertTrue(await self.rollups.acquire_lease(60))
+        
+        self.assertTrue(await self.rollups.acquire_lease(-1))
+        self.assertTrue(await other.acquire_lease(60))
+        self.assertFalse(await self.rollups.acquire_lease(60))
+    
+    async def test_incremental_update(self):
+        """测试从高水位线增量更新，重复执行不会重复计数"""
+        await self.rollups.update(now=datetime(2025, 3, 1, 8, 30))
+        self._append(pd.DataFrame([
+            _log(datetime(2025, 3, 1, 8, 15), "203.0.113.42", "端口扫描", "高"),
+            _log(datetime(2025, 3, 1, 9, 45), "203.0.113.42", "端口扫描", "高"),
+        ]))
+        
+        await self.rollups.update(now=datetime(2025, 3, 1, 10, 5))
+        await self.rollups.update(now=datetime(2025, 3, 1, 10, 10))
+        
+        stats = await self.rollups.fetch_statistics({"start_time": "2025-03-01 04:00:00", "end_time": "2025-03-01 10:00:00"})
+        self.assertEqual(stats["total_logs"], 6)
+        self.assertEqual(stats["top_source_ips"][0], {"source_ip": "203.0.113.42", "count": 4})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+表结构注册表单元测试
+"""
+import unittest
+from unittest.mock import patch
+import os
+import tempfile
+from sqlalchemy import create_engine, text
+
+from langchain_community.utilities.sql_database import SQLDatabase
+from security_agent.models.security_log import Base
+from security_agent.utils.schema_registry import SchemaRegistry
+
+class TestSchemaRegistry(unittest.TestCase):
+    """表结构注册表单元测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        # 创建临时数据库文件
+        self.temp_db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.temp_db_file.close()
+        self.db_connection_string = f"sqlite:///{self.temp_db_file.name}"
+        
+        self.engine = create_engine(self.db_connection_string)
+        Base.metadata.create_all(self.engine)
+        
+        self.registry = SchemaRegistry()
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.registry.clear()
+        self.engine.dispose()
+        if os.path.exists(self.temp_db_file.name):
+            os.unlink(self.temp_db_file.name)
+    
+    def test_shared_database_instance(self):
+        """测试同一连接字符串共享一个实例"""
+        first = self.registry.get_database(self.db_connection_string)
+        second = self.registry.get_database(self.db_connection_string)
+        self.assertIs(first, second)
+    
+    def test_table_info_cached(self):
+        """测试表信息只生成一次"""
+        with patch.object(SQLDatabase, "get_table_info", return_value="CREATE TABLE security_logs") as mock_info:
+            for _ in range(3):
+                table_info = self.registry.get_table_info(self.db_connection_string, ["security_logs"])
+        
+        self.assertEqual(table_info, "CREATE TABLE security_logs")
+        mock_info.assert_called_once()
+    
+    def test_column_names(self):
+        """测试列名顺序与表定义一致"""
+        columns = self.registry.get_column_names(self.db_connection_string, "security_logs")
+        self.assertEqual(columns[:3], ["id", "timestamp", "source_ip"])
+        self.assertIn("raw_log", columns)
+    
+    def test_refresh(self):
+        """测试刷新后能看到新增的列"""
+        columns = self.registry.get_column_names(self.db_connection_string, "security_logs")
+        self.assertNotIn("tag", columns)
+        
+        with self.engine.begin() as connection:
+            connection.execute(text("ALTER TABLE security_logs ADD COLUMN tag VARCHAR(20)"))
+        
+        # 刷新前仍然使用缓存
+        self.assertNotIn("tag", self.registry.get_column_names(self.db_connection_string, "security_logs"))
+        
+        self.registry.refresh(self.db_connection_string)
+        self.assertIn("tag", self.registry.get_column_names(self.db_connection_string, "security_logs"))
+    
+    def test_ttl_expiry(self):
+        """测试超过有效期后自动重新反射"""
+        registry = SchemaRegistry(ttl=60)
+        database = registry.get_database(self.db_connection_string)
+        
+        with patch("security_agent.utils.schema_registry.time.monotonic", return_value=database._reflected_at + 120):
+            with patch.object(database, "refresh") as mock_refresh:
+                database.get_usable_column_names(["security_logs"])
+        
+        mock_refresh.assert_called_once()
+        registry.clear()
+
+if __name__ == "__main__":
+    unittest.main()
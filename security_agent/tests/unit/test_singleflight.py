@@ -0,0 +1,181 @@
+"""
+并发请求合并单元测试
+"""
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import pandas as pd
+
+from security_agent.chains.security_agent_chain import SecurityAgentChain
+from security_agent.utils.singleflight import SingleFlight
+from security_agent.utils.time_grammar import TIME_FORMAT
+
+TIME_RANGE = {
+    "start_time": "2025-03-01 04:00:00",
+    "end_time": "2025-03-01 12:00:00",
+    "formatted_range": "2025-03-01 04:00:00 至 2025-03-01 12:00:00",
+}
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    """并发请求合并测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.inflight = SingleFlight()
+        self.calls = 0
+        self.release = asyncio.Event()
+    
+    async def _work(self, value="结果"):
+        self.calls += 1
+        await self.release.wait()
+        return value
+    
+    async def test_concurrent_calls_share_result(self):
+        """测试相同键的并发调用只执行一次"""
+        tasks = [asyncio.create_task(self.inflight.do("key", self._work)) for _ in range(5)]
+        other = asyncio.create_task(self.inflight.do("other", lambda: self._work("其他")))
+        await asyncio.sleep(0)
+        self.assertEqual(self.inflight.in_flight(), 2)
+        
+        self.release.set()
+        self.assertEqual(await asyncio.gather(*tasks), ["结果"] * 5)
+        self.assertEqual(await other, "其他")
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.inflight.stats(), {"in_flight": 0, "executed": 2, "shared": 4})
+    
+    async def test_completed_calls_are_not_reused(self):
+        """测试调用完成后再次调用会重新执行"""
+        self.release.set()
+        await self.inflight.do("key", self._work)
+        await self.inflight.do("key", self._work)
+        self.assertEqual(self.calls, 2)
+    
+    async def test_exception_is_shared(self):
+        """测试异常传递给所有等待的调用方"""
+        async def fail():
+            await self.release.wait()
+            raise ValueError("查询失败")
+        
+        tasks = [asyncio.create_task(self.inflight.do("key", fail)) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+    
+    async def test_cancelled_caller_does_not_cancel_others(self):
+        """测试第一个调用方被取消时其他调用方仍然得到结果"""
+        first = asyncio.create_task(self.inflight.do("key", self._work))
+        second = asyncio.create_task(self.inflight.do("key", self._work))
+        await asyncio.sleep(0)
+        
+        first.cancel()
+        await asyncio.sleep(0)
+        self.release.set()
+        self.assertEqual(await second, "结果")
+        self.assertTrue(first.cancelled())
+
+class TestSecurityAgentChainCoalescing(unittest.IsolatedAsyncioTestCase):
+    """安全代理链合并相同时间范围的分析"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.chain = SecurityAgentChain.__new__(SecurityAgentChain)
+        self.chain.inflight = SingleFlight()
+        self.chain.coalesce_bucket_seconds = 60
+        self.chain.speculative_hours = None
+        self.chain.time_parser = MagicMock()
+    
+    async def test_duplicate_queries_share_analysis(self):
+        """测试同一时间范围的并发分析只执行一次，各调用方得到独立的结果字典"""
+        chain = self.chain
+        chain.time_parser.parse_time_range = AsyncMock(return_value=TIME_RANGE)
+        release = asyncio.Event()
+        
+        async def analyze(time_range, prefetched=None):
+            await release.wait()
+            return {"time_range": time_range["formatted_range"], "has_risk": False}
+        
+        chain._analyze = AsyncMock(side_effect=analyze)
+        tasks = [asyncio.create_task(chain.run("前8小时是否有网络安全攻击风险")) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        release.set()
+        results = await asyncio.gather(*tasks)
+        
+        chain._analyze.assert_awaited_once()
+        self.assertEqual(results[0]["time_range"], results[1]["time_range"])
+        self.assertIsNot(results[0], results[1])
+        self.assertIn("analysis", results[0]["timings"])
+
+    async def test_relative_ranges_in_same_bucket_share_analysis(self):
+        """测试相对时间范围相差几秒、起止时间落在同一时间分桶内时合并为一次分析"""
+        def time_range(end_second):
+            end_time = datetime(2025, 3, 1, 12, 0, end_second)
+            start_time = end_time - timedelta(hours=8)
+            return {
+                "start_time": start_time.strftime(TIME_FORMAT),
+                "end_time": end_time.strftime(TIME_FORMAT),
+                "formatted_range": f"{start_time.strftime(TIME_FORMAT)} 至 {end_time.strftime(TIME_FORMAT)}",
+            }
+        
+        async def analyze(time_range, prefetched=None):
+            await asyncio.sleep(0.01)
+            return {"time_range": time_range["formatted_range"], "has_risk": False}
+        
+        self.chain._analyze = AsyncMock(side_effect=analyze)
+        self.chain.time_parser.parse_time_range = AsyncMock(side_effect=[time_range(5), time_range(20), time_range(0), time_range(15)])
+        first, second = await asyncio.gather(*(self.chain.run("前8小时是否有网络安全攻击风险") for _ in range(2)))
+        self.chain._analyze.assert_awaited_once()
+        self.assertEqual(first["time_range"], second["time_range"])
+        
+        # 跨越分桶边界的时间范围分别分析
+        self.chain.coalesce_bucket_seconds = 10
+        await asyncio.gather(*(self.chain.run("前8小时是否有网络安全攻击风险") for _ in range(2)))
+        self.assertEqual(self.chain._analyze.await_count, 3)
+
+    async def test_cancelled_caller_does_not_fail_others(self):
+        """测试合并到同一次分析的请求中一个断开时，等待预取数据的其他请求仍然得到结果"""
+        end_time = datetime.now().replace(microsecond=0)
+        start_time = end_time - timedelta(hours=24)
+        self.chain.speculative_hours = 24
+        self.chain.speculative_tolerance = timedelta(seconds=60)
+        self.chain.time_parser.parse_time_range = AsyncMock(return_value={
+            "start_time": start_time.strftime(TIME_FORMAT),
+            "end_time": end_time.strftime(TIME_FORMAT),
+            "formatted_range": f"{start_time.strftime(TIME_FORMAT)} 至 {end_time.strftime(TIME_FORMAT)}",
+        })
+        release = asyncio.Event()
+        
+        async def fetch_data(time_range):
+            await release.wait()
+            return {"total_logs": 0}, pd.DataFrame(), pd.DataFrame()
+        
+        self.chain._fetch_data = AsyncMock(side_effect=fetch_data)
+        analyzer = MagicMock()
+        analyzer.detect.return_value = []
+        analyzer.encode_sample.return_value = "样本"
+        analyzer.analyze_prepared = AsyncMock(return_value={
+            "has_risk": False,
+            "risk_level": "无",
+            "analysis": "未发现风险",
+            "recommendations": [],
+        })
+        self.chain.security_analyzer = analyzer
+        
+        first = asyncio.create_task(self.chain.run("最近的网络安全状况"))
+        second = asyncio.create_task(self.chain.run("最近的网络安全状况"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        
+        result = await second
+        self.assertNotIn("error", result)
+        self.assertFalse(result["has_risk"])
+        self.chain._fetch_data.assert_awaited_once()
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+
+if __name__ == "__main__":
+    unittest.main()
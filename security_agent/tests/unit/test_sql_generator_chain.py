@@ -2,11 +2,13 @@
 SQL生成链单元测试
 """
 import unittest
-from unittest.mock import patch, MagicMock
+from datetime import datetime
+from unittest.mock import patch, MagicMock, AsyncMock
 
 from security_agent.chains.sql_generator_chain import SQLGeneratorChain
+from security_agent.config import settings
 
-class TestSQLGeneratorChain(unittest.TestCase):
+class TestSQLGeneratorChain(unittest.IsolatedAsyncioTestCase):
     """SQL生成链单元测试"""
     
     def setUp(self):
@@ -16,91 +18,114 @@ class TestSQLGeneratorChain(unittest.TestCase):
         self.db_connection = "sqlite:///test.db"
         
         # 模拟LLM和链
-        self.patcher = patch('security_agent.chains.sql_generator_chain.ChatOpenAI')
+        self.patcher = patch('security_agent.chains.sql_generator_chain.llm_registry')
         self.mock_llm = self.patcher.start()
         
-        # 模拟SQLDatabase
-        self.db_patcher = patch('security_agent.chains.sql_generator_chain.SQLDatabase')
-        self.mock_db = self.db_patcher.start()
+        # 模拟表结构注册表
+        self.db_patcher = patch('security_agent.chains.sql_generator_chain.schema_registry')
+        self.mock_registry = self.db_patcher.start()
         
         # 设置模拟数据库返回值
-        self.mock_db_instance = MagicMock()
-        self.mock_db.from_uri.return_value = self.mock_db_instance
-        self.mock_db_instance.get_table_info.return_value = "id (INTEGER), timestamp (DATETIME), source_ip (VARCHAR), event_type (VARCHAR)"
+        self.mock_registry.get_table_info.return_value = "id (INTEGER), timestamp (DATETIME), source_ip (VARCHAR), event_type (VARCHAR)"
         
         # 创建SQL生成链实例
         self.sql_generator = SQLGeneratorChain(self.api_key, self.table_name)
         
-        # 模拟链的调用结果
-        self.mock_chain = MagicMock()
-        self.sql_generator.chain = self.mock_chain
-    
     def tearDown(self):
         """测试后清理"""
         self.patcher.stop()
         self.db_patcher.stop()
     
-    async def test_generate_sql_success(self):
-        """测试成功生成SQL查询"""
-        # 模拟时间范围
+    async def test_generate_sql_uses_template(self):
+        """测试生成时间窗口SQL时直接渲染模板，不调用LLM"""
         time_range = {
             "start_time": "2025-03-01 04:00:00",
             "end_time": "2025-03-01 12:00:00"
         }
         
-        # 模拟生成的SQL
-        expected_sql = f"""
-        SELECT * FROM {self.table_name}
-        WHERE timestamp >= '{time_range["start_time"]}'
-        AND timestamp <= '{time_range["end_time"]}'
-        ORDER BY timestamp DESC
-        LIMIT 10000
-        """.strip()
-        
-        # 创建模拟响应对象
-        mock_response = MagicMock()
-        mock_response.content = expected_sql
-        
-        # 设置模拟链的返回值
-        self.mock_chain.ainvoke.return_value = mock_response
-        
-        # 调用SQL生成函数
         result = await self.sql_generator.generate_sql(time_range, "table_schema", self.db_connection)
         
-        # 验证结果
-        self.assertEqual(result, expected_sql)
-        self.mock_chain.ainvoke.assert_called_once()
-        
-        # 验证调用参数
-        call_args = self.mock_chain.ainvoke.call_args[0][0]
-        self.assertEqual(call_args["table_name"], self.table_name)
-        self.assertEqual(call_args["start_time"], time_range["start_time"])
-        self.assertEqual(call_args["end_time"], time_range["end_time"])
+        self.assertIn(f"FROM {self.table_name}", result)
+        self.assertIn("'2025-03-01 04:00:00'", result)
+        self.assertIn("'2025-03-01 12:00:00'", result)
+        self.assertIn("LIMIT 10000", result)
+        self.mock_llm.get_chat_model.return_value.ainvoke.assert_not_called()
+
+class TestSQLGeneratorChainTemplates(unittest.IsolatedAsyncioTestCase):
+    """SQL生成链模板路径单元测试"""
     
-    async def test_generate_sql_failure(self):
-        """测试生成SQL失败时的默认行为"""
-        # 模拟时间范围
-        time_range = {
+    def setUp(self):
+        """测试前准备"""
+        self.patcher = patch('security_agent.chains.sql_generator_chain.llm_registry')
+        self.patcher.start()
+        
+        self.sql_generator = SQLGeneratorChain("fake_api_key", "ids_ai")
+        self.sql_generator.query_chain = MagicMock()
+        self.sql_generator.query_chain.ainvoke = AsyncMock(return_value="SQLQuery: SELECT user_id FROM ids_ai")
+        
+        self.time_range = {
             "start_time": "2025-03-01 04:00:00",
             "end_time": "2025-03-01 12:00:00"
         }
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.patcher.stop()
+    
+    async def test_report_type_uses_template(self):
+        """测试报告类型直接使用模板，不调用LLM"""
+        rendered = await self.sql_generator.generate_query(self.time_range, report_type="high_risk")
         
-        # 设置模拟链抛出异常
-        self.mock_chain.ainvoke.side_effect = Exception("生成SQL失败")
+        self.assertEqual(rendered.template, "high_risk")
+        self.assertEqual(rendered.params["start_time"], self.time_range["start_time"])
+        self.sql_generator.query_chain.ainvoke.assert_not_called()
+    
+    async def test_matching_question_uses_template(self):
+        """测试能匹配模板的问题不调用LLM"""
+        rendered = await self.sql_generator.generate_query(self.time_range, question="有哪些登录失败的记录")
         
-        # 调用SQL生成函数
-        result = await self.sql_generator.generate_sql(time_range, "table_schema", self.db_connection)
+        self.assertEqual(rendered.template, "login_failure")
+        self.assertEqual(rendered.params["limit"], settings.SQL_ANSWER_ROW_LIMIT)
+        self.sql_generator.query_chain.ainvoke.assert_not_called()
+    
+    async def test_matching_question_uses_question_time_range(self):
+        """测试未指定时间范围时，模板使用问题中的时间描述"""
+        with patch('security_agent.utils.time_grammar.datetime', wraps=datetime) as mock_datetime:
+            mock_datetime.now.return_value = datetime(2025, 3, 5, 14, 30, 0)
+            recent = await self.sql_generator.generate_query(question="前8小时的网络攻击事件")
+            yesterday = await self.sql_generator.generate_query(question="昨天登录失败的记录")
+        
+        self.assertEqual(recent.template, "attack")
+        self.assertEqual((recent.params["start_time"], recent.params["end_time"]), ("2025-03-05 06:30:00", "2025-03-05 14:30:00"))
+        self.assertEqual(yesterday.template, "login_failure")
+        self.assertEqual(
+            (yesterday.params["start_time"], yesterday.params["end_time"]), ("2025-03-04 00:00:00", "2025-03-04 23:59:59")
+        )
+    
+    async def test_free_form_question_uses_llm(self):
+        """测试自由形式的问题交给LLM生成"""
+        rendered = await self.sql_generator.generate_query(self.time_range, question="哪些用户访问了10.0.0.5")
+        
+        self.assertIsNone(rendered.template)
+        self.assertEqual(rendered.sql, "SELECT user_id FROM ids_ai")
+        self.assertEqual(rendered.params, {})
+        self.sql_generator.query_chain.ainvoke.assert_called_once()
+
+    async def test_stream_report(self):
+        """测试流式报告在生成报告前返回查询和数据量"""
+        async def astream(inputs):
+            for text in ["安全概况：", "未发现高风险事件"]:
+                yield text
         
-        # 验证结果
-        expected_default_sql = f"""
-            SELECT * FROM {self.table_name}
-            WHERE timestamp >= '{time_range["start_time"]}'
-            AND timestamp <= '{time_range["end_time"]}'
-            ORDER BY timestamp DESC
-            LIMIT 10000
-            """.strip()
+        self.sql_generator.execute_query = AsyncMock(return_value=[{"id": 1}, {"id": 2}])
+        self.sql_generator.report_chain = MagicMock()
+        self.sql_generator.report_chain.astream = astream
+        events = [event async for event in self.sql_generator.astream_report("high_risk", self.time_range)]
         
-        self.assertEqual(result, expected_default_sql)
+        self.assertEqual([name for name, _ in events], ["time_range", "sql", "rows", "token", "token", "result"])
+        self.assertIn("ids_ai", events[1][1]["query"])
+        self.assertEqual(events[2][1], {"count": 2, "source": "logs"})
+        self.assertEqual(events[-1][1], {"report_content": "安全概况：未发现高风险事件"})
 
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+SQL模板库单元测试
+"""
+import unittest
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from security_agent.chains.sql_templates import SQLTemplateLibrary, dialect_from_url
+from security_agent.models.security_log import Base
+
+class TestSQLTemplateLibrary(unittest.TestCase):
+    """SQL模板库单元测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        # 使用内存SQLite数据库
+        self.engine = create_engine("sqlite://")
+        Base.metadata.create_all(self.engine)
+        
+        base_time = datetime(2025, 3, 1, 0, 0, 0)
+        rows = [
+            {"timestamp": base_time + timedelta(minutes=30), "source_ip": "203.0.113.42", "event_type": "端口扫描", "severity": "中"},
+            {"timestamp": base_time + timedelta(minutes=40), "source_ip": "203.0.113.42", "event_type": "端口扫描", "severity": "中"},
+            {"timestamp": base_time + timedelta(hours=1, minutes=5), "source_ip": "203.0.113.37", "event_type": "登录失败", "severity": "高"},
+            {"timestamp": base_time + timedelta(hours=2), "source_ip": "192.168.1.25", "event_type": "文件访问", "severity": "严重"},
+            {"timestamp": base_time + timedelta(days=2), "source_ip": "192.168.1.1", "event_type": "登录成功", "severity": "低"},
+        ]
+        pd.DataFrame(rows).to_sql("security_logs", self.engine, if_exists="append", index=False)
+        
+        self.library = SQLTemplateLibrary("security_logs", time_column="timestamp", dialect="sqlite")
+        self.time_range = {"start_time": "2025-03-01 00:00:00", "end_time": "2025-03-01 23:59:59"}
+    
+    def _run(self, name, **options):
+        rendered = self.library.render(name, self.time_range, **options)
+        with self.engine.connect() as connection:
+            return connection.execute(text(rendered.sql), rendered.params).fetchall()
+    
+    def test_detail_templates(self):
+        """测试明细查询模板"""
+        self.assertEqual(len(self._run("time_window")), 4)
+        self.assertEqual(len(self._run("general", limit=2)), 2)
+        self.assertEqual(len(self._run("high_risk")), 2)
+        self.assertEqual(len(self._run("login_failure")), 1)
+        self.assertEqual(len(self._run("attack")), 2)
+    
+    def test_aggregate_templates(self):
+        """测试聚合查询模板"""
+        top_ips = self._run("top_source_ips", top_n=1)
+        self.assertEqual([tuple(row) for row in top_ips], [("203.0.113.42", 2)])
+        
+        hourly = self._run("hourly_counts")
+        self.assertEqual(
+            [tuple(row) for row in hourly],
+            [("2025-03-01 00:00:00", 2), ("2025-03-01 01:00:00", 1), ("2025-03-01 02:00:00", 1)]
+        )
+    
+    def test_summary_templates(self):
+        """测试日志摘要统计聚合模板"""
+        totals = self._run("summary_totals")
+        self.assertEqual(tuple(totals[0]), (4, 3, 0))
+        
+        event_types = self._run("event_type_counts")
+        self.assertEqual(tuple(event_types[0]), ("端口扫描", 2))
+        self.assertEqual(len(event_types), 3)
+        
+        severities = dict(tuple(row) for row in self._run("severity_counts"))
+        self.assertEqual(severities, {"中": 2, "高": 1, "严重": 1})
+    
+    def test_bound_parameters(self):
+        """测试时间范围使用绑定参数而不是拼接"""
+        rendered = self.library.render("time_window", {"start_time": "x' OR '1'='1", "end_time": "y"})
+        self.assertNotIn("OR '1'='1", rendered.sql)
+        self.assertEqual(rendered.params["start_time"], "x' OR '1'='1")
+        self.assertIn(":start_time", rendered.sql)
+    
+    def test_match(self):
+        """测试问题匹配模板"""
+        self.assertEqual(self.library.match("前8小时最活跃的前5个源IP"), ("top_source_ips", {"top_n": 5}))
+        self.assertEqual(self.library.match("昨天有哪些登录失败的记录")[0], "login_failure")
+        self.assertEqual(self.library.match("今天早上8点到现在的所有高危警报")[0], "high_risk")
+        self.assertEqual(self.library.match("按小时统计事件数量")[0], "hourly_counts")
+        self.assertEqual(self.library.match("前8小时的网络攻击事件")[0], "attack")
+        self.assertIsNone(self.library.match("哪些用户访问了10.0.0.5"))
+    
+    def test_free_form_questions_do_not_match(self):
+        """测试只包含泛化关键词或超出模板过滤能力的问题交给LLM"""
+        for question in (
+            "前8小时是否有网络安全攻击风险",
+            "这些攻击有多严重？",
+            "被攻击的服务器有哪些",
+            "登录失败最多的IP有哪些",
+            "203.0.113.42 昨天的高危事件",
+            "高危事件的类型分布",
+        ):
+            self.assertIsNone(self.library.match(question), question)
+    
+    def test_invalid_identifier(self):
+        """测试非法表名"""
+        with self.assertRaises(ValueError):
+            SQLTemplateLibrary("security_logs; DROP TABLE x")
+        with self.assertRaises(ValueError):
+            self.library.render("unknown", self.time_range)
+    
+    def test_dialect_from_url(self):
+        """测试从连接字符串获取方言"""
+        self.assertEqual(dialect_from_url("mysql+pymysql://u:p@localhost:3306/itm"), "mysql")
+        self.assertEqual(dialect_from_url("sqlite:///./security_logs.db"), "sqlite")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+流式检测引擎单元测试
+"""
+import unittest
+from datetime import datetime, timedelta
+
+from security_agent.models.security_log import SecurityLog
+from security_agent.utils.stream_detector import StreamDetector
+
+START = datetime(2025, 3, 1, 10, 0, 0)
+
+def _event(seconds, **fields):
+    """生成 seconds 秒时的事件"""
+    event = {
+        "timestamp": START + timedelta(seconds=seconds),
+        "source_ip": "192.168.1.10",
+        "destination_ip": "10.0.0.1",
+        "event_type": "文件访问",
+        "protocol": "TCP",
+        "destination_port": 443,
+        "user_id": "user1",
+        "status": "成功",
+        "bytes_sent": 1000 + (seconds * 37) % 9000,
+    }
+    event.update(fields)
+    return event
+
+def _baseline(count=60, start=0):
+    """正常流量，建立 bytes_sent 基线"""
+    return [_event(start + i, source_ip=f"192.168.1.{i % 20}") for i in range(count)]
+
+class TestStreamDetector(unittest.TestCase):
+    """流式检测引擎测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.detector = StreamDetector(window_seconds=600)
+    
+    def test_normal_traffic_has_no_alerts(self):
+        """测试正常流量不告警"""
+        self.assertEqual(self.detector.process_many(_baseline(200)), [])
+        self.assertEqual(self.detector.stats()["events_processed"], 200)
+    
+    def test_port_scan(self):
+        """测试同一源IP在窗口内访问多个端口时告警一次"""
+        self.detector.process_many(_baseline())
+        scan = [
+            _event(100 + i, source_ip="203.0.113.42", event_type="端口扫描", destination_port=port)
+            for i, port in enumerate([22, 23, 80, 443, 3389, 8080, 8443, 21])
+        ]
+        alerts = self.detector.process_many(scan)
+        
+        self.assertEqual([(alert.rule, alert.key) for alert in alerts], [("port_scan", "203.0.113.42")])
+        self.assertEqual(alerts[0].evidence["distinct_ports"], 6)
+        self.assertEqual(alerts[0].timestamp, START + timedelta(seconds=105))
+    
+    def test_port_scan_outside_window(self):
+        """测试分散在多个窗口内的访问不告警"""
+        events = [
+            _event(i * 700, source_ip="203.0.113.42", destination_port=port)
+            for i, port in enumerate([22, 23, 80, 443, 3389, 8080, 8443, 21])
+        ]
+        self.assertEqual(self.detector.process_many(events), [])
+    
+    def test_ssh_brute_force_by_source_and_user(self):
+        """测试SSH暴力破解按源IP和被攻击的账号分别告警"""
+        attempts = [
+            _event(i * 10, source_ip="203.0.113.37", event_type="登录失败", protocol="SSH",
+                   destination_port=22, user_id="root", status="失败")
+            for i in range(12)
+        ]
+        alerts = self.detector.process_many(attempts)
+        
+        self.assertEqual(
+            sorted((alert.rule, alert.key_type, alert.key) for alert in alerts),
+            [("ssh_brute_force", "source_ip", "203.0.113.37"), ("ssh_brute_force", "user_id", "root")]
+        )
+        self.assertTrue(all(alert.risk_level == "高" for alert in alerts))
+    
+    def test_distributed_brute_force_against_user(self):
+        """测试多个源IP针对同一账号的暴力破解"""
+        attempts = [
+            _event(i * 10, source_ip=f"198.51.100.{i}", event_type="登录失败", protocol="SSH",
+                   user_id="admin", status="失败")
+            for i in range(10)
+        ]
+        alerts = self.detector.process_many(attempts)
+        
+        self.assertEqual([(alert.key_type, alert.key) for alert in alerts], [("user_id", "admin")])
+        self.assertEqual(len(alerts[0].evidence["source_ips"]), 10)
+    
+    def test_exfiltration(self):
+        """测试发往同一目标的异常大流量传输"""
+        self.detector.process_many(_baseline())
+        transfers = [
+            _event(100 + i, source_ip="192.168.1.25", destination_ip="198.51.100.23",
+                   protocol="FTP", bytes_sent=80000)
+            for i in range(3)
+        ]
+        alerts = self.detector.process_many(transfers)
+        
+        self.assertEqual([(alert.rule, alert.key) for alert in alerts], [("data_exfiltration", "198.51.100.23")])
+        self.assertEqual(alerts[0].evidence["source_ips"], ["192.168.1.25"])
+        self.assertEqual(alerts[0].evidence["total_bytes"], 160000)
+    
+    def test_idle_keys_are_evicted(self):
+        """测试空闲的键被淘汰，活跃键的数量有上限"""
+        detector = StreamDetector(window_seconds=60, max_keys=50)
+        detector.process_many(_event(i, source_ip=f"10.1.{i // 256}.{i % 256}") for i in range(500))
+        self.assertLessEqual(detector.stats()["active_keys"]["source_ip"], 50)
+        
+        detector.process(_event(10000, source_ip="10.9.9.9"))
+        self.assertEqual(detector.stats()["active_keys"]["source_ip"], 1)
+    
+    def test_late_and_invalid_events_are_dropped(self):
+        """测试迟到超过一个窗口的事件和没有时间的事件被丢弃"""
+        self.detector.process(_event(5000))
+        self.detector.process(_event(100))
+        self.detector.process({"source_ip": "192.168.1.10"})
+        self.assertEqual(self.detector.stats()["events_dropped"], 2)
+    
+    def test_accepts_security_log_objects(self):
+        """测试可以直接处理 SecurityLog 对象"""
+        log = SecurityLog(**_event(0, timestamp=START.isoformat()))
+        self.assertEqual(self.detector.process(log), [])
+        self.assertEqual(self.detector.stats()["events_processed"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+规则时间解析单元测试
+"""
+import unittest
+from datetime import datetime
+
+from security_agent.utils.time_grammar import parse_time_expression
+
+class TestTimeGrammar(unittest.TestCase):
+    """规则时间解析单元测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        # 2025-03-05 是星期三
+        self.now = datetime(2025, 3, 5, 14, 30, 0)
+    
+    def assertRange(self, query, start_time, end_time):
+        """断言解析出的时间范围"""
+        result = parse_time_expression(query, self.now)
+        self.assertIsNotNone(result, query)
+        self.assertEqual(result["start_time"], start_time, query)
+        self.assertEqual(result["end_time"], end_time, query)
+        self.assertEqual(result["formatted_range"], f"{start_time} 至 {end_time}")
+    
+    def test_relative_hours(self):
+        """测试相对小时数"""
+        self.assertRange("前8小时是否有网络安全攻击风险", "2025-03-05 06:30:00", "2025-03-05 14:30:00")
+        self.assertRange("过去24小时", "2025-03-04 14:30:00", "2025-03-05 14:30:00")
+        self.assertRange("最近八个小时", "2025-03-05 06:30:00", "2025-03-05 14:30:00")
+        self.assertRange("24小时内的登录失败", "2025-03-04 14:30:00", "2025-03-05 14:30:00")
+    
+    def test_relative_days_and_months(self):
+        """测试相对天数、周数和月数"""
+        self.assertRange("近三天", "2025-03-02 14:30:00", "2025-03-05 14:30:00")
+        self.assertRange("最近一周", "2025-02-26 14:30:00", "2025-03-05 14:30:00")
+        self.assertRange("前两个月", "2025-01-05 14:30:00", "2025-03-05 14:30:00")
+    
+    def test_day_and_period(self):
+        """测试日期和时段"""
+        self.assertRange("查看昨天的报表", "2025-03-04 00:00:00", "2025-03-04 23:59:59")
+        self.assertRange("昨天下午", "2025-03-04 12:00:00", "2025-03-04 17:59:59")
+        self.assertRange("今天", "2025-03-05 00:00:00", "2025-03-05 14:30:00")
+        self.assertRange("3月1日", "2025-03-01 00:00:00", "2025-03-01 23:59:59")
+        self.assertRange("3/1的日志", "2025-03-01 00:00:00", "2025-03-01 23:59:59")
+        self.assertRange("2025年最近3天", "2025-03-02 14:30:00", "2025-03-05 14:30:00")
+    
+    def test_ranges(self):
+        """测试区间表达式"""
+        self.assertRange("上周五到本周一期间的异常活动", "2025-02-28 00:00:00", "2025-03-03 23:59:59")
+        self.assertRange("今天早上8点到现在的所有高危警报", "2025-03-05 08:00:00", "2025-03-05 14:30:00")
+        self.assertRange("前天下午3点到昨天晚上8点的系统日志", "2025-03-03 15:00:00", "2025-03-04 20:00:00")
+        self.assertRange("昨天下午3点到5点", "2025-03-04 15:00:00", "2025-03-04 17:00:00")
+        self.assertRange("前天晚上8点到晚上12点", "2025-03-03 20:00:00", "2025-03-04 00:00:00")
+        self.assertRange("前天夜里12点到昨天中午12点", "2025-03-04 00:00:00", "2025-03-04 12:00:00")
+        self.assertRange("本月初至今的用户增长", "2025-03-01 00:00:00", "2025-03-05 14:30:00")
+        self.assertRange("2025-03-01 08:00到2025-03-02 10:30", "2025-03-01 08:00:00", "2025-03-02 10:30:00")
+        self.assertRange("从3/1到3/3", "2025-03-01 00:00:00", "2025-03-03 23:59:59")
+    
+    def test_week_and_month(self):
+        """测试周和月"""
+        self.assertRange("本周", "2025-03-03 00:00:00", "2025-03-05 14:30:00")
+        self.assertRange("上周", "2025-02-24 00:00:00", "2025-03-02 23:59:59")
+        self.assertRange("上个月", "2025-02-01 00:00:00", "2025-02-28 23:59:59")
+    
+    def test_english(self):
+        """测试英文描述"""
+        self.assertRange("any attacks in the last 24 hours?", "2025-03-04 14:30:00", "2025-03-05 14:30:00")
+        self.assertRange("yesterday", "2025-03-04 00:00:00", "2025-03-04 23:59:59")
+        self.assertRange("past hour", "2025-03-05 13:30:00", "2025-03-05 14:30:00")
+    
+    def test_unresolved(self):
+        """测试无法识别的描述返回None"""
+        self.assertIsNone(parse_time_expression("没有明确时间范围的查询", self.now))
+        self.assertIsNone(parse_time_expression("本季度的安全状况", self.now))
+        self.assertIsNone(parse_time_expression("前5个源IP", self.now))
+        self.assertIsNone(parse_time_expression("现在有没有攻击", self.now))
+        self.assertIsNone(parse_time_expression("v1.2版本的漏洞", self.now))
+        self.assertIsNone(parse_time_expression("事件1-2的详情", self.now))
+        self.assertIsNone(parse_time_expression("192.168.1.25的访问记录", self.now))
+        self.assertIsNone(parse_time_expression("2024年最近3天", self.now))
+    
+    def test_future_clamped(self):
+        """测试结束时间不会超过当前时间"""
+        self.assertRange("今天下午", "2025-03-05 12:00:00", "2025-03-05 14:30:00")
+        self.assertIsNone(parse_time_expression("今天晚上", self.now))
+
+if __name__ == "__main__":
+    unittest.main()
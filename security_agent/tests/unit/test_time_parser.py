@@ -6,6 +6,8 @@ Date: 2025-03-04
 import asyncio
 import os
 import sys
+import tempfile
+from unittest.mock import patch
 
 # # 添加项目根目录到Python路径
 # sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
@@ -13,6 +15,12 @@ from security_agent.config import settings
 from security_agent.chains.time_parser_chain import TimeRangeParserChain
 
 async def test_time_range_parser():
+    # LLM响应缓存写入临时目录，不在工作目录中创建缓存文件
+    with tempfile.TemporaryDirectory() as tmpdir, \
+            patch.object(settings, "LLM_CACHE_PATH", os.path.join(tmpdir, "llm_cache.db")):
+        await _run_time_range_parser()
+
+async def _run_time_range_parser():
     # 从环境变量获取API密钥，或者直接在这里设置
     api_key = settings.TONGYI_API_KEY
      # 打印API密钥的前5个和后5个字符，中间用星号代替（安全考虑）
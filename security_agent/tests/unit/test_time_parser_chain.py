@@ -2,13 +2,14 @@
 时间解析链单元测试
 """
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 import json
 from datetime import datetime, timedelta
 
 from security_agent.chains.time_parser_chain import TimeRangeParserChain
+from security_agent.utils.cache import TTLCache
 
-class TestTimeRangeParserChain(unittest.TestCase):
+class TestTimeRangeParserChain(unittest.IsolatedAsyncioTestCase):
     """时间解析链单元测试"""
     
     def setUp(self):
@@ -16,14 +17,15 @@ class TestTimeRangeParserChain(unittest.TestCase):
         self.api_key = "fake_api_key"
         
         # 模拟LLM和链
-        self.patcher = patch('security_agent.chains.time_parser_chain.ChatOpenAI')
+        self.patcher = patch('security_agent.chains.time_parser_chain.llm_registry')
         self.mock_llm = self.patcher.start()
         
-        # 创建解析链实例
-        self.time_parser = TimeRangeParserChain(self.api_key)
+        # 创建解析链实例（使用独立的缓存，避免测试之间互相影响）
+        self.time_parser = TimeRangeParserChain(self.api_key, cache=TTLCache(max_size=16), cache_bucket_seconds=3600)
         
         # 模拟链的调用结果
         self.mock_chain = MagicMock()
+        self.mock_chain.ainvoke = AsyncMock()
         self.time_parser.chain = self.mock_chain
     
     def tearDown(self):
@@ -39,22 +41,38 @@ class TestTimeRangeParserChain(unittest.TestCase):
         expected_result = {
             "start_time": "2025-03-01 04:00:00",
             "end_time": "2025-03-01 12:00:00",
-            "description": "前8小时",
+            "description": "本季度",
             "formatted_range": "2025-03-01 04:00:00 至 2025-03-01 12:00:00"
         }
         
         # 设置模拟链的返回值
         self.mock_chain.ainvoke.return_value = expected_result
         
-        # 调用解析函数
+        # 调用解析函数（规则无法识别"本季度"，回退到LLM）
         with patch('security_agent.chains.time_parser_chain.datetime') as mock_datetime:
             mock_datetime.now.return_value = current_time
-            result = await self.time_parser.parse_time_range("前8小时是否有网络安全攻击风险")
+            result = await self.time_parser.parse_time_range("本季度是否有网络安全攻击风险")
         
         # 验证结果
         self.assertEqual(result, expected_result)
         self.mock_chain.ainvoke.assert_called_once()
     
+    async def test_parse_time_range_rule_fast_path(self):
+        """测试规则可识别的时间描述不调用LLM"""
+        # 模拟当前时间
+        current_time = datetime(2025, 3, 1, 12, 0, 0)
+        
+        # 调用解析函数
+        with patch('security_agent.chains.time_parser_chain.datetime') as mock_datetime:
+            mock_datetime.now.return_value = current_time
+            result = await self.time_parser.parse_time_range("前8小时是否有网络安全攻击风险")
+        
+        # 验证结果
+        self.assertEqual(result["start_time"], "2025-03-01 04:00:00")
+        self.assertEqual(result["end_time"], "2025-03-01 12:00:00")
+        self.assertEqual(result["description"], "前8小时")
+        self.mock_chain.ainvoke.assert_not_called()
+    
     async def test_parse_time_range_failure(self):
         """测试解析失败时的默认行为"""
         # 模拟当前时间
@@ -74,5 +92,57 @@ class TestTimeRangeParserChain(unittest.TestCase):
         self.assertEqual(result["description"], "默认时间范围（最近24小时）")
         self.assertIn("error", result)
 
+    async def test_parse_time_range_cache_reanchor(self):
+        """测试缓存命中时不再调用LLM，并将相对范围重新锚定到当前时间"""
+        self.mock_chain.ainvoke.return_value = {
+            "start_time": "2025-03-01 04:00:00",
+            "end_time": "2025-03-01 12:00:00",
+            "description": "本季度",
+            "formatted_range": "2025-03-01 04:00:00 至 2025-03-01 12:00:00"
+        }
+        
+        with patch('security_agent.chains.time_parser_chain.datetime') as mock_datetime:
+            mock_datetime.now.return_value = datetime(2025, 3, 1, 12, 0, 0)
+            first = await self.time_parser.parse_time_range("本季度")
+            mock_datetime.now.return_value = datetime(2025, 3, 1, 12, 10, 0)
+            second = await self.time_parser.parse_time_range("本季度？")
+        
+        # 验证只调用了一次LLM
+        self.mock_chain.ainvoke.assert_called_once()
+        self.assertEqual(first["end_time"], "2025-03-01 12:00:00")
+        self.assertEqual(second["start_time"], "2025-03-01 04:10:00")
+        self.assertEqual(second["end_time"], "2025-03-01 12:10:00")
+        
+        stats = self.time_parser.cache_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+    
+    async def test_parse_time_range_cache_keeps_fixed_start(self):
+        """测试缓存命中时起始时间固定的范围（今天、本周）只延伸结束时间，相对范围整体平移"""
+        with patch('security_agent.chains.time_parser_chain.datetime') as mock_datetime:
+            mock_datetime.now.return_value = datetime(2025, 3, 5, 14, 30, 10)
+            await self.time_parser.parse_time_range("今天")
+            await self.time_parser.parse_time_range("本周")
+            await self.time_parser.parse_time_range("前8小时")
+            mock_datetime.now.return_value = datetime(2025, 3, 5, 14, 30, 40)
+            today = await self.time_parser.parse_time_range("今天")
+            week = await self.time_parser.parse_time_range("本周")
+            recent = await self.time_parser.parse_time_range("前8小时")
+        
+        self.assertEqual(self.time_parser.cache_stats()["hits"], 3)
+        self.assertEqual((today["start_time"], today["end_time"]), ("2025-03-05 00:00:00", "2025-03-05 14:30:40"))
+        self.assertEqual((week["start_time"], week["end_time"]), ("2025-03-03 00:00:00", "2025-03-05 14:30:40"))
+        self.assertEqual((recent["start_time"], recent["end_time"]), ("2025-03-05 06:30:40", "2025-03-05 14:30:40"))
+        self.mock_chain.ainvoke.assert_not_called()
+    
+    async def test_parse_time_range_failure_not_cached(self):
+        """测试解析失败的默认结果不会被缓存"""
+        self.mock_chain.ainvoke.side_effect = Exception("解析失败")
+        
+        await self.time_parser.parse_time_range("无效的时间描述")
+        await self.time_parser.parse_time_range("无效的时间描述")
+        
+        self.assertEqual(self.mock_chain.ainvoke.call_count, 2)
+
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
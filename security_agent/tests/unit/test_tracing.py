@@ -0,0 +1,138 @@
+"""
+请求级链路追踪单元测试
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.prompts import ChatPromptTemplate
+
+from security_agent.utils import tracing
+from security_agent.utils.metrics import llm_callbacks, observe_stage
+from security_agent.utils.pipeline import StageGraph
+from security_agent.utils.tracing import JSONLExporter, Tracer, current_span, install_log_record_factory
+
+class TestTracer(unittest.IsolatedAsyncioTestCase):
+    """追踪器测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "traces.jsonl")
+        self.tracer = Tracer(exporter=JSONLExporter(self.path), recent_size=3)
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.tmpdir.cleanup()
+    
+    def _spans(self, trace):
+        return {span["name"]: span for span in trace["spans"]}
+    
+    async def test_nested_spans_across_tasks(self):
+        """测试子 span 记录父 span，并随 asyncio 任务和线程传递"""
+        async def child(name):
+            with self.tracer.span(name) as span:
+                self.assertIs(await asyncio.to_thread(current_span), span)
+        
+        with self.tracer.start_trace("POST /api/security/analyze", trace_id="abc-123") as root:
+            with self.tracer.span("stage", step=1) as stage:
+                await asyncio.gather(child("a"), child("b"))
+            self.assertIs(current_span(), root)
+        self.assertIsNone(current_span())
+        
+        trace = self.tracer.slowest(1)[0]
+        spans = self._spans(trace)
+        self.assertEqual(trace["trace_id"], "abc-123")
+        self.assertEqual(len(trace["spans"]), 4)
+        self.assertEqual(spans["stage"]["parent_id"], root.span_id)
+        self.assertEqual(spans["stage"]["attributes"], {"step": 1})
+        self.assertEqual(spans["a"]["parent_id"], stage.span_id)
+        self.assertEqual(spans["b"]["parent_id"], stage.span_id)
+    
+    def test_invalid_trace_id_and_errors(self):
+        """测试不合法的 trace id 被替换，异常记录在 span 中"""
+        with self.assertRaises(RuntimeError):
+            with self.tracer.start_trace("请求", trace_id="bad id\n"):
+                with self.tracer.span("stage"):
+                    raise RuntimeError("数据库不可用")
+        
+        trace = self.tracer.slowest(1)[0]
+        self.assertNotEqual(trace["trace_id"], "bad id\n")
+        self.assertEqual(trace["error"], "RuntimeError: 数据库不可用")
+        self.assertEqual(self._spans(trace)["stage"]["error"], "RuntimeError: 数据库不可用")
+    
+    def test_span_outside_trace_is_noop(self):
+        """测试没有进行中的 trace 时不记录 span"""
+        with self.tracer.span("stage") as span:
+            self.assertIsNone(span)
+        self.assertEqual(self.tracer.slowest(), [])
+    
+    def test_exporter_and_slowest(self):
+        """测试结束的 trace 由后台线程写入JSONL文件，按耗时返回最慢的 trace"""
+        for name, seconds in (("fast", 0), ("slow", 0.05), ("medium", 0.02)):
+            with self.tracer.start_trace(name):
+                with self.tracer.span("sleep"):
+                    time.sleep(seconds)
+        
+        self.assertEqual([trace["name"] for trace in self.tracer.slowest(2)], ["slow", "medium"])
+        self.tracer.flush()
+        with open(self.path, encoding="utf-8") as f:
+            exported = [json.loads(line) for line in f]
+        self.assertEqual([trace["name"] for trace in exported], ["fast", "slow", "medium"])
+        self.assertEqual(exported[1]["spans"][1]["name"], "sleep")
+    
+    def test_log_records_carry_trace_id(self):
+        """测试日志记录带有当前请求的 trace id"""
+        install_log_record_factory()
+        test_logger = logging.getLogger("security_agent.tests.tracing")
+        with self.assertLogs(test_logger, level="INFO") as logs:
+            test_logger.info("请求外")
+            with self.tracer.start_trace("请求", trace_id="trace-1"):
+                test_logger.info("请求内")
+        
+        self.assertEqual([record.trace_id for record in logs.records], ["-", "trace-1"])
+
+class TestInstrumentedSpans(unittest.IsolatedAsyncioTestCase):
+    """阶段图、LLM调用和阶段耗时的 span 测试"""
+    
+    def setUp(self):
+        """测试前准备，全局追踪器不写入默认的 trace 文件"""
+        self.patcher = patch.object(tracing.tracer, "exporter", None)
+        self.patcher.start()
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.patcher.stop()
+    
+    async def test_stage_graph_llm_and_stage_spans(self):
+        """测试阶段图的每个阶段、LLM调用和 observe_stage 都记录在全局追踪器的 trace 中"""
+        llm = FakeListChatModel(responses=["回答"])
+        chain = (ChatPromptTemplate.from_template("{question}") | llm).with_config(callbacks=llm_callbacks("test_trace"))
+        
+        async def ask():
+            with observe_stage("test_trace_stage", sql="SELECT 1"):
+                return await chain.ainvoke({"question": "问题"})
+        
+        graph = StageGraph("测试图")
+        graph.add("answer", ask)
+        with tracing.tracer.start_trace("测试请求", trace_id="graph-trace") as root:
+            await graph.run()
+        
+        trace = root.trace.to_dict()
+        spans = {span["name"]: span for span in trace["spans"]}
+        self.assertEqual(spans["测试图"]["parent_id"], root.span_id)
+        self.assertEqual(spans["answer"]["parent_id"], spans["测试图"]["span_id"])
+        self.assertEqual(spans["answer"]["attributes"], {"graph": "测试图"})
+        self.assertEqual(spans["test_trace_stage"]["parent_id"], spans["answer"]["span_id"])
+        self.assertEqual(spans["test_trace_stage"]["attributes"], {"sql": "SELECT 1"})
+        self.assertEqual(spans["llm.test_trace"]["parent_id"], spans["test_trace_stage"]["span_id"])
+        self.assertIsNotNone(spans["llm.test_trace"]["duration"])
+
+if __name__ == "__main__":
+    unittest.main()
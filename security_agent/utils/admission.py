@@ -0,0 +1,169 @@
+"""
+准入控制
+
+模型变慢时请求会在 uvicorn 中不断堆积，内存增长后所有请求一起超时。调用LLM的接口在执行前先申请执行名额：
+每个接口有自己的并发上限，所有接口共享一个总并发上限。没有空闲名额时请求进入有界的等待队列，
+队列已满时立即返回429，等待超过期限时返回503，两者都带有 Retry-After。
+空出名额时按优先级唤醒等待的请求，交互式分析优先于批量分析、报告和定时报告。
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from security_agent.utils.metrics import ADMISSION_REJECTED, ADMISSION_WAIT
+
+logger = logging.getLogger(__name__)
+
+class AdmissionPolicy(NamedTuple):
+    """一个接口的准入策略"""
+    concurrency: int  # 同时执行的请求数上限
+    queue_size: int  # 等待队列长度上限
+    timeout: float  # 在队列中等待的最长时间（秒）
+    priority: int  # 优先级，数值越小越先获得空出的名额
+
+class AdmissionRejected(Exception):
+    """请求未被准入"""
+    
+    def __init__(self, endpoint: str, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.endpoint = endpoint
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class _EndpointState:
+    """接口的运行中、等待中请求数和累计统计"""
+    
+    def __init__(self):
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queue_full = 0
+        self.timed_out = 0
+
+class AdmissionController:
+    """按接口限制并发、按优先级排队的准入控制器"""
+    
+    def __init__(self, policies: Dict[str, AdmissionPolicy], max_concurrency: int, retry_after: float = 5):
+        """初始化准入控制器
+        
+        Args:
+            policies: 接口名到准入策略的映射
+            max_concurrency: 所有接口同时执行的请求总数上限
+            retry_after: 队列已满时建议客户端重试的间隔（秒）
+        """
+        self.policies = policies
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self._states = {endpoint: _EndpointState() for endpoint in policies}
+        self._running = 0
+        # (优先级, 序号, 接口名, future)，序号保证同一优先级先到先得
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._sequence = itertools.count()
+    
+    async def acquire(self, endpoint: str) -> None:
+        """申请执行名额，没有空闲名额时排队等待
+        
+        Raises:
+            AdmissionRejected: 等待队列已满（429）或等待超时（503）
+        """
+        policy = self.policies[endpoint]
+        state = self._states[endpoint]
+        # 有等待的请求时名额已在释放时按优先级分配，这里有空闲名额说明没有可以先执行的请求
+        if self._has_room(endpoint):
+            self._start(endpoint)
+            return
+        if state.waiting >= policy.queue_size:
+            state.queue_full += 1
+            self._reject(endpoint, 429, "等待队列已满", self.retry_after)
+        
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (policy.priority, next(self._sequence), endpoint, waiter))
+        state.waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, policy.timeout)
+        except asyncio.TimeoutError:
+            state.waiting -= 1
+            state.timed_out += 1
+            self._reject(endpoint, 503, f"等待超过 {policy.timeout:g} 秒", policy.timeout)
+        except asyncio.CancelledError:
+            # 客户端断开；名额可能恰好已经分配给了这个请求
+            if waiter.done() and not waiter.cancelled():
+                self.release(endpoint)
+            else:
+                state.waiting -= 1
+            raise
+        ADMISSION_WAIT.observe(time.perf_counter() - started, endpoint=endpoint)
+    
+    def release(self, endpoint: str) -> None:
+        """归还执行名额，并按优先级唤醒等待的请求"""
+        self._states[endpoint].running -= 1
+        self._running -= 1
+        self._dispatch()
+    
+    @asynccontextmanager
+    async def slot(self, endpoint: str):
+        """在执行名额内执行代码块"""
+        await self.acquire(endpoint)
+        try:
+            yield
+        finally:
+            self.release(endpoint)
+    
+    def stats(self) -> Dict[str, Any]:
+        """总并发数和各接口的并发上限、运行中和等待中的请求数、准入和拒绝次数"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "endpoints": {
+                endpoint: {
+                    "concurrency": policy.concurrency,
+                    "queue_size": policy.queue_size,
+                    "priority": policy.priority,
+                    "running": self._states[endpoint].running,
+                    "waiting": self._states[endpoint].waiting,
+                    "admitted": self._states[endpoint].admitted,
+                    "queue_full": self._states[endpoint].queue_full,
+                    "timed_out": self._states[endpoint].timed_out,
+                }
+                for endpoint, policy in self.policies.items()
+            }
+        }
+    
+    def _has_room(self, endpoint: str) -> bool:
+        return (self._running < self.max_concurrency
+                and self._states[endpoint].running < self.policies[endpoint].concurrency)
+    
+    def _start(self, endpoint: str) -> None:
+        state = self._states[endpoint]
+        state.running += 1
+        state.admitted += 1
+        self._running += 1
+    
+    def _dispatch(self) -> None:
+        """按优先级把空闲名额分配给等待的请求，所在接口已达到并发上限的请求继续等待"""
+        blocked = []
+        while self._waiters and self._running < self.max_concurrency:
+            entry = heapq.heappop(self._waiters)
+            endpoint, waiter = entry[2], entry[3]
+            if waiter.done():
+                # 已超时或客户端已断开
+                continue
+            if not self._has_room(endpoint):
+                blocked.append(entry)
+                continue
+            self._states[endpoint].waiting -= 1
+            self._start(endpoint)
+            waiter.set_result(None)
+        for entry in blocked:
+            heapq.heappush(self._waiters, entry)
+    
+    def _reject(self, endpoint: str, status_code: int, reason: str, retry_after: float) -> None:
+        ADMISSION_REJECTED.inc(endpoint=endpoint, status=str(status_code))
+        logger.warning(f"拒绝 {endpoint} 请求: {reason}")
+        raise AdmissionRejected(endpoint, status_code, reason, max(1, math.ceil(retry_after)))
@@ -0,0 +1,308 @@
+"""
+本地异常检测
+
+按源IP在分析窗口内做向量化统计，识别示例数据中的几类攻击模式：
+端口扫描（时间窗口内访问大量不同端口）、SSH暴力破解（针对SSH的登录失败次数和比例）、
+数据外泄（bytes_sent 稳健 z 分数异常的大流量传输）。
+检测结果交给安全分析链作为证据；没有任何规则命中时可以直接给出无风险结论，不调用LLM。
+"""
+import logging
+from typing import Any, Dict, List, NamedTuple
+
+import pandas as pd
+
+from security_agent.chains.sql_templates import LOGIN_FAILURE_EVENT_TYPES
+
+logger = logging.getLogger(__name__)
+
+# 检测需要的列（不含时间列）
+DETECTION_COLUMNS = (
+    "source_ip", "destination_ip", "destination_port", "event_type",
+    "protocol", "user_id", "status", "bytes_sent",
+)
+
+# 风险等级，按严重程度升序
+RISK_LEVELS = ("无", "低", "中", "高")
+
+# 视为失败的状态
+FAILURE_STATUSES = ("失败",)
+
+# 特权账号，暴力破解针对这些账号时风险等级为高
+PRIVILEGED_USERS = ("root", "admin")
+
+# SSH 端口
+SSH_PORT = 22
+
+# 登录相关的事件类型
+LOGIN_EVENT_PATTERN = "登录|login"
+
+# 各类风险的处置建议
+RECOMMENDATIONS = {
+    "port_scan": ["在防火墙上封禁扫描来源IP", "检查暴露在外网的端口和服务"],
+    "ssh_brute_force": ["封禁暴力破解来源IP", "禁止 root 远程登录并启用密钥认证", "为SSH配置登录失败锁定策略"],
+    "data_exfiltration": ["立即核查大流量传输的目标地址和传输内容", "限制内网主机向外部地址的FTP传输"],
+}
+
+class Finding(NamedTuple):
+    """检测结果"""
+    rule: str
+    risk_type: str
+    risk_level: str
+    source_ip: str
+    event_count: int
+    evidence: Dict[str, Any]
+    description: str
+
+def _robust_zscores(values: pd.Series) -> pd.Series:
+    """稳健 z 分数：使用中位数和 MAD，MAD 为 0 时退回均值和标准差"""
+    values = values.astype(float)
+    median = values.median()
+    scale = 1.4826 * (values - median).abs().median()
+    if scale:
+        return (values - median) / scale
+    std = values.std(ddof=0)
+    if not std:
+        return pd.Series(0.0, index=values.index)
+    return (values - values.mean()) / std
+
+def _risk_rank(level: str) -> int:
+    return RISK_LEVELS.index(level) if level in RISK_LEVELS else 0
+
+def findings_verdict(findings: List[Finding]) -> Dict[str, Any]:
+    """根据检测结果生成分析结论，格式与安全分析链的输出一致"""
+    if not findings:
+        return {
+            "has_risk": False,
+            "risk_level": "无",
+            "risk_type": None,
+            "analysis": "本地异常检测未发现端口扫描、SSH暴力破解或数据外泄迹象。",
+            "recommendations": ["继续保持日志监控"],
+            "findings": [],
+        }
+    
+    risk_types = list(dict.fromkeys(finding.risk_type for finding in findings))
+    recommendations = []
+    for finding in findings:
+        for item in RECOMMENDATIONS.get(finding.rule, []):
+            if item not in recommendations:
+                recommendations.append(item)
+    return {
+        "has_risk": True,
+        "risk_level": max((finding.risk_level for finding in findings), key=_risk_rank),
+        "risk_type": "、".join(risk_types),
+        "analysis": "\n".join(finding.description for finding in findings),
+        "recommendations": recommendations,
+        "findings": [finding._asdict() for finding in findings],
+    }
+
+class AnomalyDetector:
+    """基于源IP窗口统计的本地异常检测器"""
+    
+    def __init__(
+        self,
+        time_column: str = "timestamp",
+        window_minutes: int = 60,
+        port_scan_min_ports: int = 4,
+        port_scan_min_events: int = 6,
+        brute_force_min_failures: int = 10,
+        brute_force_min_ratio: float = 0.5,
+        exfil_bytes_zscore: float = 3.0,
+        exfil_min_bytes: int = 100000
+    ):
+        """初始化检测阈值
+        
+        Args:
+            time_column: 时间字段名
+            window_minutes: 端口扫描统计窗口的长度（分钟）
+            port_scan_min_ports: 端口扫描在一个窗口内最少访问的不同目标端口数
+            port_scan_min_events: 端口扫描在一个窗口内最少的事件数（不含登录失败）
+            brute_force_min_failures: 暴力破解最少SSH登录失败次数
+            brute_force_min_ratio: 暴力破解最小失败比例
+            exfil_bytes_zscore: 单次传输 bytes_sent 的最小稳健 z 分数
+            exfil_min_bytes: 数据外泄来源异常传输的最小总字节数
+        """
+        self.time_column = time_column
+        self.window_minutes = window_minutes
+        self.port_scan_min_ports = port_scan_min_ports
+        self.port_scan_min_events = port_scan_min_events
+        self.brute_force_min_failures = brute_force_min_failures
+        self.brute_force_min_ratio = brute_force_min_ratio
+        self.exfil_bytes_zscore = exfil_bytes_zscore
+        self.exfil_min_bytes = exfil_min_bytes
+    
+    def detect(self, logs_df: pd.DataFrame) -> List[Finding]:
+        """检测日志中的攻击模式
+        
+        Args:
+            logs_df: 分析窗口内的日志，缺少某条规则需要的列时跳过该规则
+        
+        Returns:
+            检测结果，按风险等级和事件数降序排列
+        """
+        if logs_df.empty or "source_ip" not in logs_df.columns:
+            return []
+        
+        logs_df = logs_df[logs_df["source_ip"].notna()]
+        findings = self._port_scans(logs_df) + self._brute_force(logs_df) + self._exfiltration(logs_df)
+        findings.sort(key=lambda finding: (-_risk_rank(finding.risk_level), -finding.event_count, finding.source_ip))
+        logger.info(f"本地异常检测完成: {len(logs_df)} 条日志，命中 {len(findings)} 项")
+        return findings
+    
+    def _port_scans(self, logs_df: pd.DataFrame) -> List[Finding]:
+        if "destination_port" not in logs_df.columns:
+            return []
+        
+        # 登录失败归入暴力破解规则，不计入扫描
+        if "event_type" in logs_df.columns:
+            logs_df = logs_df[~logs_df["event_type"].isin(LOGIN_FAILURE_EVENT_TYPES)]
+        if logs_df.empty:
+            return []
+        
+        # 按 (源IP, 时间窗口) 统计事件数和不同目标端口数，没有时间列时整个分析窗口作为一个窗口
+        if self.time_column in logs_df.columns:
+            windows = pd.to_datetime(logs_df[self.time_column], errors="coerce").dt.floor(f"{self.window_minutes}min")
+        else:
+            windows = pd.Series(pd.NaT, index=logs_df.index)
+        per_window = logs_df.assign(window=windows).groupby(["source_ip", "window"], dropna=False).agg(
+            event_count=("destination_port", "size"),
+            distinct_ports=("destination_port", "nunique"),
+        )
+        hits = per_window[
+            (per_window["distinct_ports"] >= self.port_scan_min_ports)
+            & (per_window["event_count"] >= self.port_scan_min_events)
+        ].reset_index()
+        if hits.empty:
+            return []
+        per_source = hits.groupby("source_ip").agg(
+            windows=("window", "size"),
+            peak_events=("event_count", "max"),
+            peak_ports=("distinct_ports", "max"),
+        )
+        
+        findings = []
+        for source_ip, row in per_source.iterrows():
+            source_logs = logs_df[logs_df["source_ip"] == source_ip]
+            ports = sorted(int(port) for port in source_logs["destination_port"].dropna().unique())
+            findings.append(Finding(
+                rule="port_scan",
+                risk_type="端口扫描",
+                risk_level="中",
+                source_ip=str(source_ip),
+                event_count=int(len(source_logs)),
+                evidence={
+                    "suspicious_windows": int(row["windows"]),
+                    "window_minutes": self.window_minutes,
+                    "peak_window_events": int(row["peak_events"]),
+                    "peak_window_ports": int(row["peak_ports"]),
+                    "ports": ports[:20],
+                },
+                description=(
+                    f"源IP {source_ip} 在 {self.window_minutes} 分钟内最多访问了 {int(row['peak_ports'])} 个不同的目标端口"
+                    f"（{int(row['peak_events'])} 条事件），共 {len(source_logs)} 条事件，疑似端口扫描"
+                ),
+            ))
+        return findings
+    
+    def _brute_force(self, logs_df: pd.DataFrame) -> List[Finding]:
+        columns = logs_df.columns
+        ssh = pd.Series(False, index=logs_df.index)
+        if "protocol" in columns:
+            ssh |= logs_df["protocol"].astype(str).str.upper().eq("SSH")
+        if "destination_port" in columns:
+            ssh |= pd.to_numeric(logs_df["destination_port"], errors="coerce").eq(SSH_PORT)
+        # 只统计登录相关的事件，没有事件类型时按状态判断
+        failed = pd.Series(False, index=logs_df.index)
+        if "status" in columns:
+            failed |= logs_df["status"].isin(FAILURE_STATUSES)
+        if "event_type" in columns:
+            login = logs_df["event_type"].astype(str).str.contains(LOGIN_EVENT_PATTERN, case=False, regex=True)
+            ssh &= login
+            failed = (failed & login) | logs_df["event_type"].isin(LOGIN_FAILURE_EVENT_TYPES)
+        
+        attempts = logs_df[ssh].assign(failed=failed[ssh])
+        if attempts.empty:
+            return []
+        per_source = attempts.groupby("source_ip").agg(attempts=("failed", "size"), failures=("failed", "sum"))
+        per_source["failure_ratio"] = per_source["failures"] / per_source["attempts"]
+        hits = per_source[
+            (per_source["failures"] >= self.brute_force_min_failures)
+            & (per_source["failure_ratio"] >= self.brute_force_min_ratio)
+        ]
+        
+        findings = []
+        for source_ip, row in hits.iterrows():
+            source_failures = attempts[(attempts["source_ip"] == source_ip) & attempts["failed"]]
+            users = []
+            if "user_id" in columns:
+                users = source_failures["user_id"].dropna().astype(str).value_counts().head(5).index.tolist()
+            privileged = any(user in PRIVILEGED_USERS for user in users)
+            findings.append(Finding(
+                rule="ssh_brute_force",
+                risk_type="SSH暴力破解",
+                risk_level="高" if privileged else "中",
+                source_ip=str(source_ip),
+                event_count=int(row["failures"]),
+                evidence={
+                    "attempts": int(row["attempts"]),
+                    "failures": int(row["failures"]),
+                    "failure_ratio": round(float(row["failure_ratio"]), 2),
+                    "target_users": users,
+                },
+                description=(
+                    f"源IP {source_ip} 的SSH登录失败 {int(row['failures'])} 次，"
+                    f"失败比例 {row['failure_ratio']:.0%}"
+                    + (f"，目标账号包括 {'、'.join(users)}" if users else "")
+                    + "，疑似暴力破解"
+                ),
+            ))
+        return findings
+    
+    def _exfiltration(self, logs_df: pd.DataFrame) -> List[Finding]:
+        if "bytes_sent" not in logs_df.columns:
+            return []
+        
+        bytes_sent = pd.to_numeric(logs_df["bytes_sent"], errors="coerce").dropna()
+        if len(bytes_sent) < 3:
+            return []
+        zscores = _robust_zscores(bytes_sent)
+        outliers = logs_df.loc[zscores.index[zscores >= self.exfil_bytes_zscore]].assign(
+            bytes_sent=bytes_sent,
+            zscore=zscores
+        )
+        if outliers.empty:
+            return []
+        
+        per_source = outliers.groupby("source_ip").agg(
+            transfers=("bytes_sent", "size"),
+            total_bytes=("bytes_sent", "sum"),
+            max_bytes=("bytes_sent", "max"),
+            max_zscore=("zscore", "max"),
+        )
+        hits = per_source[per_source["total_bytes"] >= self.exfil_min_bytes]
+        
+        findings = []
+        for source_ip, row in hits.iterrows():
+            destinations = []
+            if "destination_ip" in logs_df.columns:
+                destinations = outliers.loc[outliers["source_ip"] == source_ip, "destination_ip"].dropna().astype(str).unique().tolist()
+            findings.append(Finding(
+                rule="data_exfiltration",
+                risk_type="数据外泄",
+                risk_level="高",
+                source_ip=str(source_ip),
+                event_count=int(row["transfers"]),
+                evidence={
+                    "transfers": int(row["transfers"]),
+                    "total_bytes": int(row["total_bytes"]),
+                    "max_bytes": int(row["max_bytes"]),
+                    "max_bytes_zscore": round(float(row["max_zscore"]), 2),
+                    "destinations": destinations[:10],
+                },
+                description=(
+                    f"源IP {source_ip} 有 {int(row['transfers'])} 次异常大流量传输，"
+                    f"共发送 {int(row['total_bytes'])} 字节"
+                    + (f"，目标 {'、'.join(destinations[:3])}" if destinations else "")
+                    + "，疑似数据外泄"
+                ),
+            ))
+        return findings
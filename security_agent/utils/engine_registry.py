@@ -0,0 +1,199 @@
+"""
+数据库引擎注册表
+
+进程内所有链共享同一组数据库引擎：每个连接字符串只创建一个同步引擎和一个异步引擎，
+连接池参数统一从配置读取，避免每个链各自建池导致连接数成倍增长。
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from security_agent.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 数据库方言对应的异步驱动
+ASYNC_DRIVERS = {
+    "mysql": "aiomysql",
+    "sqlite": "aiosqlite",
+}
+
+def to_async_url(db_connection: str) -> str:
+    """将同步连接字符串转换为异步驱动的连接字符串
+    
+    例如 mysql+pymysql://... 转换为 mysql+aiomysql://...，sqlite:///... 转换为 sqlite+aiosqlite:///...
+    """
+    url = make_url(db_connection)
+    backend = url.get_backend_name()
+    driver = ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        raise ValueError(f"不支持异步执行的数据库方言: {backend}")
+    return url.set(drivername=f"{backend}+{driver}").render_as_string(hide_password=False)
+
+class _WaitTimingMixin:
+    """记录从连接池获取连接的等待时间"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            elapsed = time.perf_counter() - started
+            self.wait_count += 1
+            self.wait_time_total += elapsed
+            self.wait_time_max = max(self.wait_time_max, elapsed)
+
+class TimedQueuePool(_WaitTimingMixin, QueuePool):
+    """记录等待时间的连接池"""
+
+class TimedAsyncAdaptedQueuePool(_WaitTimingMixin, AsyncAdaptedQueuePool):
+    """记录等待时间的异步连接池"""
+
+class EngineRegistry:
+    """按连接字符串共享的数据库引擎注册表"""
+    
+    def __init__(
+        self,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_timeout: float = 30,
+        pool_recycle: int = 1800,
+        pool_pre_ping: bool = True,
+        statement_timeout_ms: int = 0
+    ):
+        """初始化引擎注册表
+        
+        Args:
+            pool_size: 连接池常驻连接数
+            max_overflow: 超出 pool_size 后允许临时创建的连接数
+            pool_timeout: 获取连接的最长等待时间（秒）
+            pool_recycle: 连接最长使用时间（秒），超过后重新建立
+            pool_pre_ping: 取出连接前是否检测连接可用
+            statement_timeout_ms: 单条查询的最长执行时间（毫秒），0 表示不限制，目前只对 MySQL 生效
+        """
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_recycle = pool_recycle
+        self.pool_pre_ping = pool_pre_ping
+        self.statement_timeout_ms = statement_timeout_ms
+        self._engines: Dict[str, Engine] = {}
+        self._async_engines: Dict[str, AsyncEngine] = {}
+        self._lock = threading.Lock()
+    
+    def get_engine(self, db_connection: str) -> Engine:
+        """获取连接字符串对应的共享同步引擎"""
+        engine = self._engines.get(db_connection)
+        if engine is not None:
+            return engine
+        
+        with self._lock:
+            engine = self._engines.get(db_connection)
+            if engine is None:
+                logger.info(f"创建数据库引擎: {self._display_url(db_connection)}")
+                engine = create_engine(db_connection, **self._engine_options(db_connection, TimedQueuePool))
+                self._engines[db_connection] = engine
+            return engine
+    
+    def get_async_engine(self, db_connection: str) -> AsyncEngine:
+        """获取连接字符串对应的共享异步引擎，db_connection 使用同步驱动的写法"""
+        engine = self._async_engines.get(db_connection)
+        if engine is not None:
+            return engine
+        
+        with self._lock:
+            engine = self._async_engines.get(db_connection)
+            if engine is None:
+                logger.info(f"创建异步数据库引擎: {self._display_url(db_connection)}")
+                engine = create_async_engine(
+                    to_async_url(db_connection),
+                    **self._engine_options(db_connection, TimedAsyncAdaptedQueuePool)
+                )
+                self._async_engines[db_connection] = engine
+            return engine
+    
+    def pool_stats(self) -> Dict[str, Dict[str, Any]]:
+        """返回各连接池的统计信息，键为隐藏密码后的连接字符串"""
+        stats = {}
+        for kind, engines in (("sync", self._engines), ("async", self._async_engines)):
+            for db_connection, engine in list(engines.items()):
+                pool = engine.pool
+                pool_stats = {"kind": kind, "pool_class": type(pool).__name__, "status": pool.status()}
+                if isinstance(pool, QueuePool):
+                    pool_stats.update({
+                        "size": pool.size(),
+                        "checked_in": pool.checkedin(),
+                        "checked_out": pool.checkedout(),
+                        "overflow": pool.overflow(),
+                    })
+                if isinstance(pool, _WaitTimingMixin):
+                    pool_stats.update({
+                        "wait_count": pool.wait_count,
+                        "wait_time_total": round(pool.wait_time_total, 6),
+                        "wait_time_max": round(pool.wait_time_max, 6),
+                        "wait_time_avg": round(pool.wait_time_total / pool.wait_count, 6) if pool.wait_count else 0.0,
+                    })
+                stats[f"{kind}:{self._display_url(db_connection)}"] = pool_stats
+        return stats
+    
+    async def dispose_all(self) -> None:
+        """关闭所有连接池并移除已注册的引擎"""
+        with self._lock:
+            engines = list(self._engines.values())
+            async_engines = list(self._async_engines.values())
+            self._engines.clear()
+            self._async_engines.clear()
+        
+        for engine in engines:
+            engine.dispose()
+        for engine in async_engines:
+            await engine.dispose()
+    
+    def _engine_options(self, db_connection: str, pool_class) -> Dict[str, Any]:
+        """根据方言生成引擎参数"""
+        url = make_url(db_connection)
+        backend = url.get_backend_name()
+        
+        # 内存 SQLite 每个连接都是独立的数据库，保留 SQLAlchemy 默认的连接池
+        if backend == "sqlite" and url.database in (None, "", ":memory:"):
+            return {}
+        
+        options = {
+            "poolclass": pool_class,
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.pool_timeout,
+            "pool_recycle": self.pool_recycle,
+            "pool_pre_ping": self.pool_pre_ping,
+        }
+        if backend == "mysql" and self.statement_timeout_ms:
+            options["connect_args"] = {
+                "init_command": f"SET SESSION MAX_EXECUTION_TIME={int(self.statement_timeout_ms)}"
+            }
+        return options
+    
+    @staticmethod
+    def _display_url(db_connection: str) -> str:
+        return make_url(db_connection).render_as_string(hide_password=True)
+
+# 进程内共享的数据库引擎注册表
+engine_registry = EngineRegistry(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    statement_timeout_ms=settings.DB_STATEMENT_TIMEOUT_MS
+)
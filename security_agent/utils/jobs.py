@@ -0,0 +1,285 @@
+"""
+后台任务子系统
+
+耗时的分析和报告作为任务提交后立即返回任务ID，由按任务类型限制并发数的后台工作协程执行，客户端轮询任务状态和结果。
+任务保存在本地SQLite表中：进程重启后未完成的任务会被重新执行，同一台机器上的多个 uvicorn worker 共享任务表，
+工作协程通过条件更新领取任务，保证每个任务只被一个进程执行。运行中的任务定期更新心跳，
+心跳超时的任务（所在进程已退出）重新变为等待状态。
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from contextlib import closing, suppress
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+JOB_COLUMNS = ("id", "job_type", "status", "params", "result", "error", "created_at", "started_at", "finished_at")
+
+class JobStore:
+    """基于SQLite的任务表"""
+    
+    def __init__(self, path: str, timeout: float = 5):
+        """初始化任务表
+        
+        Args:
+            path: SQLite数据库文件路径
+            timeout: 等待其他进程释放写锁的时间（秒）
+        """
+        self.path = path
+        self.timeout = timeout
+        with closing(self._connect()) as conn, conn:
+            # WAL 模式下多个进程可以同时读取，写入互不阻塞读取
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, job_type TEXT NOT NULL, status TEXT NOT NULL, params TEXT NOT NULL, "
+                "result TEXT, error TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status, job_type, created_at)")
+    
+    def create(self, job_type: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """新建等待执行的任务"""
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO jobs (id, job_type, status, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, job_type, PENDING, json.dumps(params, ensure_ascii=False), time.time())
+            )
+        return self.get(job_id)
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务，不存在时返回 None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        
+        job = dict(zip(JOB_COLUMNS, row))
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+    
+    def claim(self, job_type: str) -> Optional[Dict[str, Any]]:
+        """领取最早的等待任务并标记为运行中，没有等待任务时返回 None"""
+        with closing(self._connect()) as conn:
+            while True:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? AND job_type = ? ORDER BY created_at LIMIT 1",
+                    (PENDING, job_type)
+                ).fetchone()
+                if row is None:
+                    return None
+                
+                now = time.time()
+                with conn:
+                    claimed = conn.execute(
+                        "UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ? WHERE id = ? AND status = ?",
+                        (RUNNING, now, now, row[0], PENDING)
+                    ).rowcount
+                # 其他进程先领取了该任务时继续尝试下一个
+                if claimed:
+                    return self.get(row[0])
+    
+    def heartbeat(self, job_id: str) -> None:
+        """更新运行中任务的心跳"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ?", (time.time(), job_id, RUNNING))
+    
+    def finish(self, job_id: str, result: Any = None, error: Optional[str] = None) -> None:
+        """记录任务结果，error 不为 None 时标记为失败"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (
+                    FAILED if error is not None else SUCCEEDED,
+                    json.dumps(result, ensure_ascii=False) if error is None else None,
+                    error,
+                    time.time(),
+                    job_id
+                )
+            )
+    
+    def requeue_stale(self, stale_seconds: float) -> int:
+        """心跳超时的运行中任务重新变为等待状态，返回任务数"""
+        with closing(self._connect()) as conn, conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL, heartbeat_at = NULL "
+                "WHERE status = ? AND heartbeat_at < ?",
+                (PENDING, RUNNING, time.time() - stale_seconds)
+            ).rowcount
+    
+    def prune(self, retention_seconds: float) -> int:
+        """删除完成时间早于保留期的任务，返回删除的任务数"""
+        with closing(self._connect()) as conn, conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (SUCCEEDED, FAILED, time.time() - retention_seconds)
+            ).rowcount
+    
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """按任务类型和状态统计任务数"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT job_type, status, COUNT(*) FROM jobs GROUP BY job_type, status").fetchall()
+        counts: Dict[str, Dict[str, int]] = {}
+        for job_type, status, count in rows:
+            counts.setdefault(job_type, {})[status] = count
+        return counts
+    
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+class JobManager:
+    """按任务类型限制并发数的后台任务执行器"""
+    
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]],
+        concurrency: Dict[str, int],
+        poll_interval: float = 1.0,
+        heartbeat_seconds: float = 10,
+        retention_seconds: float = 86400
+    ):
+        """初始化任务执行器
+        
+        Args:
+            store: 任务表
+            handlers: 任务类型到处理函数的映射，处理函数接收任务参数，返回可JSON序列化的结果
+            concurrency: 每种任务类型在本进程中同时执行的任务数
+            poll_interval: 没有新任务时轮询任务表的间隔（秒），用于领取其他进程提交的和恢复的任务
+            heartbeat_seconds: 运行中任务的心跳间隔（秒），超过三个间隔没有心跳的任务被重新执行
+            retention_seconds: 已完成任务的保留时间（秒）
+        """
+        self.store = store
+        self.handlers = handlers
+        self.concurrency = {job_type: max(1, concurrency.get(job_type, 1)) for job_type in handlers}
+        self.poll_interval = poll_interval
+        self.heartbeat_seconds = heartbeat_seconds
+        self.retention_seconds = retention_seconds
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, int] = {job_type: 0 for job_type in handlers}
+    
+    async def start(self) -> None:
+        """恢复中断的任务，清理过期任务，并为每种任务类型启动工作协程"""
+        requeued = await asyncio.to_thread(self.store.requeue_stale, self.heartbeat_seconds * 3)
+        pruned = await asyncio.to_thread(self.store.prune, self.retention_seconds)
+        logger.info(f"任务执行器启动，恢复 {requeued} 个中断的任务，清理 {pruned} 个过期任务")
+        
+        for job_type, limit in self.concurrency.items():
+            self._wakeups[job_type] = asyncio.Event()
+            self._workers.extend(
+                asyncio.create_task(self._worker(job_type), name=f"job-worker-{job_type}-{i}")
+                for i in range(limit)
+            )
+        self._workers.append(asyncio.create_task(self._requeue_periodically(), name="job-requeue"))
+    
+    async def stop(self) -> None:
+        """停止工作协程，运行中的任务在心跳超时后由其他进程或下次启动时重新执行"""
+        for worker in self._workers:
+            worker.cancel()
+        for worker in self._workers:
+            with suppress(asyncio.CancelledError):
+                await worker
+        self._workers = []
+    
+    async def submit(self, job_type: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """提交任务，立即返回任务信息"""
+        if job_type not in self.handlers:
+            raise ValueError(f"未知的任务类型: {job_type}")
+        job = await asyncio.to_thread(self.store.create, job_type, params)
+        logger.info(f"提交{job_type}任务: {job['id']}")
+        wakeup = self._wakeups.get(job_type)
+        if wakeup is not None:
+            wakeup.set()
+        return job
+    
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务状态和结果"""
+        return await asyncio.to_thread(self.store.get, job_id)
+    
+    async def stats(self) -> Dict[str, Any]:
+        """返回各任务类型的并发上限、本进程运行中的任务数和任务表中的任务数"""
+        counts = await asyncio.to_thread(self.store.counts)
+        return {
+            job_type: {
+                "concurrency": limit,
+                "running_here": self._running[job_type],
+                "jobs": counts.get(job_type, {}),
+            }
+            for job_type, limit in self.concurrency.items()
+        }
+    
+    async def _worker(self, job_type: str) -> None:
+        """领取并执行一种类型的任务，没有任务时等待提交通知或轮询间隔"""
+        wakeup = self._wakeups[job_type]
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim, job_type)
+            except sqlite3.Error as e:
+                logger.error(f"领取{job_type}任务失败: {e}")
+                job = None
+            
+            if job is None:
+                wakeup.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(wakeup.wait(), self.poll_interval)
+                continue
+            
+            try:
+                await self._execute(job)
+            except sqlite3.Error as e:
+                logger.error(f"记录{job_type}任务结果失败: {job['id']} {e}")
+    
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        """执行任务并记录结果，执行期间定期更新心跳"""
+        job_type = job["job_type"]
+        logger.info(f"开始执行{job_type}任务: {job['id']}")
+        self._running[job_type] += 1
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        try:
+            result = await self.handlers[job_type](job["params"])
+        except asyncio.CancelledError:
+            # 执行器停止，任务保持运行中状态，心跳超时后重新执行
+            raise
+        except Exception as e:
+            logger.error(f"{job_type}任务失败: {job['id']} {e}")
+            await asyncio.to_thread(self.store.finish, job["id"], error=str(e))
+        else:
+            logger.info(f"{job_type}任务完成: {job['id']}")
+            await asyncio.to_thread(self.store.finish, job["id"], result=result)
+        finally:
+            heartbeat.cancel()
+            self._running[job_type] -= 1
+    
+    async def _requeue_periodically(self) -> None:
+        """定期将心跳超时的任务（所在进程已退出）重新变为等待状态"""
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds * 3)
+            try:
+                requeued = await asyncio.to_thread(self.store.requeue_stale, self.heartbeat_seconds * 3)
+            except sqlite3.Error as e:
+                logger.warning(f"恢复中断的任务失败: {e}")
+                continue
+            if requeued:
+                logger.info(f"恢复 {requeued} 个心跳超时的任务")
+                for wakeup in self._wakeups.values():
+                    wakeup.set()
+    
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await asyncio.to_thread(self.store.heartbeat, job_id)
+            except sqlite3.Error as e:
+                logger.warning(f"更新任务心跳失败: {job_id} {e}")
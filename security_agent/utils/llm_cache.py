@@ -0,0 +1,234 @@
+"""
+LLM响应持久化缓存
+
+使用SQLite保存LLM响应，重启后仍然有效，并且同一台机器上的多个 uvicorn worker 共享同一份缓存。
+缓存键由模型参数（模型名、温度等，即 LangChain 的 llm_string）和渲染后的提示组成。
+每个链通过 namespace() 获得带独立有效期的缓存视图，作为 ChatOpenAI 的 cache 参数使用；
+分析等非确定性的提示不传 cache 即不缓存。
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+
+from security_agent.config import settings
+from security_agent.utils.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+def _serialize(generations: RETURN_VAL_TYPE) -> str:
+    """将生成结果序列化为JSON"""
+    items = []
+    for generation in generations:
+        if isinstance(generation, ChatGeneration):
+            items.append({"message": message_to_dict(generation.message)})
+        else:
+            items.append({"text": generation.text})
+    return json.dumps(items, ensure_ascii=False)
+
+def _deserialize(payload: str) -> RETURN_VAL_TYPE:
+    """从JSON还原生成结果"""
+    generations = []
+    for item in json.loads(payload):
+        if "message" in item:
+            generations.append(ChatGeneration(message=messages_from_dict([item["message"]])[0]))
+        else:
+            generations.append(Generation(text=item["text"]))
+    return generations
+
+class SQLiteLLMCache:
+    """基于SQLite的LLM响应缓存
+    
+    条目数超过 max_entries 时按最近访问时间淘汰最旧的条目，过期条目在读取时视为未命中并删除。
+    命中、未命中和写入次数按 namespace 在进程内统计。
+    """
+    
+    def __init__(self, path: Optional[str] = None, max_entries: int = 10000, timeout: float = 5):
+        """初始化缓存，数据库文件在首次读写时才打开
+        
+        Args:
+            path: SQLite数据库文件路径，None 表示首次使用时读取 settings.LLM_CACHE_PATH
+            max_entries: 最大条目数（所有 namespace 合计）
+            timeout: 等待其他进程释放写锁的时间（秒）
+        """
+        self._path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._initialized_path: Optional[str] = None
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._namespaces: Dict[Tuple[str, Optional[float]], "NamespacedLLMCache"] = {}
+    
+    def namespace(self, name: str, ttl: Optional[float] = None) -> "NamespacedLLMCache":
+        """返回某个链使用的缓存视图
+        
+        Args:
+            name: 命名空间，通常是链的名称
+            ttl: 条目有效期（秒），None 表示不过期
+        
+        Returns:
+            可作为 ChatOpenAI cache 参数的缓存视图，相同的 name 和 ttl 返回同一个视图，
+            LLM客户端注册表因此可以为使用同一缓存的链共享同一个实例
+        """
+        with self._lock:
+            view = self._namespaces.get((name, ttl))
+            if view is None:
+                view = self._namespaces[(name, ttl)] = NamespacedLLMCache(self, name, ttl)
+            return view
+    
+    @property
+    def path(self) -> str:
+        """数据库文件路径"""
+        return self._path or settings.LLM_CACHE_PATH
+    
+    def get(self, namespace: str, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """读取缓存，未命中或已过期时返回 None"""
+        key = self._key(namespace, prompt, llm_string)
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT response, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] <= now:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        
+        self._count(namespace, "hits" if row is not None else "misses")
+        return _deserialize(row[0]) if row is not None else None
+    
+    def set(self, namespace: str, prompt: str, llm_string: str, generations: RETURN_VAL_TYPE,
+            ttl: Optional[float] = None) -> None:
+        """写入缓存，超过最大条目数时淘汰最久未访问的条目"""
+        key = self._key(namespace, prompt, llm_string)
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, namespace, response, created_at, accessed_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, namespace, _serialize(generations), now, now, expires_at)
+            )
+            size = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if size > self.max_entries:
+                evicted = conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                    (size - self.max_entries,)
+                ).rowcount
+                self._count(namespace, "evictions", evicted)
+        
+        self._count(namespace, "writes")
+    
+    def clear(self, namespace: Optional[str] = None) -> None:
+        """清空缓存，指定 namespace 时只清空该命名空间"""
+        with closing(self._connect()) as conn, conn:
+            if namespace is None:
+                conn.execute("DELETE FROM llm_cache")
+            else:
+                conn.execute("DELETE FROM llm_cache WHERE namespace = ?", (namespace,))
+    
+    def prune(self) -> int:
+        """删除所有已过期的条目，返回删除的条目数"""
+        with closing(self._connect()) as conn, conn:
+            return conn.execute(
+                "DELETE FROM llm_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            ).rowcount
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回各命名空间的条目数和命中率"""
+        with closing(self._connect()) as conn:
+            sizes = dict(conn.execute("SELECT namespace, COUNT(*) FROM llm_cache GROUP BY namespace").fetchall())
+        
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+        
+        namespaces = {}
+        for name in sorted(set(sizes) | set(counters)):
+            values = counters.get(name, {})
+            hits = values.get("hits", 0)
+            misses = values.get("misses", 0)
+            namespaces[name] = {
+                "size": sizes.get(name, 0),
+                "hits": hits,
+                "misses": misses,
+                "writes": values.get("writes", 0),
+                "evictions": values.get("evictions", 0),
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            }
+        return {
+            "path": self.path,
+            "size": sum(sizes.values()),
+            "max_entries": self.max_entries,
+            "namespaces": namespaces,
+        }
+    
+    def _key(self, namespace: str, prompt: str, llm_string: str) -> str:
+        """缓存键：命名空间、模型参数和提示的哈希"""
+        return hashlib.sha256("\x00".join((namespace, llm_string, prompt)).encode("utf-8")).hexdigest()
+    
+    def _count(self, namespace: str, name: str, amount: int = 1) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(namespace, {})
+            counters[name] = counters.get(name, 0) + amount
+    
+    def _connect(self) -> sqlite3.Connection:
+        """打开数据库连接，首次使用某个文件时建表"""
+        path = self.path
+        conn = sqlite3.connect(path, timeout=self.timeout)
+        if self._initialized_path != path:
+            with self._lock:
+                if self._initialized_path != path:
+                    # WAL 模式下多个进程可以同时读取，写入互不阻塞读取
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS llm_cache ("
+                        "key TEXT PRIMARY KEY, namespace TEXT NOT NULL, response TEXT NOT NULL, "
+                        "created_at REAL NOT NULL, accessed_at REAL NOT NULL, expires_at REAL)"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at)")
+                    conn.commit()
+                    self._initialized_path = path
+        return conn
+
+class NamespacedLLMCache(BaseCache):
+    """某个链的缓存视图，实现 LangChain 的 BaseCache 接口"""
+    
+    def __init__(self, store: SQLiteLLMCache, name: str, ttl: Optional[float] = None):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+    
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        try:
+            cached = self.store.get(self.name, prompt, llm_string)
+        except sqlite3.Error as e:
+            logger.warning(f"读取LLM缓存失败: {e}")
+            cached = None
+        record_cache(f"llm:{self.name}", cached is not None)
+        return cached
+    
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        try:
+            self.store.set(self.name, prompt, llm_string, return_val, ttl=self.ttl)
+        except sqlite3.Error as e:
+            logger.warning(f"写入LLM缓存失败: {e}")
+    
+    def clear(self, **kwargs: Any) -> None:
+        self.store.clear(self.name)
+
+def namespaced_cache(name: str, ttl: Optional[float]) -> Optional[NamespacedLLMCache]:
+    """返回共享缓存的命名空间视图，未启用缓存时返回 None"""
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    return llm_cache.namespace(name, ttl)
+
+# 进程内共享的LLM响应缓存，首次使用时才按 settings.LLM_CACHE_PATH 打开数据库文件
+llm_cache = SQLiteLLMCache(max_entries=settings.LLM_CACHE_MAX_ENTRIES)
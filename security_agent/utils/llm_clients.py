@@ -0,0 +1,147 @@
+"""
+LLM客户端注册表
+
+进程内所有链共享 ChatOpenAI 实例和底层的HTTP连接池：每个 (模型, base_url) 只创建一个模型实例，
+同一个 base_url 的模型共用一对 httpx 客户端（同步和异步），保持长连接，安装了 h2 时启用 HTTP/2，
+避免每个链各自建立连接池和TLS握手。应用启动时预热连接，关闭时统一释放。
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from langchain_core.caches import BaseCache
+from langchain_openai import ChatOpenAI
+
+from security_agent.config import settings
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:  # h2 是可选依赖，未安装时使用 HTTP/1.1
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+class LLMClientRegistry:
+    """按 (模型, base_url) 共享的LLM客户端注册表"""
+    
+    def __init__(
+        self,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 60,
+        timeout: float = 60,
+        http2: bool = True
+    ):
+        """初始化客户端注册表
+        
+        Args:
+            max_connections: 每个 base_url 的最大连接数
+            max_keepalive_connections: 每个 base_url 保持的空闲长连接数
+            keepalive_expiry: 空闲长连接的保持时间（秒）
+            timeout: 请求超时时间（秒）
+            http2: 是否启用 HTTP/2，需要安装 h2
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._http_clients: Dict[str, Tuple[httpx.Client, httpx.AsyncClient]] = {}
+        self._models: Dict[Tuple, ChatOpenAI] = {}
+        self._lock = threading.Lock()
+    
+    def get_chat_model(self, api_key: str, model_name: str, base_url: str, cache: Optional[BaseCache] = None,
+                       **options: Any) -> ChatOpenAI:
+        """获取共享的 ChatOpenAI 实例
+        
+        Args:
+            api_key: API密钥
+            model_name: 模型名称
+            base_url: API地址
+            cache: 响应缓存，None 表示不缓存
+            options: 其他 ChatOpenAI 参数，如 temperature，不同参数对应不同的实例
+        
+        Returns:
+            ChatOpenAI 实例
+        """
+        if cache is not None:
+            options["cache"] = cache
+        key = (model_name, base_url, api_key, tuple(sorted(options.items())))
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                logger.info(f"创建LLM客户端: {model_name} @ {base_url}")
+                http_client, http_async_client = self._get_http_clients(base_url)
+                model = ChatOpenAI(
+                    model_name=model_name,
+                    api_key=api_key,
+                    base_url=base_url,
+                    http_client=http_client,
+                    http_async_client=http_async_client,
+                    **options
+                )
+                self._models[key] = model
+            return model
+    
+    async def warm_up(self, timeout: Optional[float] = 5) -> None:
+        """预先建立到各个 base_url 的连接（TCP和TLS握手），失败只记录日志"""
+        async def _warm(base_url: str, client: httpx.AsyncClient) -> None:
+            try:
+                await client.head(base_url, timeout=timeout)
+                logger.info(f"LLM连接预热完成: {base_url}")
+            except Exception as e:
+                logger.warning(f"LLM连接预热失败: {base_url} {e}")
+        
+        clients = [(base_url, pair[1]) for base_url, pair in list(self._http_clients.items())]
+        await asyncio.gather(*(_warm(base_url, client) for base_url, client in clients))
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回已创建的模型和连接池配置"""
+        return {
+            "models": [{"model": key[0], "base_url": key[1]} for key in list(self._models)],
+            "base_urls": list(self._http_clients),
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+        }
+    
+    async def aclose_all(self) -> None:
+        """关闭所有HTTP客户端并移除已创建的模型"""
+        with self._lock:
+            clients = list(self._http_clients.values())
+            self._http_clients.clear()
+            self._models.clear()
+        
+        for client, async_client in clients:
+            try:
+                await async_client.aclose()
+                client.close()
+            except Exception as e:
+                logger.warning(f"关闭LLM客户端失败: {e}")
+    
+    def _get_http_clients(self, base_url: str) -> Tuple[httpx.Client, httpx.AsyncClient]:
+        """获取 base_url 对应的 httpx 客户端，调用方持有锁"""
+        clients = self._http_clients.get(base_url)
+        if clients is None:
+            options = {"limits": self.limits, "timeout": self.timeout, "http2": self.http2}
+            clients = (httpx.Client(**options), httpx.AsyncClient(**options))
+            self._http_clients[base_url] = clients
+        return clients
+
+# 进程内共享的LLM客户端注册表
+llm_registry = LLMClientRegistry(
+    max_connections=settings.LLM_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+    timeout=settings.LLM_TIMEOUT,
+    http2=settings.LLM_HTTP2
+)
@@ -0,0 +1,148 @@
+"""
+日志采样工具
+
+在给定的token预算内挑选有代表性的日志行交给LLM：
+先合并重复的日志，再优先保留罕见的高危事件和异常活跃的源IP，
+剩余预算按 event_type 和 severity 分层轮流抽取，保证各类事件都有样本。
+"""
+import logging
+import re
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from security_agent.chains.sql_templates import HIGH_RISK_SEVERITIES
+
+logger = logging.getLogger(__name__)
+
+# 默认的token预算
+DEFAULT_TOKEN_BUDGET = 2000
+
+# 合并重复日志时比较的列，其余列（id、时间、原始日志等）不参与比较
+DEDUP_COLUMNS = (
+    "source_ip", "destination_ip", "event_type", "severity", "protocol",
+    "destination_port", "user_id", "action", "status",
+)
+
+# 严重程度排序，数值越大越优先
+SEVERITY_RANK = {"严重": 4, "高": 3, "中": 2, "低": 1}
+
+# 重复次数列名
+REPEAT_COLUMN = "repeat_count"
+
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计文本的token数：中文约每字1个token，其他字符约每4个字符1个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def _row_text(row: pd.Series) -> str:
+    return " | ".join("" if pd.isna(value) else str(value) for value in row.values)
+
+def collapse_duplicates(logs_df: pd.DataFrame, columns: Iterable[str] = DEDUP_COLUMNS) -> pd.DataFrame:
+    """合并关键字段相同的日志，保留第一条并记录重复次数"""
+    keys = [name for name in columns if name in logs_df.columns]
+    if not keys or logs_df.empty:
+        collapsed = logs_df.copy()
+        collapsed[REPEAT_COLUMN] = 1
+        return collapsed
+    
+    grouped = logs_df.groupby(keys, dropna=False, sort=False)
+    collapsed = logs_df.loc[grouped.head(1).index].copy()
+    collapsed[REPEAT_COLUMN] = grouped[keys[0]].transform("size").loc[collapsed.index].astype(int)
+    return collapsed
+
+def _outlier_source_ips(logs_df: pd.DataFrame, limit: int = 5, z_threshold: float = 2.0) -> List[str]:
+    """事件数明显高于其他源IP的地址"""
+    if "source_ip" not in logs_df.columns:
+        return []
+    counts = logs_df["source_ip"].value_counts()
+    if len(counts) < 2:
+        return []
+    std = counts.std(ddof=0)
+    if not std:
+        return []
+    z_scores = (counts - counts.mean()) / std
+    return z_scores[z_scores >= z_threshold].head(limit).index.tolist()
+
+def _stratified_order(logs_df: pd.DataFrame, seed: int) -> List:
+    """按 event_type 和 severity 分层，每轮从每层取一行，罕见和高危的层排在前面"""
+    strata_columns = [name for name in ("event_type", "severity") if name in logs_df.columns]
+    rng = np.random.default_rng(seed)
+    if not strata_columns:
+        return list(rng.permutation(logs_df.index.to_numpy()))
+    
+    strata = []
+    for key, group in logs_df.groupby(strata_columns, dropna=False, sort=True):
+        key = key if isinstance(key, tuple) else (key,)
+        severity = key[strata_columns.index("severity")] if "severity" in strata_columns else None
+        strata.append((-SEVERITY_RANK.get(severity, 0), len(group), list(rng.permutation(group.index.to_numpy()))))
+    strata.sort(key=lambda item: (item[0], item[1]))
+    
+    order = []
+    queues = [indexes for _, _, indexes in strata]
+    while any(queues):
+        for indexes in queues:
+            if indexes:
+                order.append(indexes.pop(0))
+    return order
+
+def sample_logs(
+    logs_df: pd.DataFrame,
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    seed: int = 0,
+    time_column: Optional[str] = None
+) -> pd.DataFrame:
+    """在token预算内挑选有代表性的日志行
+    
+    Args:
+        logs_df: 日志数据
+        token_budget: 样本的token预算，按每行拼接后的文本估算
+        seed: 随机种子，相同输入得到相同样本
+        time_column: 时间字段名，指定时样本按时间排序
+    
+    Returns:
+        样本数据，增加 repeat_count 列表示合并的重复日志条数
+    """
+    if logs_df.empty:
+        return logs_df.copy()
+    
+    logs_df = logs_df.reset_index(drop=True)
+    collapsed = collapse_duplicates(logs_df)
+    
+    # 优先保留：每种高危事件一行，每个异常活跃的源IP一行
+    priority = []
+    if "severity" in collapsed.columns:
+        high_risk = collapsed[collapsed["severity"].isin(HIGH_RISK_SEVERITIES)]
+        group_columns = [name for name in ("event_type", "severity") if name in collapsed.columns]
+        priority.extend(high_risk.groupby(group_columns, dropna=False, sort=False).head(1).index)
+    for source_ip in _outlier_source_ips(logs_df):
+        matches = collapsed.index[collapsed["source_ip"] == source_ip]
+        if len(matches):
+            priority.append(matches[0])
+    
+    selected = []
+    seen = set()
+    used_tokens = 0
+    for position, index in enumerate(priority + _stratified_order(collapsed, seed)):
+        if index in seen:
+            continue
+        cost = estimate_tokens(_row_text(collapsed.loc[index]))
+        if selected and used_tokens + cost > token_budget:
+            # 优先保留的行放不下时跳过，分层抽取阶段超出预算即停止
+            if position < len(priority):
+                continue
+            break
+        seen.add(index)
+        selected.append(index)
+        used_tokens += cost
+    
+    sample = collapsed.loc[selected]
+    if time_column and time_column in sample.columns:
+        sample = sample.sort_values(time_column, ascending=False, kind="stable")
+    logger.info(f"日志采样完成: {len(logs_df)} 条日志合并为 {len(collapsed)} 条，选取 {len(sample)} 条，约 {used_tokens} tokens")
+    return sample
@@ -0,0 +1,118 @@
+"""
+日志统计工具
+
+用 pandas 向量化运算在完整结果集上精确计算日志摘要统计，
+代替把采样日志交给LLM计数。返回的结构与 LogProcessorChain 原来要求LLM输出的JSON一致。
+fetch_log_statistics 用聚合查询在数据库中计算同样的统计，不需要取回原始日志。
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 默认的排行数量
+DEFAULT_TOP_N = 5
+
+def _sorted_counts(series: pd.Series) -> pd.Series:
+    """各取值出现次数，按次数降序，次数相同时按取值升序"""
+    counts = series.dropna().astype(str).value_counts().sort_index()
+    return counts.sort_values(ascending=False, kind="stable")
+
+def _value_counts(series: pd.Series) -> Dict[str, int]:
+    """统计各取值出现次数"""
+    return {key: int(value) for key, value in _sorted_counts(series).items()}
+
+def _top_values(series: pd.Series, name: str, top_n: int) -> List[Dict[str, Any]]:
+    """出现次数最多的前 top_n 个取值"""
+    return [{name: key, "count": int(value)} for key, value in _sorted_counts(series).head(top_n).items()]
+
+def empty_log_statistics() -> Dict[str, Any]:
+    """没有日志时的统计结果"""
+    return {
+        "total_logs": 0,
+        "event_types": {},
+        "severity_levels": {},
+        "unique_source_ips": 0,
+        "unique_dest_ips": 0,
+        "top_source_ips": [],
+        "top_event_types": [],
+    }
+
+def compute_log_statistics(logs_df: pd.DataFrame, top_n: int = DEFAULT_TOP_N) -> Dict[str, Any]:
+    """计算日志摘要统计
+    
+    Args:
+        logs_df: 日志数据，缺少的列对应的统计项为空
+        top_n: 排行列表的长度
+    
+    Returns:
+        包含日志总数、事件类型分布、严重程度分布、唯一源/目标IP数量、
+        最活跃源IP和最常见事件类型的字典，可以直接序列化为JSON
+    """
+    stats = empty_log_statistics()
+    stats["total_logs"] = int(len(logs_df))
+    if logs_df.empty:
+        return stats
+    
+    columns = logs_df.columns
+    if "event_type" in columns:
+        stats["event_types"] = _value_counts(logs_df["event_type"])
+        stats["top_event_types"] = _top_values(logs_df["event_type"], "event_type", top_n)
+    if "severity" in columns:
+        stats["severity_levels"] = _value_counts(logs_df["severity"])
+    if "source_ip" in columns:
+        stats["unique_source_ips"] = int(logs_df["source_ip"].nunique())
+        stats["top_source_ips"] = _top_values(logs_df["source_ip"], "source_ip", top_n)
+    if "destination_ip" in columns:
+        stats["unique_dest_ips"] = int(logs_df["destination_ip"].nunique())
+    
+    return stats
+
+async def fetch_log_statistics(executor, templates, time_range: Dict[str, Any], top_n: int = DEFAULT_TOP_N) -> Dict[str, Any]:
+    """在数据库中计算时间范围内的日志摘要统计
+    
+    使用 COUNT / COUNT(DISTINCT) / GROUP BY 聚合查询覆盖整个时间窗口，
+    返回结构与 compute_log_statistics 相同。
+    
+    Args:
+        executor: AsyncQueryExecutor
+        templates: SQLTemplateLibrary
+        time_range: 包含 start_time 和 end_time 的时间范围
+        top_n: 排行列表的长度
+    
+    Returns:
+        日志摘要统计
+    """
+    queries = [
+        templates.render("summary_totals", time_range),
+        templates.render("event_type_counts", time_range),
+        templates.render("severity_counts", time_range),
+        templates.render("top_source_ips", time_range, top_n=top_n),
+    ]
+    totals, event_types, severities, top_ips = await asyncio.gather(
+        *(executor.fetch_records(query.sql, query.params) for query in queries)
+    )
+    
+    stats = empty_log_statistics()
+    if totals:
+        stats["total_logs"] = int(totals[0]["total_logs"] or 0)
+        stats["unique_source_ips"] = int(totals[0]["unique_source_ips"] or 0)
+        stats["unique_dest_ips"] = int(totals[0]["unique_dest_ips"] or 0)
+    
+    stats["event_types"] = {
+        str(row["event_type"]): int(row["event_count"]) for row in event_types if row["event_type"] is not None
+    }
+    stats["severity_levels"] = {
+        str(row["severity"]): int(row["event_count"]) for row in severities if row["severity"] is not None
+    }
+    stats["top_event_types"] = [
+        {"event_type": key, "count": value} for key, value in list(stats["event_types"].items())[:top_n]
+    ]
+    stats["top_source_ips"] = [
+        {"source_ip": str(row["source_ip"]), "count": int(row["event_count"])}
+        for row in top_ips if row["source_ip"] is not None
+    ]
+    return stats
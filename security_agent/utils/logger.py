@@ -1,4 +1,4 @@
-'''
+r'''
 Description: 
 version: 
 Author: Bao Jiaming
@@ -14,6 +14,7 @@ import sys
 from pathlib import Path
 
 from security_agent.config import settings
+from security_agent.utils.tracing import install_log_record_factory
 
 def setup_logger():
     """设置日志记录器"""
@@ -24,10 +25,11 @@ def setup_logger():
     # 获取日志级别
     log_level = getattr(logging, settings.LOG_LEVEL.upper())
     
-    # 配置根日志记录器
+    # 配置根日志记录器，trace_id 为当前请求的 trace id
+    install_log_record_factory()
     logging.basicConfig(
         level=log_level,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        format="%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] - %(message)s",
         handlers=[
             logging.StreamHandler(sys.stdout),
             logging.FileHandler(log_dir / "security_agent.log")
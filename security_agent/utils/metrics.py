@@ -0,0 +1,270 @@
+"""
+进程内指标
+
+记录各阶段的耗时直方图、SQL取回的行数、LLM的耗时和 token 用量、缓存命中以及错误次数，
+由 /metrics 以 Prometheus 文本格式暴露，不需要额外的采集进程或依赖。
+多个 uvicorn worker 各自统计本进程的指标，由 Prometheus 按实例分别抓取。
+"""
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from security_agent.utils.tracing import LLMTracingHandler, tracer
+
+logger = logging.getLogger(__name__)
+
+# 耗时直方图的桶（秒），覆盖从缓存命中到长时间的模型调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+# 取回行数直方图的桶
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+def _escape(value: Any) -> str:
+    """转义标签值中的反斜杠、引号和换行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric:
+    """带标签的指标"""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+    
+    def collect(self) -> List[str]:
+        """Prometheus 文本格式的行"""
+        raise NotImplementedError
+    
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+    
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        """增加计数，labels 必须与 labelnames 一致"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def value(self, **labels: Any) -> float:
+        """当前计数"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+    
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Histogram(_Metric):
+    """按桶统计观测值的直方图"""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+    
+    def observe(self, value: float, **labels: Any) -> None:
+        """记录一个观测值"""
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            total[0] += value
+    
+    def count(self, **labels: Any) -> int:
+        """观测次数"""
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[0]) if series is not None else 0
+    
+    def sum(self, **labels: Any) -> float:
+        """观测值之和"""
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return series[1][0] if series is not None else 0.0
+    
+    def collect(self) -> List[str]:
+        # 桶计数为累计值
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """指标注册表"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """注册计数器"""
+        return self._register(Counter(name, documentation, labelnames))
+    
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """注册直方图"""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+    
+    def render(self) -> str:
+        """所有指标的 Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.collect()) + "\n"
+    
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标重复: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+# 进程内共享的指标注册表
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram(
+    "security_agent_stage_duration_seconds", "各阶段的耗时（秒）", ["stage"]
+)
+STAGE_ERRORS = registry.counter(
+    "security_agent_stage_errors_total", "各阶段抛出异常的次数", ["stage"]
+)
+LLM_DURATION = registry.histogram(
+    "security_agent_llm_request_duration_seconds", "各阶段单次LLM调用的耗时（秒），包括缓存命中", ["stage"]
+)
+LLM_TOKENS = registry.counter(
+    "security_agent_llm_tokens_total", "各阶段消耗的LLM token 数，type 为 prompt 或 completion", ["stage", "type"]
+)
+LLM_ERRORS = registry.counter(
+    "security_agent_llm_errors_total", "各阶段LLM调用失败的次数", ["stage"]
+)
+SQL_ROWS = registry.histogram(
+    "security_agent_sql_rows_fetched", "单次SQL查询取回的行数", buckets=ROW_BUCKETS
+)
+CACHE_REQUESTS = registry.counter(
+    "security_agent_cache_requests_total", "缓存查询次数，result 为 hit 或 miss", ["cache", "result"]
+)
+ADMISSION_WAIT = registry.histogram(
+    "security_agent_admission_wait_seconds", "各接口的请求在准入队列中等待的时间（秒）", ["endpoint"]
+)
+ADMISSION_REJECTED = registry.counter(
+    "security_agent_admission_rejected_total", "各接口被准入控制拒绝的请求数，status 为 429（队列已满）或 503（等待超时）",
+    ["endpoint", "status"]
+)
+
+@contextmanager
+def observe_stage(stage: str, **attributes: Any):
+    """记录代码块的耗时，抛出异常时增加该阶段的错误次数
+    
+    在请求的 trace 中同时记录一个同名的 span，attributes 为 span 的属性，返回该 span（不在 trace 中时为 None）。
+    """
+    started = time.perf_counter()
+    with tracer.span(stage, **attributes) as span:
+        try:
+            yield span
+        except Exception:
+            STAGE_ERRORS.inc(stage=stage)
+            raise
+        finally:
+            STAGE_DURATION.observe(time.perf_counter() - started, stage=stage)
+
+def timed_stage(stage: str):
+    """记录函数（同步或异步）耗时和异常次数的装饰器"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with observe_stage(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with observe_stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_cache(cache: str, hit: bool) -> None:
+    """记录一次缓存查询"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """记录LLM调用耗时、token 用量和错误次数的回调"""
+    
+    # 只更新内存中的计数，直接在调用线程中执行
+    run_inline = True
+    
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._started: Dict[UUID, float] = {}
+    
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+    
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+    
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self._observe(run_id)
+        # 缓存命中时没有 llm_output，不计入 token 用量
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        for kind in ("prompt", "completion"):
+            tokens = usage.get(f"{kind}_tokens")
+            if tokens:
+                LLM_TOKENS.inc(tokens, stage=self.stage, type=kind)
+    
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._observe(run_id)
+        LLM_ERRORS.inc(stage=self.stage)
+    
+    def _observe(self, run_id: UUID) -> None:
+        started: Optional[float] = self._started.pop(run_id, None)
+        if started is not None:
+            LLM_DURATION.observe(time.perf_counter() - started, stage=self.stage)
+
+def llm_callbacks(stage: str) -> List[BaseCallbackHandler]:
+    """某个阶段的链使用的回调列表（指标和 trace 中的LLM调用 span），通过 with_config(callbacks=...) 绑定到链上"""
+    return [LLMMetricsHandler(stage), LLMTracingHandler(stage)]
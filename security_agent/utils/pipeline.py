@@ -0,0 +1,107 @@
+"""
+按依赖关系并发执行的阶段图
+
+每个阶段是一个函数（可以返回协程），依赖的阶段完成后以关键字参数接收它们的结果；
+没有依赖关系的阶段并发执行，并记录每个阶段的耗时。
+"""
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Callable, Dict, NamedTuple, Sequence, Tuple
+
+from security_agent.utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+class GraphResult(NamedTuple):
+    """阶段图的执行结果"""
+    results: Dict[str, Any]  # 各阶段的结果，被取消的阶段为 None
+    timings: Dict[str, float]  # 各阶段的耗时（秒），total 为整个阶段图的耗时
+
+class StageGraph:
+    """阶段图，阶段按添加顺序声明，只能依赖已经添加的阶段
+    
+    在请求的 trace 中，阶段图和每个阶段各记录一个 span。
+    """
+    
+    def __init__(self, name: str = "pipeline"):
+        """初始化阶段图
+        
+        Args:
+            name: 阶段图名称，用于日志
+        """
+        self.name = name
+        self._stages: Dict[str, Tuple[Callable[..., Any], Tuple[str, ...]]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+    
+    def add(self, name: str, func: Callable[..., Any], deps: Sequence[str] = ()) -> "StageGraph":
+        """添加阶段
+        
+        Args:
+            name: 阶段名称
+            func: 以依赖阶段的名称为参数名接收它们的结果，返回协程时等待其完成
+            deps: 依赖的阶段名称
+        
+        Returns:
+            阶段图本身，便于链式添加
+        """
+        if name in self._stages:
+            raise ValueError(f"阶段重复: {name}")
+        missing = [dep for dep in deps if dep not in self._stages]
+        if missing:
+            raise ValueError(f"阶段 {name} 依赖未定义的阶段: {missing}")
+        self._stages[name] = (func, tuple(deps))
+        return self
+    
+    def cancel(self, name: str) -> None:
+        """取消正在执行的阶段（如不再需要的预取），依赖它的阶段也会被取消"""
+        task = self._tasks.get(name)
+        if task is not None and not task.done():
+            logger.info(f"{self.name} 取消阶段: {name}")
+            task.cancel()
+    
+    async def result(self, name: str) -> Any:
+        """在执行过程中等待某个阶段的结果，用于按条件使用某个阶段（如预取）的结果"""
+        return await self._tasks[name]
+    
+    async def run(self) -> GraphResult:
+        """执行所有阶段，任一阶段失败时取消其余阶段并抛出异常"""
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        
+        async def _run_stage(name, func, deps):
+            values = {dep: await self._tasks[dep] for dep in deps}
+            stage_started = time.perf_counter()
+            try:
+                with tracer.span(name, graph=self.name):
+                    result = func(**values)
+                    if inspect.isawaitable(result):
+                        result = await result
+                    return result
+            finally:
+                timings[name] = time.perf_counter() - stage_started
+        
+        with tracer.span(self.name):
+            # 阶段任务在阶段图的 span 中创建，继承它作为父 span
+            self._tasks = {
+                name: asyncio.ensure_future(_run_stage(name, func, deps))
+                for name, (func, deps) in self._stages.items()
+            }
+            pending = set(self._tasks.values())
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+                    for task in done:
+                        if not task.cancelled() and task.exception() is not None:
+                            raise task.exception()
+            finally:
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    await asyncio.gather(*pending, return_exceptions=True)
+        
+        timings["total"] = time.perf_counter() - started
+        logger.info(f"{self.name} 阶段耗时: " + ", ".join(f"{name}={seconds:.3f}s" for name, seconds in timings.items()))
+        results = {name: None if task.cancelled() else task.result() for name, task in self._tasks.items()}
+        return GraphResult(results=results, timings=timings)
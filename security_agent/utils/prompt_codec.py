@@ -0,0 +1,123 @@
+"""
+日志提示编码工具
+
+把日志样本编码成紧凑的表格文本放进提示词：只写一次列名，每行用分隔符连接字段值，
+重复出现的取值（事件类型、严重程度、IP等）替换为字典编码，长文本字段截断，
+全部为空的列直接省略。相比 to_json(orient="records") 每行重复列名，
+通常可以把日志部分的token数减少到原来的几分之一。
+"""
+import logging
+from typing import Iterable, List, Mapping, NamedTuple, Optional
+
+import pandas as pd
+
+from security_agent.utils.log_sampler import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 字段分隔符
+FIELD_SEPARATOR = "|"
+
+# 使用字典编码的列
+DICT_COLUMNS = (
+    "event_type", "severity", "protocol", "source_ip", "destination_ip",
+    "user_id", "action", "status", "description", "raw_log",
+)
+
+# 需要截断的长文本列及最大长度
+TRUNCATE_COLUMNS = {"raw_log": 80, "description": 80}
+
+# 时间格式
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+class EncodedLogs(NamedTuple):
+    """编码结果"""
+    text: str
+    rows: int
+    original_tokens: int
+    encoded_tokens: int
+    
+    @property
+    def savings(self) -> float:
+        """节省的token比例"""
+        if not self.original_tokens:
+            return 0.0
+        return 1 - self.encoded_tokens / self.original_tokens
+
+def _format_value(value) -> str:
+    if value is None or (not isinstance(value, (list, dict)) and pd.isna(value)):
+        return ""
+    if isinstance(value, pd.Timestamp):
+        return value.strftime(TIMESTAMP_FORMAT)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    text = str(value)
+    return text.replace("\r", " ").replace("\n", " ").replace(FIELD_SEPARATOR, "/")
+
+def _truncate(text: str, max_length: int) -> str:
+    if len(text) <= max_length:
+        return text
+    return text[:max_length - 1] + "…"
+
+def encode_logs(
+    logs_df: pd.DataFrame,
+    dict_columns: Iterable[str] = DICT_COLUMNS,
+    truncate_columns: Optional[Mapping[str, int]] = None
+) -> EncodedLogs:
+    """将日志数据编码为紧凑的表格文本
+    
+    输出格式：
+        说明行
+        字典行，每个字典编码列一行，形如 source_ip: #0=10.0.0.1 #1=10.0.0.2
+        列名行，字段以 | 分隔
+        数据行，字段以 | 分隔，#n 表示该列字典中的取值，空字段表示缺失
+    
+    Args:
+        logs_df: 日志数据
+        dict_columns: 取值重复时使用字典编码的列
+        truncate_columns: 需要截断的列名 -> 最大长度，默认使用 TRUNCATE_COLUMNS
+    
+    Returns:
+        编码结果，包含编码前后估算的token数
+    """
+    if logs_df.empty:
+        return EncodedLogs("无日志数据", 0, 0, 0)
+    
+    truncate_columns = TRUNCATE_COLUMNS if truncate_columns is None else truncate_columns
+    columns = [name for name in logs_df.columns if not logs_df[name].isna().all()]
+    
+    values = {}
+    for name in columns:
+        formatted = [_format_value(value) for value in logs_df[name]]
+        if name in truncate_columns:
+            formatted = [_truncate(text, truncate_columns[name]) for text in formatted]
+        values[name] = formatted
+    
+    dictionary_lines: List[str] = []
+    for name in dict_columns:
+        if name not in values:
+            continue
+        counts = pd.Series(values[name]).value_counts(sort=False)
+        # 只对重复出现且比编码更长的取值编码
+        repeated = [text for text, count in counts.items() if text and count > 1 and len(text) > 3]
+        if not repeated:
+            continue
+        codes = {text: f"#{index}" for index, text in enumerate(repeated)}
+        values[name] = [codes.get(text, text) for text in values[name]]
+        dictionary_lines.append(f"{name}: " + " ".join(f"{code}={text}" for text, code in codes.items()))
+    
+    lines = [f"共 {len(logs_df)} 行日志，字段以 {FIELD_SEPARATOR} 分隔，表头为列名，#n 为该列字典中的编码，空字段表示缺失"]
+    if dictionary_lines:
+        lines.append("字典:")
+        lines.extend(dictionary_lines)
+    lines.append(FIELD_SEPARATOR.join(columns))
+    lines.extend(FIELD_SEPARATOR.join(row) for row in zip(*(values[name] for name in columns)))
+    text = "\n".join(lines)
+    
+    original_tokens = estimate_tokens(logs_df.to_json(orient="records", date_format="iso", force_ascii=False))
+    encoded = EncodedLogs(text, len(logs_df), original_tokens, estimate_tokens(text))
+    logger.info(
+        f"日志提示编码完成: {encoded.rows} 行，约 {encoded.original_tokens} -> {encoded.encoded_tokens} tokens，"
+        f"节省 {encoded.savings:.0%}"
+    )
+    return encoded
@@ -0,0 +1,154 @@
+"""
+查询执行工具
+
+直接通过 SQLAlchemy 执行查询，返回带真实列名的类型化结果，
+避免 QuerySQLDataBaseTool 把结果转成字符串后再用 literal_eval 解析。
+AsyncQueryExecutor 使用异步引擎（MySQL 使用 aiomysql，SQLite 使用 aiosqlite），
+查询期间不会阻塞事件循环。引擎由 engine_registry 统一管理。
+"""
+import logging
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow 是可选依赖
+    pa = None
+
+from security_agent.utils.engine_registry import engine_registry, to_async_url
+from security_agent.utils.metrics import SQL_ROWS, observe_stage
+
+logger = logging.getLogger(__name__)
+
+class QueryResult(NamedTuple):
+    """查询结果，列名来自游标描述"""
+    columns: List[str]
+    rows: List[tuple]
+
+def rows_to_dataframe(result: QueryResult, parse_dates: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """将查询结果转换为 DataFrame
+    
+    Args:
+        result: 查询结果
+        parse_dates: 需要转换为 datetime 的列名，SQLite 返回的时间是字符串
+    
+    Returns:
+        DataFrame
+    """
+    df = pd.DataFrame.from_records(result.rows, columns=result.columns)
+    for column in parse_dates or ():
+        if column in df.columns and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column], errors="coerce")
+    return df
+
+class QueryExecutor:
+    """基于 SQLAlchemy 引擎的查询执行器"""
+    
+    def __init__(self, engine: Engine):
+        """初始化查询执行器
+        
+        Args:
+            engine: SQLAlchemy 引擎
+        """
+        self.engine = engine
+    
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> QueryResult:
+        """执行查询
+        
+        Args:
+            sql: SQL语句，可以包含 :name 形式的绑定参数
+            params: 绑定参数
+        
+        Returns:
+            QueryResult
+        """
+        logger.info(f"执行SQL查询: {sql[:100]}...")
+        with observe_stage("sql_execution", sql=sql[:200]) as span, self.engine.connect() as connection:
+            cursor = connection.execute(text(sql), params or {})
+            if not cursor.returns_rows:
+                return QueryResult(columns=[], rows=[])
+            columns = list(cursor.keys())
+            rows = [tuple(row) for row in cursor.fetchall()]
+            if span is not None:
+                span.set_attribute("rows", len(rows))
+        SQL_ROWS.observe(len(rows))
+        return QueryResult(columns=columns, rows=rows)
+    
+    def fetch_dataframe(
+        self,
+        sql: str,
+        params: Optional[Dict[str, Any]] = None,
+        parse_dates: Optional[Iterable[str]] = None
+    ) -> pd.DataFrame:
+        """执行查询并返回 DataFrame"""
+        return rows_to_dataframe(self.execute(sql, params), parse_dates)
+    
+    def fetch_records(self, sql: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """执行查询并返回字典列表"""
+        result = self.execute(sql, params)
+        return [dict(zip(result.columns, row)) for row in result.rows]
+    
+    def fetch_arrow(self, sql: str, params: Optional[Dict[str, Any]] = None):
+        """执行查询并返回 pyarrow.Table，需要安装 pyarrow"""
+        if pa is None:
+            raise ImportError("fetch_arrow 需要安装 pyarrow")
+        result = self.execute(sql, params)
+        arrays = [list(column) for column in zip(*result.rows)] if result.rows else [[] for _ in result.columns]
+        return pa.Table.from_arrays([pa.array(values) for values in arrays], names=result.columns)
+
+class AsyncQueryExecutor:
+    """基于 SQLAlchemy 异步引擎的查询执行器"""
+    
+    def __init__(self, engine: AsyncEngine):
+        """初始化异步查询执行器
+        
+        Args:
+            engine: SQLAlchemy 异步引擎
+        """
+        self.engine = engine
+    
+    @classmethod
+    def from_url(cls, db_connection: str) -> "AsyncQueryExecutor":
+        """根据同步连接字符串创建异步查询执行器，引擎从共享注册表获取"""
+        return cls(engine_registry.get_async_engine(db_connection))
+    
+    async def execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> QueryResult:
+        """执行查询
+        
+        Args:
+            sql: SQL语句，可以包含 :name 形式的绑定参数
+            params: 绑定参数
+        
+        Returns:
+            QueryResult
+        """
+        logger.info(f"异步执行SQL查询: {sql[:100]}...")
+        with observe_stage("sql_execution", sql=sql[:200]) as span:
+            async with self.engine.connect() as connection:
+                cursor = await connection.execute(text(sql), params or {})
+                if not cursor.returns_rows:
+                    return QueryResult(columns=[], rows=[])
+                columns = list(cursor.keys())
+                rows = [tuple(row) for row in cursor.fetchall()]
+            if span is not None:
+                span.set_attribute("rows", len(rows))
+        SQL_ROWS.observe(len(rows))
+        return QueryResult(columns=columns, rows=rows)
+    
+    async def fetch_dataframe(
+        self,
+        sql: str,
+        params: Optional[Dict[str, Any]] = None,
+        parse_dates: Optional[Iterable[str]] = None
+    ) -> pd.DataFrame:
+        """执行查询并返回 DataFrame"""
+        return rows_to_dataframe(await self.execute(sql, params), parse_dates)
+    
+    async def fetch_records(self, sql: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """执行查询并返回字典列表"""
+        result = await self.execute(sql, params)
+        return [dict(zip(result.columns, row)) for row in result.rows]
@@ -0,0 +1,436 @@
+"""
+按小时汇总表
+
+按小时、事件类型、严重程度、协议、源IP和目标端口汇总安全日志的事件数，
+并按小时、事件类型和严重程度保存去重的目标IP，用于精确计算唯一目标IP数量。
+后台任务从高水位线开始增量更新，多个 worker 同时运行时通过数据库中的租约只由一个 worker 更新。查询时已经汇总完成的完整小时直接读取汇总表，
+只有时间窗口两端不足一小时的部分和高水位线之后的部分读取原始日志表，
+因此"最近N小时"的报告既包含最新的日志，耗时也基本与日志量无关。
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import (
+    Column, Float, Integer, MetaData, String, Table, column, distinct, func, or_, select, table, text, union_all
+)
+from sqlalchemy.exc import IntegrityError
+
+from security_agent.chains.sql_templates import HOUR_FORMAT, check_identifier, hour_bucket_expression, dialect_from_url
+from security_agent.utils.engine_registry import engine_registry
+from security_agent.utils.log_stats import DEFAULT_TOP_N, empty_log_statistics
+from security_agent.utils.time_grammar import TIME_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# 汇总维度
+ROLLUP_DIMENSIONS = ("event_type", "severity", "protocol", "source_ip", "destination_port")
+# 目标IP去重表的维度，报告可以按这些列过滤
+DEST_IP_DIMENSIONS = ("event_type", "severity")
+
+# 高水位线表名
+WATERMARK_TABLE = "rollup_watermarks"
+# 更新任务租约表名
+LEASE_TABLE = "rollup_leases"
+
+def floor_hour(value: datetime) -> datetime:
+    """截断到整点"""
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def split_rollup_range(
+    time_range: Dict[str, Any],
+    high_water: datetime
+) -> Optional[Tuple[Tuple[datetime, datetime], List[Tuple[datetime, datetime, bool]]]]:
+    """将时间范围拆分为汇总表覆盖的完整小时和需要读取原始日志表的部分
+    
+    结束时间是整点（如 12:00:00）或整点前一秒（如 11:59:59）时不包含结束时刻，
+    其他结束时间与 BETWEEN 一致包含结束时刻。
+    
+    Args:
+        time_range: 包含 start_time 和 end_time 的时间范围
+        high_water: 高水位线，之前的小时都已经汇总完成
+    
+    Returns:
+        (完整小时的 [开始, 结束) 区间, 原始表区间列表 [(开始, 结束, 是否包含结束时刻)])，
+        时间范围无效或不包含已汇总的完整小时时返回 None
+    """
+    try:
+        start = datetime.strptime(time_range["start_time"], TIME_FORMAT)
+        end = datetime.strptime(time_range["end_time"], TIME_FORMAT)
+    except (KeyError, TypeError, ValueError):
+        return None
+    
+    if end.minute == 59 and end.second == 59:
+        end = end + timedelta(seconds=1)
+    end_inclusive = end != floor_hour(end)
+    
+    hours_start = floor_hour(start)
+    if hours_start < start:
+        hours_start += timedelta(hours=1)
+    hours_end = min(floor_hour(end), high_water)
+    if hours_end <= hours_start:
+        return None
+    
+    raw_ranges = []
+    if start < hours_start:
+        raw_ranges.append((start, hours_start, False))
+    if hours_end < end or end_inclusive:
+        raw_ranges.append((hours_end, end, end_inclusive))
+    return (hours_start, hours_end), raw_ranges
+
+class RollupManager:
+    """安全日志按小时汇总表"""
+    
+    def __init__(
+        self,
+        db_connection: str,
+        table_name: str,
+        time_column: str = "event_time",
+        backfill_hours: int = 168,
+        lookback_hours: int = 1,
+        chunk_hours: int = 24
+    ):
+        """初始化汇总表
+        
+        Args:
+            db_connection: 数据库连接字符串
+            table_name: 原始安全日志表名
+            time_column: 时间字段名
+            backfill_hours: 首次汇总时最多回溯的小时数
+            lookback_hours: 每次更新时重新汇总的已完成小时数，用于收录迟到的日志
+            chunk_hours: 每个事务汇总的小时数
+        """
+        self.db_connection = db_connection
+        self.table_name = check_identifier(table_name)
+        self.time_column = check_identifier(time_column)
+        self.dialect = dialect_from_url(db_connection)
+        self.backfill_hours = backfill_hours
+        self.lookback_hours = lookback_hours
+        self.chunk_hours = chunk_hours
+        
+        # 整点时间按 HOUR_FORMAT 存成字符串，MySQL 和 SQLite 都可以直接按字符串比较
+        self.metadata = MetaData()
+        self.rollup_table = Table(
+            f"{table_name}_hourly_rollup",
+            self.metadata,
+            Column("hour_bucket", String(19), nullable=False, index=True),
+            Column("event_type", String(100)),
+            Column("severity", String(20)),
+            Column("protocol", String(20)),
+            Column("source_ip", String(50)),
+            Column("destination_port", Integer),
+            Column("event_count", Integer, nullable=False),
+        )
+        self.dest_ip_table = Table(
+            f"{table_name}_hourly_dest_ips",
+            self.metadata,
+            Column("hour_bucket", String(19), nullable=False, index=True),
+            *(Column(name, String(100)) for name in DEST_IP_DIMENSIONS),
+            Column("destination_ip", String(50)),
+        )
+        self.watermark_table = Table(
+            WATERMARK_TABLE,
+            self.metadata,
+            Column("table_name", String(100), primary_key=True),
+            Column("high_water", String(19), nullable=False),
+        )
+        self.lease_table = Table(
+            LEASE_TABLE,
+            self.metadata,
+            Column("table_name", String(100), primary_key=True),
+            Column("owner", String(100), nullable=False),
+            Column("expires_at", Float, nullable=False),
+        )
+        # 租约持有者标识，区分同一台机器上的多个 worker
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.raw_table = table(
+            table_name,
+            column(time_column),
+            column("destination_ip"),
+            *(column(name) for name in ROLLUP_DIMENSIONS)
+        )
+        self._tables_created = False
+    
+    @property
+    def engine(self):
+        """共享的异步引擎"""
+        return engine_registry.get_async_engine(self.db_connection)
+    
+    async def ensure_tables(self) -> None:
+        """创建汇总表、目标IP去重表、高水位线表和租约表"""
+        if self._tables_created:
+            return
+        async with self.engine.begin() as connection:
+            await connection.run_sync(self.metadata.create_all)
+        self._tables_created = True
+    
+    async def acquire_lease(self, duration: float) -> bool:
+        """获取或续期更新任务的租约
+        
+        租约保存在数据库中，同一个原始表同时只有一个持有者；持有者停止续期后租约在 duration 秒后过期，
+        其他 worker 可以接手。
+        
+        Args:
+            duration: 租约有效期（秒）
+        
+        Returns:
+            是否持有租约
+        """
+        await self.ensure_tables()
+        lease = self.lease_table
+        now = time.time()
+        values = {"owner": self.owner, "expires_at": now + duration}
+        async with self.engine.begin() as connection:
+            result = await connection.execute(
+                lease.update()
+                .where(lease.c.table_name == self.table_name, or_(lease.c.owner == self.owner, lease.c.expires_at < now))
+                .values(**values)
+            )
+            if result.rowcount:
+                return True
+        try:
+            async with self.engine.begin() as connection:
+                await connection.execute(lease.insert().values(table_name=self.table_name, **values))
+            return True
+        except IntegrityError:
+            # 其他 worker 持有未过期的租约
+            return False
+    
+    async def get_watermark(self) -> Optional[datetime]:
+        """读取高水位线，之前的小时都已经汇总完成"""
+        await self.ensure_tables()
+        async with self.engine.connect() as connection:
+            return await self._read_watermark(connection)
+    
+    async def update(self, now: Optional[datetime] = None) -> int:
+        """从高水位线增量汇总到当前整点
+        
+        Args:
+            now: 当前时间，默认使用系统时间
+        
+        Returns:
+            本次汇总的小时数
+        """
+        await self.ensure_tables()
+        end = floor_hour(now or datetime.now())
+        
+        async with self.engine.connect() as connection:
+            high_water = await self._read_watermark(connection)
+            if high_water is None:
+                start = await self._initial_start(connection, end)
+            else:
+                start = min(high_water, end) - timedelta(hours=self.lookback_hours)
+        
+        hours = 0
+        chunk_start = start
+        while chunk_start < end:
+            chunk_end = min(chunk_start + timedelta(hours=self.chunk_hours), end)
+            async with self.engine.begin() as connection:
+                await self._rollup_range(connection, chunk_start, chunk_end)
+                await self._write_watermark(connection, chunk_end)
+            hours += int((chunk_end - chunk_start).total_seconds() // 3600)
+            chunk_start = chunk_end
+        
+        if hours:
+            logger.info(f"汇总表更新完成: {self.table_name} {start.strftime(TIME_FORMAT)} 至 {end.strftime(TIME_FORMAT)}")
+        elif high_water is None:
+            async with self.engine.begin() as connection:
+                await self._write_watermark(connection, end)
+        return hours
+    
+    async def fetch_statistics(
+        self,
+        time_range: Dict[str, Any],
+        top_n: int = DEFAULT_TOP_N,
+        filters: Optional[Dict[str, Sequence[str]]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """从汇总表读取日志摘要统计
+        
+        返回与 compute_log_statistics 相同结构的统计：已经汇总完成的完整小时读取汇总表和目标IP去重表，
+        时间范围两端不足一小时的部分和高水位线之后的部分在原始日志表中聚合。
+        时间范围内没有已汇总的完整小时或按其他列过滤时返回 None，由调用方回退到原始日志表。
+        
+        Args:
+            time_range: 包含 start_time 和 end_time 的时间范围
+            top_n: 排行列表的长度
+            filters: 过滤条件，列名 -> 取值列表，例如 {"severity": ("高", "严重")}
+        
+        Returns:
+            日志摘要统计或 None
+        """
+        filters = filters or {}
+        if any(name not in DEST_IP_DIMENSIONS for name in filters):
+            return None
+        
+        high_water = await self.get_watermark()
+        if high_water is None:
+            return None
+        split = split_rollup_range(time_range, high_water)
+        if split is None:
+            return None
+        hours, raw_ranges = split
+        
+        # 汇总表的完整小时与原始表两端的聚合结果合并后再统计
+        raw = self.raw_table
+        rollup = self.rollup_table
+        dest_ips = self.dest_ip_table
+        start, end = (value.strftime(HOUR_FORMAT) for value in hours)
+        counted = ("event_type", "severity", "source_ip")
+        counts_parts = [
+            select(*(rollup.c[name] for name in counted), rollup.c.event_count).where(
+                rollup.c.hour_bucket >= start, rollup.c.hour_bucket < end,
+                *(rollup.c[name].in_(list(values)) for name, values in filters.items())
+            )
+        ]
+        dest_ip_parts = [
+            select(dest_ips.c.destination_ip).where(
+                dest_ips.c.hour_bucket >= start, dest_ips.c.hour_bucket < end,
+                *(dest_ips.c[name].in_(list(values)) for name, values in filters.items())
+            )
+        ]
+        for lower, upper, inclusive in raw_ranges:
+            time_column = raw.c[self.time_column]
+            raw_conditions = [
+                time_column >= lower.strftime(TIME_FORMAT),
+                time_column <= upper.strftime(TIME_FORMAT) if inclusive else time_column < upper.strftime(TIME_FORMAT),
+                *(raw.c[name].in_(list(values)) for name, values in filters.items())
+            ]
+            counts_parts.append(
+                select(*(raw.c[name] for name in counted), func.count().label("event_count"))
+                .where(*raw_conditions)
+                .group_by(*(raw.c[name] for name in counted))
+            )
+            dest_ip_parts.append(select(raw.c.destination_ip).where(*raw_conditions))
+        combined = union_all(*counts_parts).subquery()
+        combined_dest_ips = union_all(*dest_ip_parts).subquery()
+        
+        total = func.sum(combined.c.event_count)
+        async with self.engine.connect() as connection:
+            totals = (await connection.execute(
+                select(func.coalesce(total, 0), func.count(distinct(combined.c.source_ip)))
+            )).one()
+            event_types = (await connection.execute(
+                select(combined.c.event_type, total.label("event_count"))
+                .where(combined.c.event_type.is_not(None))
+                .group_by(combined.c.event_type)
+                .order_by(total.desc(), combined.c.event_type)
+            )).all()
+            severities = (await connection.execute(
+                select(combined.c.severity, total.label("event_count"))
+                .where(combined.c.severity.is_not(None))
+                .group_by(combined.c.severity)
+                .order_by(total.desc(), combined.c.severity)
+            )).all()
+            top_ips = (await connection.execute(
+                select(combined.c.source_ip, total.label("event_count"))
+                .where(combined.c.source_ip.is_not(None))
+                .group_by(combined.c.source_ip)
+                .order_by(total.desc(), combined.c.source_ip)
+                .limit(top_n)
+            )).all()
+            unique_dest_ips = (await connection.execute(
+                select(func.count(distinct(combined_dest_ips.c.destination_ip)))
+            )).scalar()
+        
+        stats = empty_log_statistics()
+        stats["total_logs"] = int(totals[0] or 0)
+        stats["unique_source_ips"] = int(totals[1] or 0)
+        stats["unique_dest_ips"] = int(unique_dest_ips or 0)
+        stats["event_types"] = {str(name): int(count) for name, count in event_types}
+        stats["severity_levels"] = {str(name): int(count) for name, count in severities}
+        stats["top_event_types"] = [
+            {"event_type": key, "count": value} for key, value in list(stats["event_types"].items())[:top_n]
+        ]
+        stats["top_source_ips"] = [{"source_ip": str(ip), "count": int(count)} for ip, count in top_ips]
+        return stats
+    
+    async def run_periodically(self, interval: float) -> None:
+        """后台任务：每隔 interval 秒增量更新一次汇总表
+        
+        每个 uvicorn worker 都会启动该任务，只有持有租约的 worker 执行更新，租约有效期为三个间隔。
+        """
+        logger.info(f"启动汇总表后台任务，间隔 {interval} 秒")
+        while True:
+            try:
+                if await self.acquire_lease(interval * 3):
+                    await self.update()
+                else:
+                    logger.debug(f"其他 worker 正在更新汇总表: {self.table_name}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"汇总表更新失败: {e}")
+            await asyncio.sleep(interval)
+    
+    async def _read_watermark(self, connection) -> Optional[datetime]:
+        result = await connection.execute(
+            select(self.watermark_table.c.high_water).where(self.watermark_table.c.table_name == self.table_name)
+        )
+        value = result.scalar()
+        return datetime.strptime(value, HOUR_FORMAT) if value else None
+    
+    async def _write_watermark(self, connection, high_water: datetime) -> None:
+        watermark = self.watermark_table
+        value = high_water.strftime(HOUR_FORMAT)
+        result = await connection.execute(
+            watermark.update().where(watermark.c.table_name == self.table_name).values(high_water=value)
+        )
+        if result.rowcount == 0:
+            await connection.execute(watermark.insert().values(table_name=self.table_name, high_water=value))
+    
+    async def _initial_start(self, connection, end: datetime) -> datetime:
+        """首次汇总的起点：最早的日志时间，最多回溯 backfill_hours 小时"""
+        earliest = (await connection.execute(
+            select(func.min(self.raw_table.c[self.time_column]))
+        )).scalar()
+        lower_bound = end - timedelta(hours=self.backfill_hours)
+        if earliest is None:
+            return end
+        if isinstance(earliest, str):
+            earliest = datetime.strptime(earliest[:19], TIME_FORMAT)
+        return max(floor_hour(earliest), lower_bound)
+    
+    async def _rollup_range(self, connection, start: datetime, end: datetime) -> None:
+        """重新汇总 [start, end) 区间，先删除旧的汇总行，保证可以重复执行"""
+        params = {
+            "start_hour": start.strftime(HOUR_FORMAT),
+            "end_hour": end.strftime(HOUR_FORMAT),
+            "start_time": start.strftime(TIME_FORMAT),
+            "end_time": end.strftime(TIME_FORMAT),
+            "hour_format": HOUR_FORMAT,
+        }
+        rollup_name = self.rollup_table.name
+        dest_ip_name = self.dest_ip_table.name
+        dimensions = ", ".join(ROLLUP_DIMENSIONS)
+        dest_ip_dimensions = ", ".join(DEST_IP_DIMENSIONS + ("destination_ip",))
+        hour_expression = hour_bucket_expression(self.dialect, self.time_column)
+        
+        for name in (rollup_name, dest_ip_name):
+            await connection.execute(
+                text(f"DELETE FROM {name} WHERE hour_bucket >= :start_hour AND hour_bucket < :end_hour"),
+                params
+            )
+        await connection.execute(
+            text(
+                f"INSERT INTO {rollup_name} (hour_bucket, {dimensions}, event_count) "
+                f"SELECT {hour_expression} AS hour_bucket, {dimensions}, COUNT(*) "
+                f"FROM {self.table_name} "
+                f"WHERE {self.time_column} >= :start_time AND {self.time_column} < :end_time "
+                f"GROUP BY hour_bucket, {dimensions}"
+            ),
+            params
+        )
+        await connection.execute(
+            text(
+                f"INSERT INTO {dest_ip_name} (hour_bucket, {dest_ip_dimensions}) "
+                f"SELECT DISTINCT {hour_expression} AS hour_bucket, {dest_ip_dimensions} "
+                f"FROM {self.table_name} "
+                f"WHERE {self.time_column} >= :start_time AND {self.time_column} < :end_time"
+            ),
+            params
+        )
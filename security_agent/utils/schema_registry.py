@@ -0,0 +1,142 @@
+"""
+数据库表结构注册表
+
+进程内共享的 SQLDatabase 实例和表结构缓存。每个连接字符串只反射一次表结构，
+表信息和列名在有效期内直接从缓存读取，过期或显式刷新时重新反射。
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import MetaData, inspect
+from langchain_community.utilities import SQLDatabase
+
+from security_agent.config import settings
+from security_agent.utils.cache import TTLCache
+from security_agent.utils.engine_registry import EngineRegistry, engine_registry
+
+logger = logging.getLogger(__name__)
+
+class CachedSQLDatabase(SQLDatabase):
+    """缓存表结构信息的 SQLDatabase
+    
+    get_table_info 会执行采样查询，在这里按表名缓存结果；
+    超过 cache_ttl 秒后自动重新反射表结构。
+    """
+    
+    def __init__(self, *args, cache_ttl: Optional[float] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cache_ttl = cache_ttl
+        self._schema_cache = TTLCache(max_size=256, ttl=None)
+        self._reflected_at = time.monotonic()
+        self._refresh_lock = threading.Lock()
+    
+    def get_table_info(self, table_names: Optional[List[str]] = None, **kwargs) -> str:
+        """获取表信息（带缓存）"""
+        self._refresh_if_expired()
+        key = ("table_info", tuple(sorted(table_names)) if table_names else None, tuple(sorted(kwargs.items())))
+        table_info = self._schema_cache.get(key)
+        if table_info is None:
+            table_info = super().get_table_info(table_names, **kwargs)
+            self._schema_cache.set(key, table_info)
+        return table_info
+    
+    def get_usable_column_names(self, table_names: Optional[List[str]] = None) -> List[str]:
+        """获取表的列名列表，顺序与 SELECT * 返回的列一致"""
+        self._refresh_if_expired()
+        table_names = table_names or sorted(self._usable_tables)
+        key = ("columns", tuple(table_names))
+        columns = self._schema_cache.get(key)
+        if columns is None:
+            columns = []
+            for table in self._metadata.sorted_tables:
+                if table.name in table_names:
+                    columns.extend(column.name for column in table.columns)
+            self._schema_cache.set(key, columns)
+        return list(columns)
+    
+    def refresh(self) -> None:
+        """重新反射表结构并清空缓存"""
+        with self._refresh_lock:
+            logger.info("重新反射数据库表结构")
+            self._inspector = inspect(self._engine)
+            self._all_tables = set(
+                list(self._inspector.get_table_names(schema=self._schema))
+                + (self._inspector.get_view_names(schema=self._schema) if self._view_support else [])
+            )
+            usable_tables = self.get_usable_table_names()
+            self._usable_tables = set(usable_tables) if usable_tables else self._all_tables
+            
+            metadata = MetaData()
+            metadata.reflect(
+                views=self._view_support,
+                bind=self._engine,
+                only=list(self._usable_tables),
+                schema=self._schema,
+            )
+            self._metadata = metadata
+            self._schema_cache.clear()
+            self._reflected_at = time.monotonic()
+    
+    def schema_cache_stats(self) -> Dict[str, Any]:
+        """返回表结构缓存统计"""
+        return self._schema_cache.stats()
+    
+    def _refresh_if_expired(self) -> None:
+        if self._cache_ttl is not None and time.monotonic() - self._reflected_at > self._cache_ttl:
+            self.refresh()
+
+class SchemaRegistry:
+    """按连接字符串共享的数据库表结构注册表"""
+    
+    def __init__(self, ttl: Optional[float] = None, engines: Optional[EngineRegistry] = None):
+        """初始化注册表
+        
+        Args:
+            ttl: 表结构缓存有效期（秒），None 表示只在显式刷新时重新反射
+            engines: 数据库引擎注册表，默认使用进程内共享的注册表
+        """
+        self.ttl = ttl
+        self.engines = engines or engine_registry
+        self._databases: Dict[str, CachedSQLDatabase] = {}
+        self._lock = threading.Lock()
+    
+    def get_database(self, db_connection: str) -> CachedSQLDatabase:
+        """获取连接字符串对应的共享 SQLDatabase 实例"""
+        database = self._databases.get(db_connection)
+        if database is not None:
+            return database
+        
+        with self._lock:
+            database = self._databases.get(db_connection)
+            if database is None:
+                logger.info("反射数据库表结构并加入注册表")
+                database = CachedSQLDatabase(self.engines.get_engine(db_connection), cache_ttl=self.ttl)
+                self._databases[db_connection] = database
+            return database
+    
+    def get_table_info(self, db_connection: str, table_names: Optional[List[str]] = None) -> str:
+        """获取表信息"""
+        return self.get_database(db_connection).get_table_info(table_names)
+    
+    def get_column_names(self, db_connection: str, table_name: str) -> List[str]:
+        """获取表的列名列表"""
+        return self.get_database(db_connection).get_usable_column_names([table_name])
+    
+    def refresh(self, db_connection: Optional[str] = None) -> None:
+        """刷新指定连接（默认全部连接）的表结构"""
+        if db_connection is not None:
+            targets = [self._databases[db_connection]] if db_connection in self._databases else []
+        else:
+            targets = list(self._databases.values())
+        for database in targets:
+            database.refresh()
+    
+    def clear(self) -> None:
+        """移除所有已注册的数据库"""
+        with self._lock:
+            self._databases.clear()
+
+# 进程内共享的表结构注册表
+schema_registry = SchemaRegistry(ttl=settings.SCHEMA_CACHE_TTL)
@@ -0,0 +1,69 @@
+"""
+并发请求合并（singleflight）
+
+相同键的请求同时到达时只执行一次，其余请求等待同一个结果。
+计算在独立的任务中运行，某个调用方被取消（如客户端断开）不会影响其他等待的调用方；
+所有调用方都取消后计算也随之取消。
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """按键合并进行中的异步调用"""
+    
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.executed = 0
+        self.shared = 0
+    
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 func，相同 key 的调用正在进行时等待其结果
+        
+        Args:
+            key: 合并键
+            func: 返回协程的函数，只有没有进行中的调用时才会被调用
+        
+        Returns:
+            func 的结果，异常同样传递给所有等待的调用方
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+            logger.info(f"合并进行中的请求: {key}")
+        
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._calls.get(key) is task and self._waiters[key] == 1:
+                task.cancel()
+            raise
+        finally:
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+    
+    def in_flight(self) -> int:
+        """进行中的调用数"""
+        return len(self._calls)
+    
+    def stats(self) -> Dict[str, int]:
+        """返回执行次数和合并次数"""
+        return {"in_flight": len(self._calls), "executed": self.executed, "shared": self.shared}
+    
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        """调用完成后移除，之后的请求重新执行"""
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            self._waiters.pop(key, None)
+        # 所有调用方都已取消时，避免未读取的异常产生警告
+        if not task.cancelled():
+            task.exception()
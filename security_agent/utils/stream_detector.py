@@ -0,0 +1,392 @@
+"""
+流式检测引擎
+
+按时间顺序逐条处理 SecurityLog 结构的事件，为每个源IP、用户和目标IP维护滑动窗口内的状态，
+实时发出端口扫描、SSH暴力破解和数据外泄告警。每条事件的处理是均摊 O(1) 的：
+窗口只在尾部追加、从头部过期；空闲的键按最后活跃时间从有序字典头部淘汰，
+内存只与活跃的键数量相关。规则与 anomaly_detector 的批量检测保持一致。
+"""
+import logging
+import math
+import re
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from security_agent.chains.sql_templates import LOGIN_FAILURE_EVENT_TYPES
+from security_agent.utils.anomaly_detector import (
+    FAILURE_STATUSES, LOGIN_EVENT_PATTERN, PRIVILEGED_USERS, SSH_PORT
+)
+
+logger = logging.getLogger(__name__)
+
+_LOGIN_RE = re.compile(LOGIN_EVENT_PATTERN, re.IGNORECASE)
+
+class Alert(NamedTuple):
+    """流式告警"""
+    rule: str
+    risk_type: str
+    risk_level: str
+    key_type: str
+    key: str
+    timestamp: datetime
+    evidence: Dict[str, Any]
+    description: str
+
+class _Window:
+    """单个键的滑动窗口：条目按时间追加，记录各取值的次数和权重之和"""
+    __slots__ = ("entries", "counts", "total", "last_seen", "last_alert")
+    
+    def __init__(self):
+        self.entries: Deque[Tuple[float, Any, float]] = deque()
+        self.counts: Dict[Any, int] = {}
+        self.total = 0.0
+        self.last_seen = 0.0
+        self.last_alert: Optional[float] = None
+    
+    def add(self, ts: float, item: Any, weight: float, max_entries: int) -> None:
+        self.entries.append((ts, item, weight))
+        self.counts[item] = self.counts.get(item, 0) + 1
+        self.total += weight
+        if len(self.entries) > max_entries:
+            self._pop()
+    
+    def expire(self, cutoff: float) -> None:
+        """移除时间不晚于 cutoff 的条目"""
+        while self.entries and self.entries[0][0] <= cutoff:
+            self._pop()
+    
+    def _pop(self) -> None:
+        _, item, weight = self.entries.popleft()
+        count = self.counts[item] - 1
+        if count:
+            self.counts[item] = count
+        else:
+            del self.counts[item]
+        self.total -= weight
+
+class _KeyedWindows:
+    """按键保存的滑动窗口，按最后活跃时间排序，淘汰空闲的键"""
+    
+    def __init__(self, idle_seconds: float, max_keys: int):
+        self.idle_seconds = idle_seconds
+        self.max_keys = max_keys
+        self._windows: "OrderedDict[str, _Window]" = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._windows)
+    
+    def touch(self, key: str, now: float) -> _Window:
+        """获取键的窗口并标记为最近活跃"""
+        window = self._windows.get(key)
+        if window is None:
+            window = _Window()
+            self._windows[key] = window
+        else:
+            self._windows.move_to_end(key)
+        window.last_seen = now
+        return window
+    
+    def evict(self, now: float) -> int:
+        """淘汰空闲超时的键，以及超出 max_keys 的最久未活跃的键"""
+        evicted = 0
+        cutoff = now - self.idle_seconds
+        while self._windows:
+            key, window = next(iter(self._windows.items()))
+            if window.last_seen > cutoff and len(self._windows) <= self.max_keys:
+                break
+            del self._windows[key]
+            evicted += 1
+        return evicted
+
+class _RunningStats:
+    """Welford 算法维护的均值和方差"""
+    __slots__ = ("count", "mean", "m2")
+    
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+    
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+    
+    def zscore(self, value: float) -> Optional[float]:
+        if self.count < 2:
+            return None
+        std = math.sqrt(self.m2 / self.count)
+        if not std:
+            return None
+        return (value - self.mean) / std
+
+def _field(event: Any, name: str) -> Any:
+    """读取事件字段，支持字典和 SecurityLog 对象"""
+    if isinstance(event, dict):
+        return event.get(name)
+    return getattr(event, name, None)
+
+def _to_datetime(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return None
+
+def _to_number(value: Any) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+class StreamDetector:
+    """滑动窗口流式检测引擎"""
+    
+    def __init__(
+        self,
+        window_seconds: float = 3600,
+        idle_seconds: Optional[float] = None,
+        max_keys: int = 100000,
+        max_entries_per_key: int = 10000,
+        port_scan_min_ports: int = 4,
+        port_scan_min_events: int = 6,
+        brute_force_min_failures: int = 10,
+        brute_force_min_ratio: float = 0.5,
+        exfil_bytes_zscore: float = 3.0,
+        exfil_min_bytes: int = 100000,
+        exfil_min_baseline: int = 30,
+        max_recent_alerts: int = 1000
+    ):
+        """初始化流式检测引擎
+        
+        Args:
+            window_seconds: 滑动窗口长度（秒），同一个键的同一条规则在一个窗口内只告警一次
+            idle_seconds: 键空闲多久后淘汰，默认等于窗口长度
+            max_keys: 每类键最多保留的数量，超出时淘汰最久未活跃的键
+            max_entries_per_key: 每个键的窗口最多保留的条目数
+            port_scan_min_ports: 端口扫描在窗口内最少访问的不同目标端口数
+            port_scan_min_events: 端口扫描在窗口内最少的事件数（不含登录失败）
+            brute_force_min_failures: 暴力破解在窗口内最少的SSH登录失败次数
+            brute_force_min_ratio: 暴力破解最小失败比例
+            exfil_bytes_zscore: 单次传输 bytes_sent 相对全局基线的最小 z 分数
+            exfil_min_bytes: 数据外泄在窗口内异常传输的最小总字节数
+            exfil_min_baseline: 开始判断异常传输前需要的基线样本数
+            max_recent_alerts: 保留的最近告警条数
+        """
+        self.window_seconds = window_seconds
+        self.idle_seconds = idle_seconds if idle_seconds is not None else window_seconds
+        self.max_entries_per_key = max_entries_per_key
+        self.port_scan_min_ports = port_scan_min_ports
+        self.port_scan_min_events = port_scan_min_events
+        self.brute_force_min_failures = brute_force_min_failures
+        self.brute_force_min_ratio = brute_force_min_ratio
+        self.exfil_bytes_zscore = exfil_bytes_zscore
+        self.exfil_min_bytes = exfil_min_bytes
+        self.exfil_min_baseline = exfil_min_baseline
+        
+        # 端口扫描按源IP，暴力破解按源IP和用户，数据外泄按目标IP
+        self._scans = _KeyedWindows(self.idle_seconds, max_keys)
+        self._logins_by_source = _KeyedWindows(self.idle_seconds, max_keys)
+        self._logins_by_user = _KeyedWindows(self.idle_seconds, max_keys)
+        self._transfers = _KeyedWindows(self.idle_seconds, max_keys)
+        self._bytes_baseline = _RunningStats()
+        
+        self.recent_alerts: Deque[Alert] = deque(maxlen=max_recent_alerts)
+        self.watermark: Optional[float] = None
+        self.events_processed = 0
+        self.events_dropped = 0
+        self.alerts_emitted = 0
+        self.keys_evicted = 0
+    
+    def process(self, event: Any) -> List[Alert]:
+        """处理一条事件
+        
+        Args:
+            event: SecurityLog 对象或同结构的字典，timestamp 可以是 datetime 或 ISO 格式字符串
+        
+        Returns:
+            本条事件触发的告警
+        """
+        timestamp = _to_datetime(_field(event, "timestamp"))
+        if timestamp is None:
+            self.events_dropped += 1
+            return []
+        
+        ts = timestamp.timestamp()
+        if self.watermark is not None and ts <= self.watermark - self.window_seconds:
+            # 迟到超过一个窗口的事件已经无法计入窗口
+            self.events_dropped += 1
+            return []
+        now = ts if self.watermark is None else max(self.watermark, ts)
+        self.watermark = now
+        self.events_processed += 1
+        
+        source_ip = _field(event, "source_ip")
+        event_type = _field(event, "event_type")
+        port = _to_number(_field(event, "destination_port"))
+        protocol = _field(event, "protocol")
+        status = _field(event, "status")
+        
+        is_login = event_type is None or bool(_LOGIN_RE.search(str(event_type)))
+        login_failure = event_type in LOGIN_FAILURE_EVENT_TYPES
+        failed = login_failure or (is_login and status in FAILURE_STATUSES)
+        ssh = str(protocol).upper() == "SSH" or port == SSH_PORT
+        
+        alerts = []
+        cutoff = now - self.window_seconds
+        if source_ip and port is not None and not login_failure:
+            alerts.extend(self._check_port_scan(str(source_ip), int(port), ts, now, cutoff, timestamp))
+        if ssh and is_login:
+            alerts.extend(self._check_brute_force(event, source_ip, failed, ts, now, cutoff, timestamp))
+        bytes_sent = _to_number(_field(event, "bytes_sent"))
+        if bytes_sent is not None:
+            alerts.extend(self._check_exfiltration(event, source_ip, bytes_sent, ts, now, cutoff, timestamp))
+        
+        for keyed in (self._scans, self._logins_by_source, self._logins_by_user, self._transfers):
+            self.keys_evicted += keyed.evict(now)
+        
+        self.alerts_emitted += len(alerts)
+        for alert in alerts:
+            self.recent_alerts.append(alert)
+            logger.warning(f"流式检测告警: {alert.description}")
+        return alerts
+    
+    def process_many(self, events: Iterable[Any]) -> List[Alert]:
+        """按顺序处理多条事件，返回所有告警"""
+        alerts = []
+        for event in events:
+            alerts.extend(self.process(event))
+        return alerts
+    
+    def stats(self) -> Dict[str, Any]:
+        """引擎运行统计"""
+        return {
+            "events_processed": self.events_processed,
+            "events_dropped": self.events_dropped,
+            "alerts_emitted": self.alerts_emitted,
+            "keys_evicted": self.keys_evicted,
+            "active_keys": {
+                "source_ip": len(self._scans),
+                "login_source_ip": len(self._logins_by_source),
+                "user_id": len(self._logins_by_user),
+                "destination_ip": len(self._transfers),
+            },
+            "watermark": datetime.fromtimestamp(self.watermark).isoformat() if self.watermark is not None else None,
+        }
+    
+    def _should_alert(self, window: _Window, ts: float) -> bool:
+        if window.last_alert is not None and ts - window.last_alert < self.window_seconds:
+            return False
+        window.last_alert = ts
+        return True
+    
+    def _check_port_scan(self, source_ip, port, ts, now, cutoff, timestamp) -> List[Alert]:
+        window = self._scans.touch(source_ip, now)
+        window.expire(cutoff)
+        window.add(ts, port, 1, self.max_entries_per_key)
+        events = len(window.entries)
+        distinct_ports = len(window.counts)
+        if distinct_ports < self.port_scan_min_ports or events < self.port_scan_min_events:
+            return []
+        if not self._should_alert(window, ts):
+            return []
+        return [Alert(
+            rule="port_scan",
+            risk_type="端口扫描",
+            risk_level="中",
+            key_type="source_ip",
+            key=source_ip,
+            timestamp=timestamp,
+            evidence={"events": events, "distinct_ports": distinct_ports, "ports": sorted(window.counts)[:20]},
+            description=(
+                f"源IP {source_ip} 在 {int(self.window_seconds)} 秒内访问了 {distinct_ports} 个不同的目标端口"
+                f"（{events} 条事件），疑似端口扫描"
+            ),
+        )]
+    
+    def _check_brute_force(self, event, source_ip, failed, ts, now, cutoff, timestamp) -> List[Alert]:
+        user_id = _field(event, "user_id")
+        alerts = []
+        keys = (
+            ("source_ip", source_ip, user_id, self._logins_by_source),
+            ("user_id", user_id, source_ip, self._logins_by_user),
+        )
+        for key_type, key, counterpart, keyed in keys:
+            if not key:
+                continue
+            window = keyed.touch(str(key), now)
+            window.expire(cutoff)
+            window.add(ts, counterpart, 1 if failed else 0, self.max_entries_per_key)
+            attempts = len(window.entries)
+            failures = int(window.total)
+            if failures < self.brute_force_min_failures or failures / attempts < self.brute_force_min_ratio:
+                continue
+            if not self._should_alert(window, ts):
+                continue
+            
+            counterparts = sorted(str(item) for item in window.counts if item)
+            if key_type == "source_ip":
+                privileged = any(item in PRIVILEGED_USERS for item in counterparts)
+                evidence = {"attempts": attempts, "failures": failures, "target_users": counterparts[:10]}
+                description = f"源IP {key} 在 {int(self.window_seconds)} 秒内SSH登录失败 {failures} 次，疑似暴力破解"
+            else:
+                privileged = key in PRIVILEGED_USERS
+                evidence = {"attempts": attempts, "failures": failures, "source_ips": counterparts[:10]}
+                description = (
+                    f"账号 {key} 在 {int(self.window_seconds)} 秒内被 {len(counterparts)} 个源IP "
+                    f"SSH登录失败 {failures} 次，疑似暴力破解"
+                )
+            alerts.append(Alert(
+                rule="ssh_brute_force",
+                risk_type="SSH暴力破解",
+                risk_level="高" if privileged else "中",
+                key_type=key_type,
+                key=str(key),
+                timestamp=timestamp,
+                evidence=evidence,
+                description=description,
+            ))
+        return alerts
+    
+    def _check_exfiltration(self, event, source_ip, bytes_sent, ts, now, cutoff, timestamp) -> List[Alert]:
+        baseline = self._bytes_baseline
+        zscore = baseline.zscore(bytes_sent) if baseline.count >= self.exfil_min_baseline else None
+        if zscore is None or zscore < self.exfil_bytes_zscore:
+            # 异常传输不计入基线，避免抬高均值
+            baseline.add(bytes_sent)
+            return []
+        
+        destination_ip = _field(event, "destination_ip")
+        if not destination_ip:
+            return []
+        window = self._transfers.touch(str(destination_ip), now)
+        window.expire(cutoff)
+        window.add(ts, source_ip, bytes_sent, self.max_entries_per_key)
+        if window.total < self.exfil_min_bytes or not self._should_alert(window, ts):
+            return []
+        
+        sources = sorted(str(item) for item in window.counts if item)
+        return [Alert(
+            rule="data_exfiltration",
+            risk_type="数据外泄",
+            risk_level="高",
+            key_type="destination_ip",
+            key=str(destination_ip),
+            timestamp=timestamp,
+            evidence={
+                "transfers": len(window.entries),
+                "total_bytes": int(window.total),
+                "max_bytes_zscore": round(zscore, 2),
+                "source_ips": sources[:10],
+            },
+            description=(
+                f"{int(self.window_seconds)} 秒内有 {len(window.entries)} 次异常大流量传输发往 {destination_ip}，"
+                f"共 {int(window.total)} 字节，来源 {'、'.join(sources[:3])}，疑似数据外泄"
+            ),
+        )]
@@ -0,0 +1,403 @@
+"""
+基于规则的时间表达式解析
+
+在调用LLM之前，先用确定性的规则解析常见的中英文时间描述，例如
+"前8小时"、"昨天下午"、"上周五到本周一"、"今天早上8点到现在"、"last 24 hours"。
+无法识别的描述返回 None，由调用方回退到LLM解析。
+"""
+import re
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Tuple, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 中文数字
+_CN_DIGITS = {"零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_NUMBER = r"\d+(?:\.\d+)?|[零一二两三四五六七八九十百半]+"
+
+# 时长单位（秒数，月单独处理）
+_DURATION_UNITS = {
+    "分钟": 60, "分": 60, "minute": 60, "min": 60,
+    "小时": 3600, "个小时": 3600, "钟头": 3600, "个钟头": 3600, "hour": 3600, "h": 3600,
+    "天": 86400, "日": 86400, "day": 86400,
+    "周": 604800, "个星期": 604800, "星期": 604800, "礼拜": 604800, "week": 604800,
+    "个月": -1, "月": -1, "month": -1,
+}
+_UNIT_PATTERN = "|".join(sorted((re.escape(u) for u in _DURATION_UNITS), key=len, reverse=True))
+
+# "前8小时"、"过去24小时"、"最近一周"、"last 8 hours"
+_RELATIVE_RE = re.compile(
+    rf"(?:前|过去|最近|近|last|past)\s*的?\s*(?P<num>{_NUMBER})\s*(?P<unit>{_UNIT_PATTERN})s?(?![a-z])"
+)
+# "24小时内"、"一天以内"
+_WITHIN_RE = re.compile(
+    rf"(?P<num>{_NUMBER})\s*(?P<unit>{_UNIT_PATTERN})s?\s*(?:内|以内|之内)"
+)
+# "past hour"、"last hour"、"past day"
+_SINGLE_UNIT_RE = re.compile(r"(?:past|last)\s+(?P<unit>hour|day|24h)(?![a-z])")
+# "2024年"，与相对时长同时出现时相对时长不一定以当前时间为终点
+_YEAR_RE = re.compile(r"(?<!\d)(?P<year>\d{4})\s*年")
+
+# 一天中的时段（起始小时，结束小时）
+_DAY_PERIODS = {
+    "凌晨": (0, 6), "早上": (6, 12), "早晨": (6, 12), "上午": (6, 12), "中午": (11, 13),
+    "下午": (12, 18), "傍晚": (17, 19), "晚上": (18, 24), "夜里": (18, 24), "夜间": (18, 24),
+    "morning": (6, 12), "afternoon": (12, 18), "evening": (18, 24),
+}
+_PM_PERIODS = {"中午", "下午", "傍晚", "晚上", "夜里", "夜间", "afternoon", "evening"}
+# 这些时段中的"12点"指当天结束时的午夜（次日0点）
+_NIGHT_PERIODS = {"晚上", "夜里", "夜间", "evening"}
+
+_RELATIVE_DAYS = {"今天": 0, "今日": 0, "today": 0, "昨天": 1, "昨日": 1, "yesterday": 1, "前天": 2, "大前天": 3}
+_WEEKDAYS = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "七": 6, "日": 6, "天": 6,
+             "1": 0, "2": 1, "3": 2, "4": 3, "5": 4, "6": 5, "7": 6}
+
+_MOMENT_RE = re.compile(
+    r"(?:"
+    r"(?P<date>(?:(?<!\d)(?P<year>\d{4})\s*[-/.年]\s*)?(?P<month>\d{1,2})\s*(?(year)[-/.月]|月)\s*(?P<day>\d{1,2})(?!\d)\s*[日号]?"
+    # 没有年份的"3-1"、"3/1"、"3.1"前后不能紧挨字母、数字或小数点（"从"、"到"等连接词除外），
+    # 避免把"v1.2"、"事件1-2"当作日期
+    r"|(?:(?<![\w.])|(?<=[从自到至]))(?P<short_month>\d{1,2})\s*[-/.]\s*(?P<short_day>\d{1,2})(?![a-z\d.])\s*[日号]?)"
+    r"|(?P<relday>大前天|前天|昨天|昨日(?!志)|今天|今日(?!志)|yesterday|today)"
+    r"|(?P<week>(?P<week_rel>上上|上|本|这个?|this|last)\s*(?:周|星期|礼拜|week)(?!期|末)(?P<weekday>[一二三四五六七1-7]|[日天](?!志))?"
+    r"|(?:周|星期|礼拜)(?P<bare_weekday>[一二三四五六七1-7]|[日天](?!志)))"
+    r"|(?P<monthrel>(?P<month_rel>上上个?|上个?|本|这个?|this|last)\s*(?:月|month)(?P<month_edge>初|底|末)?)"
+    r"|(?P<now>现在|此刻|目前|当前|now)"
+    r")?"
+    r"\s*(?P<period>凌晨|早上|早晨|上午|中午|下午|傍晚|晚上|夜里|夜间|morning|afternoon|evening)?"
+    r"\s*(?P<clock>(?P<hour>\d{1,2}|[零一二两三四五六七八九十]+)\s*(?:点|时(?!间)|:|：)\s*"
+    r"(?:(?P<minute>\d{1,2}|[零一二三四五六七八九十]+|半)\s*分?(?:\s*[:：]\s*(?P<second>\d{1,2}))?)?)?"
+)
+
+_CONNECTOR_RE = re.compile(r"^\s*(?:到|至|~|～|—|－|-|until|to)\s*$")
+_SINCE_RE = re.compile(r"^\s*(?:以来|之后|以后)")
+
+
+class _Moment(NamedTuple):
+    """一个解析出的时间片段"""
+    start: datetime
+    end: datetime
+    is_point: bool
+    day: Optional[datetime]
+    text: str
+    span: Tuple[int, int]
+
+
+def _cn_to_number(text: str) -> Optional[float]:
+    """将阿拉伯数字或中文数字转换为数值"""
+    if not text:
+        return None
+    if re.fullmatch(r"\d+(?:\.\d+)?", text):
+        return float(text)
+    if text == "半":
+        return 0.5
+    if text.endswith("半"):
+        base = _cn_to_number(text[:-1])
+        return base + 0.5 if base is not None else None
+
+    total = 0
+    current = 0
+    for char in text:
+        if char in _CN_DIGITS:
+            current = _CN_DIGITS[char]
+        elif char == "十":
+            total += (current or 1) * 10
+            current = 0
+        elif char == "百":
+            total += (current or 1) * 100
+            current = 0
+        else:
+            return None
+    return float(total + current)
+
+
+def _normalize(query: str) -> str:
+    """统一全角字符、大小写和常见缩写"""
+    text = query.translate(str.maketrans("０１２３４５６７８９：", "0123456789:")).lower()
+    text = text.replace("今晚", "今天晚上").replace("昨晚", "昨天晚上").replace("今早", "今天早上")
+    text = re.sub(r"(至|到|迄)今(?!天|日)", r"\1现在", text)
+    return text
+
+
+def _subtract_months(moment: datetime, months: int) -> datetime:
+    """按日历减去若干个月"""
+    month_index = moment.year * 12 + moment.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    next_month = datetime(year + (month // 12), month % 12 + 1, 1)
+    last_day = (next_month - timedelta(days=1)).day
+    return moment.replace(year=year, month=month, day=min(moment.day, last_day))
+
+
+def _parse_relative(text: str, now: datetime) -> Optional[Tuple[datetime, str]]:
+    """解析"前N小时"一类的相对时长，返回起始时间和原始描述"""
+    match = _RELATIVE_RE.search(text) or _WITHIN_RE.search(text)
+    if match:
+        amount = _cn_to_number(match.group("num"))
+        unit = match.group("unit")
+    else:
+        match = _SINGLE_UNIT_RE.search(text)
+        if not match:
+            return None
+        amount = 24 if match.group("unit") == "24h" else 1
+        unit = "hour" if match.group("unit") == "24h" else match.group("unit")
+
+    if not amount or amount <= 0:
+        return None
+
+    seconds = _DURATION_UNITS[unit]
+    if seconds < 0:
+        if amount != int(amount):
+            return None
+        start = _subtract_months(now, int(amount))
+    else:
+        start = now - timedelta(seconds=amount * seconds)
+    return start, match.group(0).strip()
+
+
+def _start_of_day(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _resolve_day(match, now: datetime) -> Optional[Tuple[datetime, datetime]]:
+    """解析日期部分，返回该部分覆盖的区间 [start, end)"""
+    today = _start_of_day(now)
+
+    if match.group("date"):
+        year = int(match.group("year")) if match.group("year") else now.year
+        month = match.group("month") or match.group("short_month")
+        day_of_month = match.group("day") or match.group("short_day")
+        try:
+            day = datetime(year, int(month), int(day_of_month))
+        except ValueError:
+            return None
+        return day, day + timedelta(days=1)
+
+    if match.group("relday"):
+        day = today - timedelta(days=_RELATIVE_DAYS[match.group("relday")])
+        return day, day + timedelta(days=1)
+
+    if match.group("week"):
+        this_monday = today - timedelta(days=today.weekday())
+        week_rel = match.group("week_rel")
+        weekday = match.group("weekday") or match.group("bare_weekday")
+        if week_rel is None:
+            # 单独的"周五"：取最近一个已经到来的周五
+            day = this_monday + timedelta(days=_WEEKDAYS[weekday])
+            if day > today:
+                day -= timedelta(days=7)
+            return day, day + timedelta(days=1)
+        weeks_back = {"上上": 2, "上": 1, "last": 1}.get(week_rel, 0)
+        monday = this_monday - timedelta(weeks=weeks_back)
+        if weekday:
+            day = monday + timedelta(days=_WEEKDAYS[weekday])
+            return day, day + timedelta(days=1)
+        return monday, monday + timedelta(days=7)
+
+    if match.group("monthrel"):
+        month_rel = match.group("month_rel")
+        months_back = 2 if month_rel.startswith("上上") else (1 if month_rel.startswith("上") or month_rel == "last" else 0)
+        first = _subtract_months(today.replace(day=1), months_back)
+        next_first = _subtract_months(first, -1)
+        edge = match.group("month_edge")
+        if edge == "初":
+            return first, first + timedelta(days=1)
+        if edge in ("底", "末"):
+            return next_first - timedelta(days=1), next_first
+        return first, next_first
+
+    return None
+
+
+def _resolve_moment(
+    match,
+    now: datetime,
+    base_day: Optional[datetime] = None,
+    base_period: Optional[str] = None
+) -> Optional[_Moment]:
+    """将一个匹配结果解析为时间区间
+
+    base_day 和 base_period 用于范围的后半部分继承前半部分的日期和时段，
+    例如"昨天下午3点到5点"中的"5点"。
+    """
+    text = match.group(0).strip()
+    span = match.span()
+
+    if match.group("now"):
+        if match.group("period") or match.group("clock"):
+            return None
+        return _Moment(now, now, True, None, text, span)
+
+    day_range = _resolve_day(match, now)
+    period = match.group("period") or (base_period if day_range is None else None)
+    clock = match.group("clock")
+
+    if day_range is None:
+        if not period and not clock:
+            return None
+        day = base_day or _start_of_day(now)
+        day_range = (day, day + timedelta(days=1))
+        explicit_day = None
+    else:
+        explicit_day = day_range[0]
+
+    start, end = day_range
+    if (period or clock) and end - start > timedelta(days=1):
+        # "本周下午3点"之类的组合没有明确含义
+        return None
+
+    if clock:
+        hour = _cn_to_number(match.group("hour"))
+        minute_text = match.group("minute")
+        minute = 30 if minute_text == "半" else (_cn_to_number(minute_text) if minute_text else 0)
+        second = int(match.group("second")) if match.group("second") else 0
+        if hour is None or minute is None:
+            return None
+        hour, minute = int(hour), int(minute)
+        if period in _PM_PERIODS and hour < 12:
+            hour += 12
+        elif period in _NIGHT_PERIODS and hour == 12:
+            hour = 24
+        if hour > 24 or minute > 59 or second > 59:
+            return None
+        point = start + timedelta(hours=hour, minutes=minute, seconds=second)
+        return _Moment(point, point + timedelta(hours=1), True, explicit_day, text, span)
+
+    if period:
+        period_start, period_end = _DAY_PERIODS[period]
+        return _Moment(
+            start + timedelta(hours=period_start),
+            start + timedelta(hours=period_end),
+            False,
+            explicit_day,
+            text,
+            span,
+        )
+
+    return _Moment(start, end, False, explicit_day, text, span)
+
+
+def _find_moments(text: str):
+    """扫描文本中的所有非空时间片段"""
+    return [match for match in _MOMENT_RE.finditer(text) if match.group(0).strip()]
+
+
+def _build_result(
+    start: datetime,
+    end: datetime,
+    description: str,
+    now: datetime,
+    relative: bool = False
+) -> Optional[Dict[str, Any]]:
+    """构建与LLM输出格式一致的结果
+
+    relative 表示起始时间相对于当前时间（如"前8小时"），当前时间变化时整个范围随之平移；
+    否则起始时间是固定的日历时刻（如"今天"、"本周"）。
+    """
+    end = min(end, now)
+    if start >= end:
+        return None
+    start_text = start.strftime(TIME_FORMAT)
+    end_text = end.strftime(TIME_FORMAT)
+    return {
+        "start_time": start_text,
+        "end_time": end_text,
+        "description": description,
+        "formatted_range": f"{start_text} 至 {end_text}",
+        "parser": "rule",
+        "relative": relative,
+    }
+
+
+def parse_time_expression(query: str, now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """使用规则解析查询中的时间范围
+
+    Args:
+        query: 用户查询
+        now: 当前时间，默认为 datetime.now()
+
+    Returns:
+        包含 start_time、end_time、description、formatted_range 的字典；
+        无法确定时间范围时返回 None
+    """
+    now = (now or datetime.now()).replace(microsecond=0)
+    text = _normalize(query)
+
+    relative = _parse_relative(text, now)
+    if relative:
+        year = _YEAR_RE.search(text)
+        if year and int(year.group("year")) != now.year:
+            # "2024年最近3天"：相对时长属于其他年份，无法按当前时间确定
+            return None
+        start, description = relative
+        return _build_result(start, now, description, now, relative=True)
+
+    matches = _find_moments(text)
+    if not matches:
+        return None
+
+    first = _resolve_moment(matches[0], now)
+    if first is None:
+        return None
+
+    if len(matches) >= 2:
+        between = text[matches[0].end():matches[1].start()]
+        if not _CONNECTOR_RE.match(between):
+            return None
+        second = _resolve_moment(
+            matches[1],
+            now,
+            base_day=first.day or _start_of_day(first.start),
+            base_period=matches[0].group("period")
+        )
+        if second is None:
+            return None
+        end = second.start if second.is_point else second.end - timedelta(seconds=1)
+        description = text[matches[0].start():matches[1].end()].strip()
+        return _build_result(first.start, end, description, now)
+
+    if first.start == now:
+        # 只有"现在"，没有实际范围
+        return None
+
+    if _SINCE_RE.match(text[matches[0].end():]):
+        return _build_result(first.start, now, first.text + "以来", now)
+
+    return _build_result(first.start, first.end - timedelta(seconds=1), first.text, now)
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询文本，用作缓存键"""
+    text = _normalize(query).strip()
+    text = re.sub(r"\s+", " ", text)
+    return text.rstrip("?？。.!！ ")
+
+
+def has_relative_start(time_range: Dict[str, Any], anchor: datetime) -> bool:
+    """判断时间范围的起始时间是否相对于解析时刻 anchor
+
+    规则解析的结果直接带有 relative 字段；LLM的结果没有解析方式，按起始时间推断：
+    与 anchor 的分、秒相同且不在零点的视为相对时长（如"前8小时"），否则视为固定的日历时刻（如"本季度"）。
+    """
+    if "relative" in time_range:
+        return bool(time_range["relative"])
+    try:
+        start = datetime.strptime(time_range["start_time"], TIME_FORMAT)
+    except (KeyError, TypeError, ValueError):
+        return False
+    at_midnight = (start.hour, start.minute, start.second) == (0, 0, 0)
+    return not at_midnight and (start.minute, start.second) == (anchor.minute, anchor.second)
+
+
+def shift_time_range(time_range: Dict[str, Any], delta: timedelta) -> Dict[str, Any]:
+    """将时间范围整体平移 delta，返回新的字典"""
+    start = datetime.strptime(time_range["start_time"], TIME_FORMAT) + delta
+    end = datetime.strptime(time_range["end_time"], TIME_FORMAT) + delta
+    shifted = dict(time_range)
+    shifted["start_time"] = start.strftime(TIME_FORMAT)
+    shifted["end_time"] = end.strftime(TIME_FORMAT)
+    shifted["formatted_range"] = f"{shifted['start_time']} 至 {shifted['end_time']}"
+    return shifted
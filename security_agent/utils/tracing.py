@@ -0,0 +1,378 @@
+"""
+请求级链路追踪
+
+每个请求对应一个 trace，请求中的各个阶段、LLM调用和数据库查询记录为带父子关系的 span。
+当前 span 保存在 contextvars 中，随 asyncio 任务和 asyncio.to_thread 自动传递，
+不在请求中执行的代码（如后台任务）不产生 span。trace id 来自请求头或新生成，
+写入每条日志记录的 trace_id 属性，响应体（包括流式响应）发送完毕后整个 trace 由后台线程写入本地JSONL文件，
+并在内存中保留最近的 trace 用于查询最慢的请求。
+"""
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from starlette.datastructures import MutableHeaders
+
+from security_agent.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 请求头中可接受的 trace id，避免把任意内容写入日志
+TRACE_ID_PATTERN = re.compile(r"^[0-9A-Za-z_-]{1,64}$")
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+class Span:
+    """trace 中的一个阶段"""
+    
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes)
+        self.start_time = time.time()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+    
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+    
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+    
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """结束 span，error 为结束时的异常"""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_offset": round(self.start_time - self.trace.start_time, 6),
+            "duration": round(self.duration, 6) if self.duration is not None else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+class Trace:
+    """一个请求的所有 span，第一个 span 为根"""
+    
+    def __init__(self, trace_id: str, max_spans: int):
+        self.trace_id = trace_id
+        self.max_spans = max_spans
+        self.start_time = time.time()
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+    
+    def add(self, span: Span) -> bool:
+        """添加 span，超过上限时丢弃并返回 False"""
+        with self._lock:
+            if len(self.spans) >= self.max_spans:
+                self.dropped += 1
+                return False
+            self.spans.append(span)
+            return True
+    
+    @property
+    def root(self) -> Span:
+        return self.spans[0]
+    
+    @property
+    def duration(self) -> float:
+        return self.root.duration or 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "start_time": datetime.fromtimestamp(self.start_time).isoformat(),
+            "duration": round(self.duration, 6),
+            "attributes": self.root.attributes,
+            "error": self.root.error,
+            "dropped_spans": self.dropped,
+            "spans": [span.to_dict() for span in spans],
+        }
+
+class JSONLExporter:
+    """将结束的 trace 逐行追加到JSONL文件，超过 max_bytes 时轮转为 .1 文件
+    
+    trace 在请求结束时导出，写文件放在后台线程中，export 只把 trace 放入有界队列，不阻塞事件循环；
+    队列已满时丢弃 trace。
+    """
+    
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, max_pending: int = 10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+    
+    def export(self, trace: Dict[str, Any]) -> None:
+        """把 trace 放入写入队列"""
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            logger.warning(f"trace 写入队列已满，丢弃 trace {trace.get('trace_id')}")
+    
+    def flush(self) -> None:
+        """等待队列中的 trace 全部写入文件"""
+        self._queue.join()
+    
+    def _ensure_writer(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+    
+    def _run(self) -> None:
+        while True:
+            trace = self._queue.get()
+            try:
+                self._write(trace)
+            except Exception as e:
+                logger.warning(f"写入trace失败: {e}")
+            finally:
+                self._queue.task_done()
+    
+    def _write(self, trace: Dict[str, Any]) -> None:
+        line = json.dumps(trace, ensure_ascii=False, default=str)
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            os.replace(self.path, f"{self.path}.1")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+class Tracer:
+    """创建 trace 和 span，保留最近的 trace"""
+    
+    def __init__(self, exporter: Optional[JSONLExporter] = None, recent_size: int = 1000, max_spans: int = 500,
+                 enabled: bool = True):
+        """初始化追踪器
+        
+        Args:
+            exporter: 结束的 trace 的导出器，None 表示只保留在内存中
+            recent_size: 内存中保留的最近 trace 数
+            max_spans: 每个 trace 最多记录的 span 数
+            enabled: 是否启用追踪，关闭时不创建任何 span
+        """
+        self.exporter = exporter
+        self.max_spans = max_spans
+        self.enabled = enabled
+        self._recent: Deque[Trace] = deque(maxlen=recent_size)
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def start_trace(self, name: str, trace_id: Optional[str] = None, **attributes: Any):
+        """开始一个 trace 并将根 span 设为当前 span，结束后导出
+        
+        Args:
+            name: 根 span 名称，如请求的方法和路径
+            trace_id: 请求头中的 trace id，格式不合法或为空时生成新的
+            attributes: 根 span 的属性
+        """
+        if not self.enabled:
+            yield None
+            return
+        
+        if not trace_id or not TRACE_ID_PATTERN.match(trace_id):
+            trace_id = uuid.uuid4().hex
+        trace = Trace(trace_id, self.max_spans)
+        span = Span(trace, name, None, attributes)
+        trace.add(span)
+        try:
+            with self._activate(span):
+                yield span
+        finally:
+            self._finish_trace(trace)
+    
+    @contextmanager
+    def span(self, name: str, **attributes: Any):
+        """在当前 trace 中创建子 span 并设为当前 span，没有进行中的 trace 时不记录"""
+        span = self.start_span(name, **attributes)
+        if span is None:
+            yield None
+            return
+        with self._activate(span):
+            yield span
+    
+    def start_span(self, name: str, **attributes: Any) -> Optional[Span]:
+        """创建当前 span 的子 span 但不设为当前 span，由调用方调用 finish，用于回调等无法使用 with 的场景"""
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        span = Span(parent.trace, name, parent.span_id, attributes)
+        return span if parent.trace.add(span) else None
+    
+    def slowest(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """最近的 trace 中耗时最长的 limit 个"""
+        with self._lock:
+            traces = list(self._recent)
+        return [trace.to_dict() for trace in sorted(traces, key=lambda trace: trace.duration, reverse=True)[:limit]]
+    
+    def flush(self) -> None:
+        """等待已结束的 trace 全部导出"""
+        if self.exporter is not None:
+            self.exporter.flush()
+    
+    @contextmanager
+    def _activate(self, span: Span):
+        token = _current_span.set(span)
+        try:
+            yield
+        except BaseException as e:
+            span.finish(e)
+            raise
+        finally:
+            span.finish()
+            _current_span.reset(token)
+    
+    def _finish_trace(self, trace: Trace) -> None:
+        with self._lock:
+            self._recent.append(trace)
+        if self.exporter is not None:
+            try:
+                self.exporter.export(trace.to_dict())
+            except Exception as e:
+                logger.warning(f"导出trace失败: {e}")
+
+class TracingMiddleware:
+    """为每个HTTP请求创建 trace 的ASGI中间件
+    
+    使用请求头中的 trace id（没有时生成新的），在响应头中返回。trace 包住整个ASGI调用，
+    流式响应的响应体发送完毕后才结束，响应体生成过程中的 span 也记录在请求的 trace 中。
+    """
+    
+    def __init__(self, app, tracer: Tracer, header: str = "X-Trace-Id", untraced_paths=()):
+        """初始化中间件
+        
+        Args:
+            app: 下游ASGI应用
+            tracer: 追踪器
+            header: 传入和返回 trace id 的请求头
+            untraced_paths: 不记录 trace 的路径
+        """
+        self.app = app
+        self.tracer = tracer
+        self.header = header
+        self.untraced_paths = set(untraced_paths)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.untraced_paths:
+            await self.app(scope, receive, send)
+            return
+        
+        method, path = scope["method"], scope["path"]
+        with self.tracer.start_trace(
+            f"{method} {path}",
+            trace_id=self._request_trace_id(scope),
+            method=method,
+            path=path
+        ) as span:
+            if span is None:
+                await self.app(scope, receive, send)
+                return
+            
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("status_code", message["status"])
+                    MutableHeaders(scope=message)[self.header] = span.trace_id
+                await send(message)
+            
+            await self.app(scope, receive, send_with_trace_id)
+    
+    def _request_trace_id(self, scope) -> Optional[str]:
+        name = self.header.lower().encode("latin-1")
+        for key, value in scope.get("headers", ()):
+            if key == name:
+                return value.decode("latin-1")
+        return None
+
+def current_span() -> Optional[Span]:
+    """当前 span，不在 trace 中时返回 None"""
+    return _current_span.get()
+
+def install_log_record_factory() -> None:
+    """为每条日志记录添加 trace_id 属性（不在 trace 中时为 -），可在日志格式中使用 %(trace_id)s"""
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, "adds_trace_id", False):
+        return
+    
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        span = _current_span.get()
+        record.trace_id = span.trace_id if span is not None else "-"
+        return record
+    
+    record_factory.adds_trace_id = True
+    logging.setLogRecordFactory(record_factory)
+
+class LLMTracingHandler(BaseCallbackHandler):
+    """为每次LLM调用记录一个 span 的回调"""
+    
+    # 需要在调用方的上下文中执行，才能读取当前 span
+    run_inline = True
+    
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._spans: Dict[UUID, Span] = {}
+    
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, kwargs)
+    
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            **kwargs: Any) -> None:
+        self._start(run_id, kwargs)
+    
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        span.set_attribute("prompt_tokens", usage.get("prompt_tokens"))
+        span.set_attribute("completion_tokens", usage.get("completion_tokens"))
+        # 缓存命中时没有 llm_output
+        span.set_attribute("cached", response.llm_output is None)
+        span.finish()
+    
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.finish(error)
+    
+    def _start(self, run_id: UUID, kwargs: Dict[str, Any]) -> None:
+        model = (kwargs.get("invocation_params") or {}).get("model_name")
+        span = tracer.start_span(f"llm.{self.stage}", model=model)
+        if span is not None:
+            self._spans[run_id] = span
+
+# 进程内共享的追踪器
+tracer = Tracer(
+    exporter=JSONLExporter(settings.TRACE_EXPORT_PATH, settings.TRACE_EXPORT_MAX_BYTES) if settings.TRACE_EXPORT_PATH else None,
+    recent_size=settings.TRACE_RECENT_SIZE,
+    max_spans=settings.TRACE_MAX_SPANS,
+    enabled=settings.TRACING_ENABLED
+)